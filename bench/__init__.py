@@ -0,0 +1 @@
+"""Replay benchmarks for the planning pipeline (`python -m bench.run`)."""
@@ -0,0 +1,432 @@
+"""Local stand-ins for Nominatim, Photon, Overpass and OSRM.
+
+One threaded HTTP server answers every upstream under a path prefix
+(/nominatim, /photon, /overpass-a|b|c, /osrm). Each request is answered from
+a recording when one matches, otherwise synthesized deterministically:
+
+  nominatim, photon  gazetteer lookup (exact, case-insensitive) of the
+                     corpus' "geo" hints; unknown queries return no hits
+  overpass           POIs on a fixed 0.01° world grid, seeded per cell and
+                     tag, so overlapping queries see the same places
+                     (`around:` and bounding-box node selectors)
+  osrm               haversine × detour factor at a per-profile speed; route
+                     geometry is densified to ~25 m like `overview=full`
+                     (GeoJSON or polyline/polyline6, per `geometries`), with
+                     per-leg `legs[].distance` following the drawn line
+
+`Faults` injects per-service latency and errors; a service name matches its
+prefix ("overpass" covers every mirror, "overpass-a" only the first).
+Recordings are JSONL ({"key", "status", "body"}); `record=True` proxies
+unmatched requests to the real upstreams and appends them to the file.
+"""
+import re, sys, json, math, time, random, hashlib, argparse, threading, zlib
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote_plus, urlsplit
+
+import requests
+
+from routeforge import polyline
+from routeforge.geo import haversine_km
+
+UPSTREAMS = {
+    "nominatim": "https://nominatim.openstreetmap.org",
+    "photon": "https://photon.komoot.io",
+    "overpass-a": "https://overpass-api.de",
+    "overpass-b": "https://overpass.kumi.systems",
+    "overpass-c": "https://z.overpass-api.de",
+    "osrm": "https://router.project-osrm.org",
+}
+OVERPASS_MIRRORS = ("overpass-a", "overpass-b", "overpass-c")
+
+# synthetic POIs per 0.01° cell (~1 km²) and tag
+POI_DENSITY = {
+    "tourism=attraction": 1.5, "amenity=park": 0.3, "leisure=park": 1.0,
+    "amenity=restaurant": 4.0, "amenity=cafe": 2.0, "amenity=pharmacy": 1.0,
+    "amenity=toilets": 0.5,
+}
+SPEED_KMH = {"driving": 40.0, "walking": 5.0, "cycling": 15.0}
+DETOUR = 1.3
+_CELL = 0.01
+
+_SELECTOR = re.compile(r"(node|way|relation)\(around:([\d.]+),(-?[\d.]+),(-?[\d.]+)\)\[\"?([\w:]+)\"?=\"?([\w:]+)\"?\]")
+_BBOX_SELECTOR = re.compile(r"(node|way|relation)\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)\[\"?([\w:]+)\"?=\"?([\w:]+)\"?\]")
+
+# =========================
+# Faults & recordings
+# =========================
+class Faults:
+    """{service: {"latency_ms", "jitter_ms", "error_rate", "status"}}."""
+    def __init__(self, spec: Optional[Dict[str, Dict[str, float]]] = None, seed: int = 7):
+        self.spec = spec or {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, latency: str = "", errors: str = "", seed: int = 7) -> "Faults":
+        """CLI form: latency "overpass=400+200,osrm=80", errors "overpass-a=0.2"."""
+        spec: Dict[str, Dict[str, float]] = {}
+        for item in filter(None, (latency or "").split(",")):
+            svc, val = item.split("=", 1)
+            base, _, jitter = val.partition("+")
+            spec.setdefault(svc.strip(), {}).update(latency_ms=float(base), jitter_ms=float(jitter or 0))
+        for item in filter(None, (errors or "").split(",")):
+            svc, val = item.split("=", 1)
+            spec.setdefault(svc.strip(), {})["error_rate"] = float(val)
+        return cls(spec, seed)
+
+    def _for(self, service: str) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        for name in sorted(self.spec, key=len):  # generic first, specific overrides
+            if service.startswith(name):
+                out.update(self.spec[name])
+        return out
+
+    def apply(self, service: str) -> Optional[int]:
+        """Sleep the injected latency; returns an error status to send, if any."""
+        f = self._for(service)
+        with self._lock:
+            delay = f.get("latency_ms", 0.0) + self._rng.uniform(0, f.get("jitter_ms", 0.0))
+            fail = self._rng.random() < f.get("error_rate", 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        return int(f.get("status", 503)) if fail else None
+
+class Recording:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            e = json.loads(line)
+                            self.entries[e["key"]] = (e["status"], e["body"])
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def key(service: str, method: str, path: str, query: str, body: bytes = b"") -> str:
+        q = "&".join(f"{k}={v}" for k, v in sorted(parse_qsl(query)))
+        k = f"{service} {method} {path}?{q}"
+        if body:
+            k += " " + hashlib.sha1(body).hexdigest()[:16]
+        return k
+
+    def get(self, key: str) -> Optional[Tuple[int, str]]:
+        return self.entries.get(key)
+
+    def add(self, key: str, status: int, body: str):
+        with self._lock:
+            self.entries[key] = (status, body)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "status": status, "body": body}) + "\n")
+
+# =========================
+# Synthetic upstreams
+# =========================
+class Synth:
+    def __init__(self, gazetteer: Dict[str, Tuple[float, float]]):
+        self.gazetteer = {k.casefold().strip(): (float(v[0]), float(v[1]), k) for k, v in gazetteer.items()}
+
+    def _lookup(self, q: str, viewbox: Optional[str] = None) -> Optional[Tuple[float, float, str]]:
+        hit = self.gazetteer.get((q or "").casefold().strip())
+        if hit and viewbox:
+            x1, y1, x2, y2 = map(float, viewbox.split(","))
+            if not (min(y1, y2) <= hit[0] <= max(y1, y2) and min(x1, x2) <= hit[1] <= max(x1, x2)):
+                return None
+        return hit
+
+    def nominatim(self, params: Dict[str, str]) -> Any:
+        hit = self._lookup(params.get("q", ""), params.get("viewbox") if params.get("bounded") else None)
+        if not hit:
+            return []
+        return [{"lat": f"{hit[0]:.7f}", "lon": f"{hit[1]:.7f}", "display_name": hit[2]}]
+
+    def photon(self, params: Dict[str, str]) -> Any:
+        hit = self._lookup(params.get("q", ""))
+        if not hit:
+            return {"type": "FeatureCollection", "features": []}
+        return {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [hit[1], hit[0]]},
+             "properties": {"name": hit[2]}}]}
+
+    @staticmethod
+    def _cell_pois(cx: int, cy: int, tag: str) -> List[Dict[str, Any]]:
+        seed = zlib.crc32(f"{cx}:{cy}:{tag}".encode())
+        rng = random.Random(seed)
+        lam = POI_DENSITY.get(tag, 0.2)
+        n = int(lam) + (rng.random() < lam - int(lam))
+        key, val = tag.split("=", 1)
+        out = []
+        for k in range(n):
+            lat = (cy + rng.random()) * _CELL; lon = (cx + rng.random()) * _CELL
+            tags = {key: val}
+            if rng.random() < 0.85:
+                tags["name"] = f"{val.replace('_', ' ').title()} {seed % 9973:04d}-{k}"
+            out.append({"type": "node", "id": (seed * 16 + k) % 10**11, "lat": round(lat, 7),
+                        "lon": round(lon, 7), "tags": tags})
+        return out
+
+    def overpass(self, query: str) -> Any:
+        m = _SELECTOR.findall(query)
+        limit = re.search(r"out\s+center\s+(\d+)", query)
+        seen, out = set(), []
+        for osm_type, radius, lat, lon, key, val in m:
+            if osm_type != "node":
+                continue
+            lat, lon, radius = float(lat), float(lon), float(radius)
+            dlat = radius / 111_000.0
+            dlon = radius / (111_000.0 * max(0.05, math.cos(math.radians(lat))))
+            for cy in range(math.floor((lat - dlat) / _CELL), math.floor((lat + dlat) / _CELL) + 1):
+                for cx in range(math.floor((lon - dlon) / _CELL), math.floor((lon + dlon) / _CELL) + 1):
+                    for e in self._cell_pois(cx, cy, f"{key}={val}"):
+                        if e["id"] in seen or haversine_km((lat, lon), (e["lat"], e["lon"])) * 1000 > radius:
+                            continue
+                        seen.add(e["id"]); out.append(e)
+        for osm_type, south, west, north, east, key, val in _BBOX_SELECTOR.findall(query):
+            if osm_type != "node":
+                continue
+            south, west, north, east = float(south), float(west), float(north), float(east)
+            for cy in range(math.floor(south / _CELL), math.floor(north / _CELL) + 1):
+                for cx in range(math.floor(west / _CELL), math.floor(east / _CELL) + 1):
+                    for e in self._cell_pois(cx, cy, f"{key}={val}"):
+                        if e["id"] in seen or not (south <= e["lat"] <= north and west <= e["lon"] <= east):
+                            continue
+                        seen.add(e["id"]); out.append(e)
+        if limit:
+            out = out[:int(limit.group(1))]
+        return {"version": 0.6, "generator": "routeforge-bench", "elements": out}
+
+    @staticmethod
+    def _coords(path: str) -> Tuple[str, List[Tuple[float, float]]]:
+        # /osrm/<svc>/v1/<mode>/<lon,lat;...>
+        parts = path.split("/")
+        mode, raw = parts[4], unquote_plus(parts[5])
+        pts = []
+        for p in raw.split(";"):
+            lon, lat = p.split(",")
+            pts.append((float(lat), float(lon)))
+        return mode, pts
+
+    def osrm_table(self, path: str, params: Dict[str, str]) -> Any:
+        mode, pts = self._coords(path)
+        speed = SPEED_KMH.get(mode, 40.0)
+        src = [int(i) for i in params["sources"].split(";")] if params.get("sources") else list(range(len(pts)))
+        dst = [int(i) for i in params["destinations"].split(";")] if params.get("destinations") else list(range(len(pts)))
+        dist = [[round(haversine_km(pts[i], pts[j]) * DETOUR * 1000, 1) for j in dst] for i in src]
+        dur = [[round(d / 1000 / speed * 3600, 1) for d in row] for row in dist]
+        return {"code": "Ok", "durations": dur, "distances": dist}
+
+    def osrm_route(self, path: str, params: Dict[str, str]) -> Any:
+        mode, pts = self._coords(path)
+        speed = SPEED_KMH.get(mode, 40.0)
+        line, total, drawn = [], 0.0, []
+        for (a_lat, a_lon), (b_lat, b_lon) in zip(pts, pts[1:]):
+            d = haversine_km((a_lat, a_lon), (b_lat, b_lon))
+            total += d
+            start = len(line)
+            steps = max(1, int(d * 1000 / 25))
+            for s in range(steps):
+                t = s / steps
+                wob = 0.002 * math.sin(t * math.pi * 7)  # meander like a road
+                line.append([round(a_lon + (b_lon - a_lon) * t + wob, 6), round(a_lat + (b_lat - a_lat) * t, 6)])
+            leg = line[start:] + [[b_lon, b_lat]]
+            drawn.append(sum(haversine_km((p[1], p[0]), (q[1], q[0])) for p, q in zip(leg, leg[1:])))
+        if pts:
+            line.append([pts[-1][1], pts[-1][0]])
+        dist = total * DETOUR * 1000
+        # like OSRM, each leg's distance follows its own drawn geometry
+        share = dist / (sum(drawn) or 1.0)
+        legs = [{"distance": x * share, "duration": x * share / 1000 / speed * 3600} for x in drawn]
+        fmt = params.get("geometries", "polyline")
+        if fmt in ("polyline", "polyline6"):
+            geometry = polyline.encode([(lat, lon) for lon, lat in line], 6 if fmt == "polyline6" else 5)
+        else:
+            geometry = {"type": "LineString", "coordinates": line}
+        return {"code": "Ok", "routes": [{"distance": dist, "duration": dist / 1000 / speed * 3600,
+                                          "geometry": geometry, "legs": legs}]}
+
+# =========================
+# Server
+# =========================
+class ReplayServer:
+    """In-process server (context manager); `base_urls` are what
+    `routeforge.services` should use. `spawn` runs one in a child process."""
+    def __init__(self, gazetteer: Dict[str, Tuple[float, float]], faults: Optional[Faults] = None,
+                 recording: Optional[Recording] = None, record: bool = False, strict: bool = False,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.synth = Synth(gazetteer)
+        self.faults = faults or Faults()
+        self.recording = recording or Recording()
+        self.record = record
+        self.strict = strict
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # header + body writes would hit delayed ACKs
+
+            def log_message(self, *a):
+                pass
+
+            def do_GET(self):
+                server._handle(self, "GET", b"")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                server._handle(self, "POST", body)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_urls(self) -> Dict[str, Any]:
+        return base_urls(self.url)
+
+    def start(self) -> "ReplayServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="rf-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- request handling ----
+    def _handle(self, h: BaseHTTPRequestHandler, method: str, body: bytes):
+        parts = urlsplit(h.path)
+        service = parts.path.split("/")[1] if parts.path.count("/") >= 1 else ""
+        if service == "_stats":
+            with self._lock:
+                return self._send(h, 200, json.dumps(self.counts))
+        with self._lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+        err = self.faults.apply(service)
+        if err:
+            return self._send(h, err, json.dumps({"error": "injected"}))
+        key = Recording.key(service, method, parts.path, parts.query, body)
+        hit = self.recording.get(key)
+        if hit is None and self.record and service in UPSTREAMS:
+            hit = self._proxy(service, method, parts, body)
+            self.recording.add(key, *hit)
+        if hit is None and not self.strict:
+            try:
+                hit = (200, json.dumps(self._synthesize(service, parts, body)))
+            except (KeyError, IndexError, ValueError) as e:
+                hit = (400, json.dumps({"error": f"{type(e).__name__}: {e}"}))
+        if hit is None:
+            hit = (404, json.dumps({"error": f"no recording for {key}"}))
+        self._send(h, *hit)
+
+    def _synthesize(self, service: str, parts, body: bytes) -> Any:
+        params = dict(parse_qsl(parts.query))
+        if service == "nominatim":
+            return self.synth.nominatim(params)
+        if service == "photon":
+            return self.synth.photon(params)
+        if service in OVERPASS_MIRRORS:
+            q = body.decode("utf-8")
+            if q.startswith("data="):
+                q = unquote_plus(q[5:])
+            return self.synth.overpass(q)
+        if service == "osrm":
+            if parts.path.startswith("/osrm/table/"):
+                return self.synth.osrm_table(parts.path, params)
+            return self.synth.osrm_route(parts.path, params)
+        raise KeyError(service)
+
+    def _proxy(self, service: str, method: str, parts, body: bytes) -> Tuple[int, str]:
+        url = UPSTREAMS[service] + parts.path[len(service) + 1:] + (f"?{parts.query}" if parts.query else "")
+        r = requests.request(method, url, data=body or None, timeout=120,
+                             headers={"User-Agent": "RouteForge-bench/1.0 (record mode)"})
+        return r.status_code, r.text
+
+    @staticmethod
+    def _send(h: BaseHTTPRequestHandler, status: int, body: str):
+        data = body.encode("utf-8")
+        h.send_response(status)
+        h.send_header("Content-Type", "application/json")
+        h.send_header("Content-Length", str(len(data)))
+        h.end_headers()
+        h.wfile.write(data)
+
+# =========================
+# Out-of-process serving
+# =========================
+def load_gazetteer(corpus_path: str) -> Dict[str, Tuple[float, float]]:
+    gaz: Dict[str, Tuple[float, float]] = {}
+    with open(corpus_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.lstrip().startswith("#"):
+                gaz.update({k: tuple(v) for k, v in (json.loads(line).get("geo") or {}).items()})
+    return gaz
+
+def _serve(conn, gazetteer, fault_spec, recording_path, record, strict, port):
+    srv = ReplayServer(gazetteer, Faults(fault_spec), Recording(recording_path), record, strict, port=port)
+    conn.send(srv.url)
+    srv.httpd.serve_forever()
+
+def spawn(gazetteer: Dict[str, Tuple[float, float]], faults: Optional[Faults] = None,
+          recording_path: Optional[str] = None, record: bool = False, strict: bool = False,
+          port: int = 0) -> Tuple[mp.Process, str]:
+    """Run a ReplayServer in a child process so its CPU and allocations stay
+    out of the measurements. Returns (process, base url)."""
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe()
+    proc = ctx.Process(target=_serve, name="rf-replay", daemon=True,
+                       args=(child, gazetteer, (faults or Faults()).spec, recording_path, record, strict, port))
+    proc.start()
+    if not parent.poll(30):
+        proc.terminate()
+        raise RuntimeError("replay server did not start")
+    return proc, parent.recv()
+
+def base_urls(url: str) -> Dict[str, Any]:
+    return {"nominatim": f"{url}/nominatim", "photon": f"{url}/photon", "osrm": f"{url}/osrm",
+            "overpass": [f"{url}/{m}/api/interpreter" for m in OVERPASS_MIRRORS]}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.replay", description="Serve replayed upstreams for manual runs.")
+    ap.add_argument("--corpus", default="bench/corpus.jsonl", help="gazetteer source (\"geo\" hints)")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="", help='e.g. "overpass=400+200,osrm=80" (ms, base+jitter)')
+    ap.add_argument("--errors", default="", help='e.g. "overpass-a=0.3" (error rate)')
+    ap.add_argument("--replay", help="recorded responses (JSONL)")
+    ap.add_argument("--record", action="store_true", help="proxy misses to the real upstreams and append to --replay")
+    ap.add_argument("--strict", action="store_true", help="404 instead of synthesizing unrecorded requests")
+    args = ap.parse_args(argv)
+    srv = ReplayServer(load_gazetteer(args.corpus), Faults.parse(args.latency, args.errors),
+                       Recording(args.replay), args.record, args.strict, port=args.port)
+    urls = base_urls(srv.url)
+    print(f"export ROUTEFORGE_NOMINATIM_URL={urls['nominatim']}")
+    print(f"export ROUTEFORGE_PHOTON_URL={urls['photon']}")
+    print(f"export ROUTEFORGE_OSRM_URL={urls['osrm']}")
+    print(f"export ROUTEFORGE_OVERPASS_URLS={','.join(urls['overpass'])}")
+    sys.stdout.flush()
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Correctness check of the local router against plain Dijkstra.
+
+    python -m bench.roadcheck                 # 24×24 synthetic town, 30 points per profile
+
+A synthetic street grid (main roads every few blocks, so most nodes sit on
+degree-2 chains; random highway types, one-way and reverse one-way streets,
+footways and dead ends) is written as .osm, built with
+`routeforge.roadgraph.build`, and queried through `LocalRouter`. Every
+table duration must equal a Dijkstra search over the raw node graph of the
+same extract, and every route geometry must be as long as its table
+distance. Points are placed exactly on road nodes so snapping adds nothing.
+"""
+import os, sys, heapq, random, argparse, tempfile
+from typing import Dict, List, Optional, Tuple
+
+from routeforge import roadgraph
+from routeforge.geo import haversine_km
+
+TYPES = ("primary", "secondary", "tertiary", "residential", "residential", "service", "footway", "cycleway")
+
+def write_town(path: str, n: int = 24, seed: int = 11) -> None:
+    """Streets on every 3rd row and column of an n×n node lattice, plus spurs."""
+    rnd = random.Random(seed)
+    nid = lambda i, j: 1 + i * n + j
+    used = set()
+    ways = []
+    def way(refs, **tags):
+        ways.append((refs, tags)); used.update(refs)
+    for i in range(0, n, 3):
+        # a street is sometimes split into two ways mid-block
+        cut = rnd.randrange(2, n - 2)
+        for refs in ([nid(i, j) for j in range(cut + 1)], [nid(i, j) for j in range(cut, n)]):
+            ow = rnd.choice(("", "", "", "yes", "-1"))
+            way(refs, highway=rnd.choice(TYPES), **({"oneway": ow} if ow else {}))
+        ow = rnd.choice(("", "", "yes"))
+        way([nid(j, i) for j in range(n)], highway=rnd.choice(TYPES), **({"oneway": ow} if ow else {}))
+    for _ in range(n // 2):  # dead ends off the grid
+        i, j = rnd.randrange(0, n, 3), rnd.randrange(1, n - 1)
+        if i + 2 < n and j % 3:
+            way([nid(i, j), nid(i + 1, j), nid(i + 2, j)], highway="residential")
+    out = ['<?xml version="1.0"?>', "<osm>"]
+    for i in range(n):
+        for j in range(n):
+            if nid(i, j) in used:
+                out.append(f'<node id="{nid(i, j)}" lat="{31.5 + i * 0.001 + rnd.uniform(-2e-4, 2e-4):.7f}" '
+                           f'lon="{74.3 + j * 0.001 + rnd.uniform(-2e-4, 2e-4):.7f}"/>')
+    for w, (refs, tags) in enumerate(ways, 1):
+        out.append(f'<way id="{w}">' + "".join(f'<nd ref="{r}"/>' for r in refs)
+                   + "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items()) + "</way>")
+    out.append("</osm>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(out))
+
+def raw_graph(path: str, profile: str):
+    """Every OSM node a vertex: node -> [(next node, seconds)], and coordinates."""
+    coords: Dict[int, Tuple[float,float]] = {}
+    adj: Dict[int, List[Tuple[int,float]]] = {}
+    for tags, refs in roadgraph._ways_xml(path, coords):
+        kmh = roadgraph._speed(tags, profile)
+        if kmh is None:
+            continue
+        ow = roadgraph._oneway(tags, profile)
+        for a, b in zip(refs, refs[1:]):
+            s = haversine_km(coords[a], coords[b]) * 1000.0 / (kmh / 3.6)
+            if ow >= 0:
+                adj.setdefault(a, []).append((b, s))
+            if ow <= 0:
+                adj.setdefault(b, []).append((a, s))
+            adj.setdefault(a, []); adj.setdefault(b, [])
+    return adj, coords
+
+def dijkstra(adj, src: int) -> Dict[int,float]:
+    best = {src: 0.0}
+    heap = [(0.0, src)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > best[u]:
+            continue
+        for v, w in adj[u]:
+            if d + w < best.get(v, float("inf")):
+                best[v] = d + w
+                heapq.heappush(heap, (d + w, v))
+    return best
+
+def _length_m(pts) -> float:
+    return sum(haversine_km(p, q) for p, q in zip(pts, pts[1:])) * 1000.0
+
+def check(points: int = 30, n: int = 24, seed: int = 11, workdir: Optional[str] = None) -> Dict[str,object]:
+    """Compare LocalRouter with Dijkstra; returns {"pairs", "mismatches"}."""
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        osm, npz = os.path.join(tmp, "town.osm"), os.path.join(tmp, "town.rfroute.npz")
+        write_town(osm, n, seed)
+        roadgraph.build(osm, npz)
+        router = roadgraph.LocalRouter(npz)
+        rnd = random.Random(seed)
+        pairs, bad = 0, []
+        for profile in roadgraph.PROFILES:
+            adj, coords = raw_graph(osm, profile)
+            nodes = rnd.sample(sorted(adj), min(points, len(adj)))
+            pts = [coords[x] for x in nodes]
+            table = router.table(pts, profile)
+            for i, s in enumerate(nodes):
+                ref = dijkstra(adj, s)
+                for j, t in enumerate(nodes):
+                    pairs += 1
+                    want, got = ref.get(t), table["durations"][i][j]
+                    if (want is None) != (got is None) or (want is not None and abs(want - got) > 1e-6 * max(1.0, want)):
+                        bad.append(f"{profile} {s}->{t}: dijkstra {want}, router {got}")
+                        continue
+                    if got is not None and i != j and j % 5 == 0:
+                        geom = router.route([pts[i], pts[j]], profile)
+                        length, dist = _length_m(geom or []), table["distances"][i][j]
+                        if abs(length - dist) > 1e-6 * max(1.0, dist):
+                            bad.append(f"{profile} {s}->{t}: route geometry {length:.2f} m, table {dist:.2f} m")
+        return {"pairs": pairs, "mismatches": bad}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.roadcheck", description=__doc__.splitlines()[0])
+    ap.add_argument("--points", type=int, default=30, help="query points per profile")
+    ap.add_argument("--size", type=int, default=24, help="lattice nodes per side")
+    ap.add_argument("--seed", type=int, default=11)
+    args = ap.parse_args(argv)
+    res = check(args.points, args.size, args.seed)
+    for m in res["mismatches"]:
+        print(f"MISMATCH {m}", file=sys.stderr)
+    print(f"router check: {res['pairs']} pairs, {len(res['mismatches'])} mismatches")
+    return 1 if res["mismatches"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
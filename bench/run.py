@@ -0,0 +1,338 @@
+"""Replay benchmark: planning latency, throughput, memory and route quality.
+
+    python -m bench.run                                   # synthetic replay, 1/4/16 users
+    python -m bench.run --latency overpass=400+300,nominatim=60 --errors overpass-a=0.3
+    python -m bench.run --replay bench/fixtures/live.jsonl --record --users 1   # capture once
+    python -m bench.run --replay bench/fixtures/live.jsonl --strict             # replay only
+    python -m bench.run --json now.json --baseline before.json                  # regression gate
+
+Upstreams are served by `bench.replay` in a child process and the services
+module is pointed at it, so runs need no network and are repeatable. Every
+pass starts from an empty in-memory cache. Reported:
+
+  stages      latency percentiles of geocode_best, overpass_places,
+              find_specific, osrm_table, plan_route, select_stops,
+              score_and_pick, route_geometry
+  end-to-end  plan_trip + plan_geometry latency, cold and warm (second
+              run of each trip)
+  throughput  trips/s and latency with N concurrent users on one cache
+  memory      tracemalloc peak per trip (replay server excluded)
+  quality     chosen route cost vs the optimal order (Held-Karp on the
+              same weights) and vs the greedy baseline
+  router      local contraction-hierarchy router vs plain Dijkstra on a
+              synthetic town (bench.roadcheck); any mismatch fails the run
+"""
+import os, sys, json, time, argparse, functools, threading, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from routeforge import cache, http, legs, planner, services, tiles
+from routeforge.ordering import held_karp, local_search, path_cost
+from routeforge.planner import PlanningError, plan_geometry, plan_trip
+from bench import roadcheck
+from bench.replay import Faults, base_urls, load_gazetteer, spawn
+
+STAGES = ("geocode_best", "overpass_places", "find_specific", "osrm_table", "plan_route", "select_stops", "score_and_pick",
+          "route_geometry")
+EXACT_MAX = 12
+
+def percentile(xs: Sequence[float], p: float) -> Optional[float]:
+    if not xs:
+        return None
+    s = sorted(xs)
+    return s[min(len(s) - 1, max(0, int(round(p * (len(s) - 1)))))]
+
+def _ms(v: Optional[float]) -> str:
+    return "-" if v is None else f"{v*1000:.1f}"
+
+def read_corpus(path: str) -> List[Dict[str,Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(l) for l in f if l.strip() and not l.lstrip().startswith("#")]
+
+# =========================
+# Instrumentation
+# =========================
+class Probe:
+    """Times the pipeline stages and scores every ordering `plan_route` makes."""
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {s: [] for s in STAGES}
+        self.score_quality = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _timed(self, name: str, fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[name].append(time.perf_counter() - t0)
+        return wrapper
+
+    def _scored(self, fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(w, *args, **kwargs):
+            sol = fn(w, *args, **kwargs)
+            if self.score_quality:
+                self._local.last = (w, sol)  # scored later, outside the timed stages
+            return sol
+        return wrapper
+
+    @staticmethod
+    def _score(w, sol) -> Dict[str,Any]:
+        n = len(w)
+        exact = n - 2 <= EXACT_MAX
+        best = held_karp(w) if exact else local_search(w, time_budget_s=10.0)
+        opt = min(path_cost(w, best), sol["cost"])
+        gap = lambda c: round((c - opt) / opt * 100.0, 3) if opt > 0 else 0.0
+        return {"stops": n - 2, "solver": sol["solver"], "cost": round(sol["cost"], 3),
+                "optimal": round(opt, 3), "exact": exact,
+                "gap_pct": gap(sol["cost"]), "greedy_gap_pct": gap(sol["greedy_cost"])}
+
+    def take_quality(self) -> Optional[Dict[str,Any]]:
+        last = getattr(self._local, "last", None)
+        self._local.last = None
+        return self._score(*last) if last else None
+
+    @contextmanager
+    def installed(self):
+        """Patch the stage functions where the pipeline looks them up
+        (planner imports them by name, services calls its own globals)."""
+        saved = []
+        for name in STAGES:
+            wrapped = None
+            for mod in (services, planner):
+                if hasattr(mod, name):
+                    orig = getattr(mod, name)
+                    wrapped = wrapped or self._timed(name, orig)
+                    saved.append((mod, name, orig)); setattr(mod, name, wrapped)
+        saved.append((planner, "solve", planner.solve))
+        planner.solve = self._scored(planner.solve)
+        try:
+            yield self
+        finally:
+            for mod, name, orig in reversed(saved):
+                setattr(mod, name, orig)
+
+    def stage_report(self) -> Dict[str, Dict[str,Any]]:
+        return {s: {"n": len(xs), "p50_s": percentile(xs, 0.5), "p90_s": percentile(xs, 0.9),
+                    "p99_s": percentile(xs, 0.99), "max_s": max(xs) if xs else None}
+                for s, xs in self.samples.items()}
+
+# =========================
+# Runs
+# =========================
+def point_services_at(url: str):
+    urls = base_urls(url)
+    services.NOMINATIM_URL = urls["nominatim"]
+    services.PHOTON_URL = urls["photon"]
+    services.OSRM_URL = urls["osrm"]
+    services._OVERPASS_ENDPOINTS[:] = urls["overpass"]
+
+def cold_start():
+    """Empty response cache, leg cache and endpoint health (no upstream rate
+    limits: the replay host is local)."""
+    cache.configure(cache.MemoryCache(max_entries=200_000))
+    legs._legs = legs.LegCache()
+    services._tiles = tiles.TileStore(services.overpass_query)
+    http.configure(http.Transport(rate_limits={}, default_concurrency=64))
+
+def upstream_counts(url: str) -> Dict[str,int]:
+    return requests.get(f"{url}/_stats", timeout=5).json()
+
+def run_one(trip: Dict[str,Any]) -> Tuple[str, float, Optional[Dict[str,Any]]]:
+    t0 = time.perf_counter()
+    try:
+        plan = plan_trip(trip)
+        plan_geometry(plan)
+        status = "ok"
+    except PlanningError:
+        plan, status = None, "planning-error"
+    except Exception as e:  # count, don't abort the run
+        plan, status = None, f"error: {type(e).__name__}: {e}"
+    dt = time.perf_counter() - t0
+    expected = trip.get("expect", "ok")
+    ok = status == "ok" if expected == "ok" else status == "planning-error"
+    return ("ok" if ok else status if status != "ok" else "unexpected-success"), dt, plan
+
+def sequential_pass(trips: List[Dict[str,Any]], probe: Probe) -> Dict[str,Any]:
+    """Each trip cold then warm, one at a time."""
+    cold_start()
+    per_trip = []
+    for trip in trips:
+        probe.score_quality = True
+        status, cold_s, _ = run_one(trip)
+        probe.score_quality = False
+        quality = probe.take_quality()
+        _, warm_s, _ = run_one(trip)
+        per_trip.append({"id": trip.get("id"), "status": status, "cold_s": cold_s, "warm_s": warm_s,
+                         "quality": quality})
+    return {"trips": per_trip}
+
+def memory_pass(trips: List[Dict[str,Any]]) -> Dict[str,float]:
+    """tracemalloc peak per cold trip; a separate pass so tracing overhead
+    stays out of the latency numbers."""
+    cold_start()
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for trip in trips:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            run_one(trip)
+            peaks[trip.get("id")] = round((tracemalloc.get_traced_memory()[1] - base) / 2**20, 2)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def concurrent_pass(trips: List[Dict[str,Any]], users: int, repeat: int, url: str) -> Dict[str,Any]:
+    """`users` workers share one (initially empty) cache and each plans the
+    corpus `repeat` times, like a busy deployment."""
+    cold_start()
+    before = upstream_counts(url)
+    jobs = [t for _ in range(repeat) for t in trips] * users
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(run_one, jobs))
+    wall = time.perf_counter() - t0
+    after = upstream_counts(url)
+    lat = [r[1] for r in results]
+    errors = sum(1 for r in results if r[0] != "ok")
+    return {"users": users, "trips": len(jobs), "wall_s": round(wall, 3),
+            "trips_per_s": round(len(jobs) / wall, 3) if wall > 0 else None,
+            "p50_s": percentile(lat, 0.5), "p95_s": percentile(lat, 0.95), "errors": errors,
+            "upstream_requests": sum(after.values()) - sum(before.values())}
+
+# =========================
+# Report
+# =========================
+def summarize(seq: Dict[str,Any], peaks: Dict[str,float], conc: List[Dict[str,Any]], probe: Probe) -> Dict[str,Any]:
+    rows = seq["trips"]
+    for r in rows:
+        r["peak_mib"] = peaks.get(r["id"])
+    good = [r for r in rows if r["status"] == "ok"]
+    quality = [r["quality"] for r in good if r["quality"]]
+    return {
+        "stages": probe.stage_report(),
+        "end_to_end": {"cold_p50_s": percentile([r["cold_s"] for r in good], 0.5),
+                       "cold_p90_s": percentile([r["cold_s"] for r in good], 0.9),
+                       "warm_p50_s": percentile([r["warm_s"] for r in good], 0.5),
+                       "failures": [r["id"] for r in rows if r["status"] != "ok"]},
+        "throughput": conc,
+        "memory": {"peak_mib_max": max(peaks.values(), default=None),
+                   "peak_mib_p50": percentile(list(peaks.values()), 0.5)},
+        "quality": {"mean_gap_pct": round(sum(q["gap_pct"] for q in quality) / len(quality), 3) if quality else None,
+                    "max_gap_pct": max((q["gap_pct"] for q in quality), default=None),
+                    "mean_greedy_gap_pct": round(sum(q["greedy_gap_pct"] for q in quality) / len(quality), 3) if quality else None},
+        "trips": rows,
+    }
+
+def print_report(rep: Dict[str,Any], out=sys.stdout):
+    p = lambda *a: print(*a, file=out)
+    p(f"{'stage':<18}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for s, r in rep["stages"].items():
+        p(f"{s:<18}{r['n']:>6}{_ms(r['p50_s']):>10}{_ms(r['p90_s']):>10}{_ms(r['p99_s']):>10}{_ms(r['max_s']):>10}")
+    e = rep["end_to_end"]
+    p(f"\nplan_trip  cold p50 {_ms(e['cold_p50_s'])} ms, p90 {_ms(e['cold_p90_s'])} ms; warm p50 {_ms(e['warm_p50_s'])} ms")
+    if e["failures"]:
+        p(f"  failed: {', '.join(map(str, e['failures']))}")
+    p(f"\n{'users':>5}{'trips':>7}{'wall s':>9}{'trips/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}{'upstream':>10}")
+    for t in rep["throughput"]:
+        p(f"{t['users']:>5}{t['trips']:>7}{t['wall_s']:>9.2f}{t['trips_per_s']:>9.2f}{_ms(t['p50_s']):>10}"
+          f"{_ms(t['p95_s']):>10}{t['errors']:>8}{t['upstream_requests']:>10}")
+    m = rep["memory"]
+    p(f"\npeak memory per trip: p50 {m['peak_mib_p50']} MiB, max {m['peak_mib_max']} MiB")
+    p(f"\n{'trip':<20}{'stops':>6}  {'solver':<13}{'gap %':>8}{'greedy gap %':>14}")
+    for r in rep["trips"]:
+        q = r["quality"]
+        if q:
+            p(f"{str(r['id']):<20}{q['stops']:>6}  {q['solver']:<13}{q['gap_pct']:>8.2f}{q['greedy_gap_pct']:>14.2f}"
+              + ("" if q["exact"] else "  (vs best known)"))
+    qs = rep["quality"]
+    p(f"mean gap to optimal {qs['mean_gap_pct']}%, greedy baseline {qs['mean_greedy_gap_pct']}%")
+    rc = rep.get("router_check")
+    if rc:
+        p(f"\nlocal router vs Dijkstra: {rc['pairs']} pairs, {len(rc['mismatches'])} mismatches")
+        for m in rc["mismatches"][:10]:
+            p(f"  {m}")
+
+def compare(now: Dict[str,Any], base: Dict[str,Any], tolerance_pct: float) -> List[str]:
+    """Regressions of `now` against a previous --json report."""
+    out = []
+    def worse(label, a, b, higher_is_worse=True):
+        if a is None or b is None or b == 0:
+            return
+        delta = (a - b) / abs(b) * 100.0 * (1 if higher_is_worse else -1)
+        if delta > tolerance_pct:
+            out.append(f"{label}: {b:.4g} -> {a:.4g} ({delta:+.1f}%)")
+    worse("cold p50 s", now["end_to_end"]["cold_p50_s"], base["end_to_end"]["cold_p50_s"])
+    worse("warm p50 s", now["end_to_end"]["warm_p50_s"], base["end_to_end"]["warm_p50_s"])
+    worse("peak MiB", now["memory"]["peak_mib_max"], base["memory"]["peak_mib_max"])
+    for t in now["throughput"]:
+        b = next((x for x in base["throughput"] if x["users"] == t["users"]), None)
+        if b:
+            worse(f"trips/s @{t['users']}", t["trips_per_s"], b["trips_per_s"], higher_is_worse=False)
+    qa, qb = now["quality"]["mean_gap_pct"], base["quality"]["mean_gap_pct"]
+    if qa is not None and qb is not None and qa > qb + 0.01:  # absolute: the baseline is usually 0
+        out.append(f"mean gap to optimal: {qb}% -> {qa}%")
+    if len(now["end_to_end"]["failures"]) > len(base["end_to_end"]["failures"]):
+        out.append(f"failures: {base['end_to_end']['failures']} -> {now['end_to_end']['failures']}")
+    if now.get("router_check", {}).get("mismatches"):
+        out.append(f"local router disagrees with Dijkstra on {len(now['router_check']['mismatches'])} pairs")
+    return out
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.splitlines()[0])
+    ap.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "corpus.jsonl"))
+    ap.add_argument("--users", default="1,4,16", help="concurrency levels (comma-separated)")
+    ap.add_argument("--repeat", type=int, default=1, help="corpus passes per user in the throughput runs")
+    ap.add_argument("--latency", default="", help='injected latency, e.g. "overpass=400+200,osrm=80" (ms, base+jitter)')
+    ap.add_argument("--errors", default="", help='injected error rate, e.g. "overpass-a=0.3,nominatim=0.05"')
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--replay", help="recorded responses (JSONL) to serve before synthesizing")
+    ap.add_argument("--record", action="store_true", help="fetch unrecorded requests live and append them to --replay")
+    ap.add_argument("--strict", action="store_true", help="only serve recorded responses")
+    ap.add_argument("--json", help="write the full report here")
+    ap.add_argument("--baseline", help="previous --json report; exit 1 on regressions")
+    ap.add_argument("--tolerance", type=float, default=25.0, help="allowed regression in %% (default 25)")
+    args = ap.parse_args(argv)
+    if args.record and not args.replay:
+        ap.error("--record needs --replay PATH")
+
+    trips = read_corpus(args.corpus)
+    faults = Faults.parse(args.latency, args.errors, args.seed)
+    proc, url = spawn(load_gazetteer(args.corpus), faults, args.replay, args.record, args.strict)
+    try:
+        point_services_at(url)
+        probe = Probe()
+        with probe.installed():
+            seq = sequential_pass(trips, probe)
+            peaks = memory_pass(trips)
+            conc = [concurrent_pass(trips, int(u), args.repeat, url) for u in args.users.split(",") if u.strip()]
+    finally:
+        proc.terminate()
+    rep = summarize(seq, peaks, conc, probe)
+    rep["router_check"] = roadcheck.check()
+    rep["config"] = {"corpus": args.corpus, "trips": len(trips), "latency": args.latency, "errors": args.errors,
+                     "replay": args.replay, "strict": args.strict,
+                     "poi_file": os.environ.get("ROUTEFORGE_POI_FILE") or None,
+                     "router": os.environ.get("ROUTEFORGE_ROUTER") or "osrm"}
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(rep, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 1 if rep["end_to_end"]["failures"] or rep["router_check"]["mismatches"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
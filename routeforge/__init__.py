@@ -0,0 +1 @@
+"""RouteForge planning library (importable without Streamlit)."""
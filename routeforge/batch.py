@@ -0,0 +1,89 @@
+"""Batch planner: one trip per JSONL line, one trip_plan.json per trip.
+
+    python -m routeforge.batch trips.jsonl --out plans/ --workers 8
+
+Each line holds planner inputs (origin, final_destination, city, mode,
+top_k, radius_m, cost_per_km, time_value_per_hr, specific_need) plus an
+optional "id" / "request_id" used as the output folder name. Trips run in
+parallel on a thread pool (or `--processes`); all workers share the
+on-disk response cache, so popular cities are fetched once. A summary line
+per trip is printed as JSON; the exit status is 1 if any trip failed.
+
+`--format compact|ndjson` and `--compress gzip|zstd` pick the export
+layout (see routeforge.export); the file name follows, e.g.
+trip_plan.ndjson.gz.
+
+`--service URL` sends each trip to a planning service (routeforge.server)
+instead of planning in-process; trips the service can't take yet (503) are
+retried after its Retry-After.
+"""
+import os, re, sys, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from routeforge import export
+from routeforge.client import ServiceClient
+from routeforge.planner import PlanningError, plan_geometry, plan_trip
+
+def read_trips(path: str) -> Iterator[Tuple[str, Dict[str,Any]]]:
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            trip = json.loads(line)
+            trip_id = str(trip.get("id") or trip.get("request_id") or f"trip-{lineno:04d}")
+            yield re.sub(r"[^A-Za-z0-9._-]+", "_", trip_id), trip
+
+def run_trip(trip_id: str, trip: Dict[str,Any], out_dir: str, geometry: bool = False,
+             layout: str = "pretty", compression: Optional[str] = None,
+             service: Optional[str] = None) -> Dict[str,Any]:
+    t0 = time.monotonic()
+    try:
+        if service:
+            plan = ServiceClient(service).plan(trip, geometry=geometry)
+        else:
+            plan = plan_trip(trip)
+            if geometry:
+                plan_geometry(plan)  # adds route.polyline to the payload
+    except PlanningError as e:
+        return {"id": trip_id, "status": "error", "error": str(e), "seconds": round(time.monotonic() - t0, 3)}
+    folder = os.path.join(out_dir, trip_id)
+    os.makedirs(folder, exist_ok=True)
+    export.save(plan["payload"], os.path.join(folder, export.filename(layout, compression)),
+                layout, compression, trip_id=trip_id)
+    with open(os.path.join(folder, "Itinerary.md"), "w", encoding="utf-8") as f:
+        f.write(plan["markdown"])
+    return {"id": trip_id, "status": "ok", "totals": plan["payload"]["totals"],
+            "seconds": round(time.monotonic() - t0, 3)}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m routeforge.batch", description=__doc__.splitlines()[0])
+    ap.add_argument("trips", help="JSONL file, one trip per line")
+    ap.add_argument("--out", default="plans", help="output directory (default: plans/)")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    ap.add_argument("--geometry", action="store_true", help="include the road geometry (encoded polyline)")
+    ap.add_argument("--format", choices=export.LAYOUTS, default="pretty", help="trip plan layout (default: pretty)")
+    ap.add_argument("--compress", choices=("gzip", "zstd"), default=None, help="compress the trip plan")
+    ap.add_argument("--service", default=os.environ.get("ROUTEFORGE_SERVICE_URL") or None,
+                    help="plan on this planning service (default: $ROUTEFORGE_SERVICE_URL, else in-process)")
+    args = ap.parse_args(argv)
+
+    trips = list(read_trips(args.trips))
+    pool_cls = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    failed = 0
+    with pool_cls(max_workers=max(1, args.workers)) as pool:
+        futs = {pool.submit(run_trip, tid, trip, args.out, args.geometry, args.format, args.compress,
+                            args.service): tid for tid, trip in trips}
+        for fut in as_completed(futs):
+            try:
+                res = fut.result()
+            except Exception as e:  # one bad trip must not sink the batch
+                res = {"id": futs[fut], "status": "error", "error": f"{type(e).__name__}: {e}"}
+            failed += res["status"] != "ok"
+            print(json.dumps(res, ensure_ascii=False), flush=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""Persistent cache for upstream responses (Nominatim, Photon, Overpass, OSRM).
+
+Entries live in a pluggable backend (SQLite by default) so every worker on a
+node shares them and they survive restarts. Each source has its own TTL plus
+a stale-while-revalidate window: stale hits are served immediately and
+refreshed on a background thread. The SQLite backend is size-bounded with
+LRU eviction.
+
+`fetch` (and the `cached` decorator) handle revalidation. Callers that
+refetch in bulk (per-leg tables, Overpass tiles, leg geometry) use `peek`
+instead. It says how long a hit stays fresh, so they can refetch stale
+entries themselves and keep the stale copy as a fallback.
+
+Configuration (environment):
+  ROUTEFORGE_CACHE         "memory", "off", or a path to the SQLite file
+                           (default: ~/.cache/routeforge/http.sqlite3)
+  ROUTEFORGE_CACHE_MAX_MB  size bound for the SQLite file (default 256)
+"""
+import os, json, time, sqlite3, hashlib, threading, functools
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from routeforge.telemetry import fallback, record_cache
+
+# source -> (ttl_s, stale_s): fresh for ttl_s, then served stale (and
+# refreshed in the background) for another stale_s
+DEFAULT_POLICIES: Dict[str, Tuple[int,int]] = {
+    "nominatim": (7*86400, 23*86400),
+    "photon":    (7*86400, 23*86400),
+    "overpass-tile": (86400, 6*86400),
+    "osrm-leg":  (86400, 6*86400),
+    "osrm-geom": (86400, 6*86400),
+}
+_FALLBACK_POLICY = (3600, 0)
+
+# =========================
+# Backends
+# =========================
+class CacheBackend:
+    """Minimal key-value interface; values are JSON-serialisable."""
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, stored_at) or None."""
+        raise NotImplementedError
+    def set(self, key: str, source: str, value: Any) -> None:
+        raise NotImplementedError
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+    def clear(self) -> None:
+        raise NotImplementedError
+
+class NullCache(CacheBackend):
+    def get(self, key): return None
+    def set(self, key, source, value): pass
+    def delete(self, key): pass
+    def clear(self): pass
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU; useful for tests and read-only deployments. Values are
+    stored serialised so callers can't mutate the cached copy."""
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._d: "OrderedDict[str, Tuple[str,float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._d.get(key)
+            if hit is None:
+                return None
+            self._d.move_to_end(key)
+        return json.loads(hit[0]), hit[1]
+
+    def set(self, key, source, value):
+        with self._lock:
+            self._d[key] = (json.dumps(value, ensure_ascii=False), time.time())
+            self._d.move_to_end(key)
+            while len(self._d) > self.max_entries:
+                self._d.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._d.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+
+class SQLiteCache(CacheBackend):
+    """Shared on-disk cache. WAL mode lets several processes read and write
+    concurrently; eviction drops least-recently-accessed rows once the stored
+    payload exceeds `max_bytes`."""
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY, source TEXT NOT NULL, value TEXT NOT NULL,
+        stored_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_lru ON entries(accessed_at);
+    """
+    # don't rewrite accessed_at on every read; LRU only needs coarse recency
+    _TOUCH_EVERY_S = 60.0
+    # size check is a full-table SUM, so only run it every few writes
+    _EVICT_EVERY = 32
+
+    def __init__(self, path: str, max_bytes: int = 256*1024*1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._writes = 0
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as c:
+            c.executescript(self._SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = c
+        return c
+
+    def get(self, key):
+        c = self._conn()
+        row = c.execute("SELECT value, stored_at, accessed_at FROM entries WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[2] > self._TOUCH_EVERY_S:
+            try:
+                c.execute("UPDATE entries SET accessed_at=? WHERE key=?", (now, key))
+            except sqlite3.OperationalError:
+                pass  # busy writer elsewhere; recency is best-effort
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, source, value):
+        blob = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        c = self._conn()
+        c.execute("INSERT OR REPLACE INTO entries(key, source, value, stored_at, accessed_at, size) "
+                  "VALUES (?,?,?,?,?,?)", (key, source, blob, now, now, len(blob)))
+        self._writes += 1
+        if self._writes % self._EVICT_EVERY == 1:
+            self._evict(c)
+
+    def _evict(self, c: sqlite3.Connection):
+        total = c.execute("SELECT COALESCE(SUM(size),0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in c.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= target:
+                break
+        c.executemany("DELETE FROM entries WHERE key=?", victims)
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Dict[str,int]]:
+        rows = self._conn().execute("SELECT source, COUNT(*), SUM(size) FROM entries GROUP BY source")
+        return {s: {"entries": n, "bytes": b or 0} for s, n, b in rows}
+
+# =========================
+# Cache front-end (TTL + stale-while-revalidate)
+# =========================
+class Cache:
+    def __init__(self, backend: CacheBackend, policies: Optional[Dict[str, Tuple[int,int]]] = None):
+        self.backend = backend
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def policy(self, source: str) -> Tuple[int,int]:
+        return self.policies.get(source, _FALLBACK_POLICY)
+
+    def fetch(self, key: str, source: str, compute: Callable[[], Any], store_none: bool = False) -> Any:
+        """Return the cached value for `key`, computing (and storing) it on a miss."""
+        ttl, stale = self.policy(source)
+        hit = self._lookup(key)
+        if hit is not None:
+            value, stored_at = hit
+            age = time.time() - stored_at
+            if age <= ttl:
+                record_cache(source, "hit")
+                return value
+            if age <= ttl + stale:
+                record_cache(source, "stale")
+                self._revalidate(key, source, compute, store_none)
+                return value
+        record_cache(source, "miss")
+        value = compute()
+        if value is not None or store_none:
+            self._store(key, source, value)
+        return value
+
+    def get(self, key: str, source: str) -> Any:
+        """Value for `key` if still usable (fresh or within the stale window), else None.
+
+        Nothing is revalidated: a stale value stays stale until it is put again."""
+        hit = self.peek(key, source)
+        return None if hit is None else hit[0]
+
+    def peek(self, key: str, source: str, record: bool = True) -> Optional[Tuple[Any, float]]:
+        """(value, seconds it stays fresh; <= 0 once stale) if still usable,
+        else None. `record=False` leaves the lookup out of the cache metrics
+        (the caller counts in bulk)."""
+        ttl, stale = self.policy(source)
+        hit = self._lookup(key)
+        age = None if hit is None else time.time() - hit[1]
+        result = "miss" if age is None or age > ttl + stale else ("hit" if age <= ttl else "stale")
+        if record:
+            record_cache(source, result)
+        return None if result == "miss" else (hit[0], ttl - age)
+
+    def put(self, key: str, source: str, value: Any) -> None:
+        self._store(key, source, value)
+
+    def _lookup(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            fallback("cache-read", e)
+            return None
+
+    def _store(self, key, source, value):
+        try:
+            self.backend.set(key, source, value)
+        except Exception as e:
+            fallback("cache-write", e)  # a cache write failure must never fail the request
+
+    def _revalidate(self, key, source, compute, store_none):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                value = compute()
+                if value is not None or store_none:
+                    self._store(key, source, value)
+            except Exception as e:
+                fallback("cache-refresh", e)  # keep serving the stale copy
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name="rf-cache-refresh", daemon=True).start()
+
+# =========================
+# Keys + decorator
+# =========================
+def _norm(v: Any, casefold: bool) -> Any:
+    if isinstance(v, str):
+        v = " ".join(v.split())
+        return v.casefold() if casefold else v
+    if isinstance(v, float):
+        return round(v, 6)
+    if isinstance(v, (list, tuple)):
+        return [_norm(x, casefold) for x in v]
+    if isinstance(v, dict):
+        return {str(k): _norm(x, casefold) for k, x in sorted(v.items())}
+    return v
+
+def make_key(source: str, endpoint: str, args: tuple, kwargs: dict, casefold: bool = False) -> str:
+    """Stable key from the endpoint name and the normalised query arguments."""
+    body = json.dumps([_norm(list(args), casefold), _norm(kwargs, casefold)],
+                      sort_keys=True, ensure_ascii=False, default=str)
+    return f"{source}:{endpoint}:" + hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+_cache: Optional[Cache] = None
+_cache_lock = threading.Lock()
+
+def _default_backend() -> CacheBackend:
+    spec = os.environ.get("ROUTEFORGE_CACHE", "").strip()
+    if spec == "off":
+        return NullCache()
+    if spec == "memory":
+        return MemoryCache()
+    path = spec or os.path.join(os.path.expanduser("~"), ".cache", "routeforge", "http.sqlite3")
+    max_mb = float(os.environ.get("ROUTEFORGE_CACHE_MAX_MB", "256"))
+    try:
+        return SQLiteCache(path, max_bytes=int(max_mb*1024*1024))
+    except (OSError, sqlite3.Error):
+        return MemoryCache()  # read-only filesystem etc.
+
+def get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = Cache(_default_backend())
+    return _cache
+
+def configure(backend: Optional[CacheBackend] = None, policies: Optional[Dict[str, Tuple[int,int]]] = None) -> Cache:
+    """Swap the process-wide cache (e.g. a MemoryCache in tests, or custom TTLs)."""
+    global _cache
+    with _cache_lock:
+        _cache = Cache(backend or _default_backend(), policies)
+    return _cache
+
+def cached(source: str, casefold: bool = False, store_none: bool = False):
+    """Memoize a function in the shared cache under `source`'s TTL policy.
+
+    `None` results are not stored by default, so transient lookup failures
+    are retried instead of being pinned for the whole TTL.
+    """
+    def deco(fn):
+        endpoint = fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = make_key(source, endpoint, args, kwargs, casefold=casefold)
+            return get_cache().fetch(key, source, lambda: fn(*args, **kwargs), store_none=store_none)
+        wrapper.uncached = fn
+        return wrapper
+    return deco
@@ -0,0 +1,233 @@
+"""Compact, spatially indexed storage for POI candidates.
+
+`CandidateStore` keeps coordinates in float arrays and names, categories and
+OSM ids in parallel columns; the OpenStreetMap URL is rebuilt on demand
+instead of being stored per candidate. It de-duplicates on insert (same
+name and coordinates to 1e-5°) and answers radius / k-nearest queries
+through a `GridIndex`. `PointGrid` is the incremental variant used for
+"is this within 10 m of something already picked?" checks.
+
+Rows come back as the same dicts `overpass_places` produces, so downstream
+code (markdown, JSON export) is unchanged.
+"""
+import re
+from array import array
+from math import cos, radians, ceil, floor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from routeforge.geo import haversine_to
+
+OSM_BASE = "https://www.openstreetmap.org/"
+_OSM_TYPES = ["", "node", "way", "relation"]
+_OSM_URL = re.compile(r"openstreetmap\.org/(node|way|relation)/(\d+)")
+
+_M_PER_DEG_LAT = 110540.0
+_M_PER_DEG_LON = 111320.0
+
+def _cell_scale(lat0: float, cell_m: float) -> Tuple[float,float]:
+    """Degrees → grid cells for a local equirectangular projection."""
+    return (_M_PER_DEG_LAT / cell_m, _M_PER_DEG_LON * max(0.05, cos(radians(lat0))) / cell_m)
+
+def _cell_keys(ix: np.ndarray, iy: np.ndarray) -> np.ndarray:
+    return ix.astype(np.int64) * (1 << 32) + (iy.astype(np.int64) + (1 << 31))
+
+# =========================
+# Spatial indexes
+# =========================
+class GridIndex:
+    """Static uniform grid over (lat, lon) arrays, built with one argsort."""
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_m: float = 250.0):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_m = cell_m
+        lat0 = float(self.lat.mean()) if len(self.lat) else 0.0
+        self._ky, self._kx = _cell_scale(lat0, cell_m)
+        keys = _cell_keys(np.floor(self.lon * self._kx), np.floor(self.lat * self._ky))
+        self._order = np.argsort(keys, kind="stable")
+        uniq, starts, counts = np.unique(keys[self._order], return_index=True, return_counts=True)
+        self._cells = dict(zip(uniq.tolist(), zip(starts.tolist(), counts.tolist())))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _gather(self, lat: float, lon: float, radius_m: float) -> np.ndarray:
+        cx = floor(lon * self._kx); cy = floor(lat * self._ky)
+        # cells are slightly narrower away from the reference latitude; pad one
+        span = int(ceil(radius_m / self.cell_m)) + 1
+        parts = []
+        for dx in range(-span, span + 1):
+            for dy in range(-span, span + 1):
+                hit = self._cells.get((cx + dx) * (1 << 32) + (cy + dy + (1 << 31)))
+                if hit:
+                    parts.append(self._order[hit[0]:hit[0] + hit[1]])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def query_radius(self, lat: float, lon: float, radius_m: float, sort: bool = False) -> np.ndarray:
+        """Indices within `radius_m` of (lat, lon)."""
+        idx = self._gather(lat, lon, radius_m)
+        if not len(idx):
+            return idx
+        d = haversine_to((lat, lon), self.lat[idx], self.lon[idx]) * 1000.0
+        keep = d <= radius_m
+        idx, d = idx[keep], d[keep]
+        if sort:
+            idx = idx[np.argsort(d, kind="stable")]
+        return idx
+
+    def knn(self, lat: float, lon: float, k: int) -> np.ndarray:
+        """Indices of the k nearest points, nearest first."""
+        n = len(self.lat)
+        if n == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64)
+        r = self.cell_m
+        while True:
+            idx = self._gather(lat, lon, r)
+            if len(idx) >= min(k, n) or len(idx) == n:
+                d = haversine_to((lat, lon), self.lat[idx], self.lon[idx]) * 1000.0
+                inside = d <= r
+                # only points inside the exact radius are guaranteed nearest
+                if inside.sum() >= min(k, n) or len(idx) == n:
+                    order = np.argsort(d, kind="stable")[:k]
+                    return idx[order]
+            r *= 2.0
+
+    def any_within(self, lat: float, lon: float, radius_m: float) -> bool:
+        return len(self.query_radius(lat, lon, radius_m)) > 0
+
+class PointGrid:
+    """Incremental hash grid for small, growing point sets (e.g. picks)."""
+    def __init__(self, cell_m: float = 50.0, lat0: float = 0.0):
+        self.cell_m = cell_m
+        self._ky, self._kx = _cell_scale(lat0, cell_m)
+        self._cells: Dict[Tuple[int,int], List[Tuple[float,float]]] = {}
+
+    def add(self, lat: float, lon: float):
+        self._cells.setdefault((floor(lon * self._kx), floor(lat * self._ky)), []).append((lat, lon))
+
+    def any_within(self, lat: float, lon: float, radius_m: float) -> bool:
+        cx = floor(lon * self._kx); cy = floor(lat * self._ky)
+        span = int(ceil(radius_m / self.cell_m)) + 1
+        near = []
+        for dx in range(-span, span + 1):
+            for dy in range(-span, span + 1):
+                near.extend(self._cells.get((cx + dx, cy + dy), ()))
+        if not near:
+            return False
+        pts = np.asarray(near)
+        return bool(np.any(haversine_to((lat, lon), pts[:, 0], pts[:, 1]) * 1000.0 <= radius_m))
+
+# =========================
+# Columnar candidate store
+# =========================
+class CandidateStore:
+    def __init__(self):
+        self._lat = array("d"); self._lon = array("d")
+        self._cat = array("B"); self._osm_type = array("B"); self._osm_id = array("q")
+        self.names: List[str] = []
+        self.categories: List[str] = []  # code -> label
+        self._cat_codes: Dict[str,int] = {}
+        self._address: Dict[int,str] = {}  # sparse: most OSM nodes have none
+        self._seen: Dict[Tuple[str,float,float], int] = {}
+        self.dist_km: Optional[np.ndarray] = None
+        self._arrays = None
+        self._index: Optional[GridIndex] = None
+
+    @classmethod
+    def from_places(cls, places: Iterable[Dict[str,Any]]) -> "CandidateStore":
+        store = cls()
+        for p in places:
+            store.add_place(p)
+        return store
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name: str, lat: float, lon: float, category: str,
+            osm_type: str = "", osm_id: int = 0, address: str = "") -> int:
+        """Append a candidate; returns its row (the existing row for duplicates)."""
+        key = (name, round(lat, 5), round(lon, 5))
+        row = self._seen.get(key)
+        if row is not None:
+            return row
+        row = len(self.names)
+        self._seen[key] = row
+        code = self._cat_codes.get(category)
+        if code is None:
+            code = self._cat_codes[category] = len(self.categories)
+            self.categories.append(category)
+        self._lat.append(lat); self._lon.append(lon); self._cat.append(code)
+        self._osm_type.append(_OSM_TYPES.index(osm_type) if osm_type in _OSM_TYPES else 0)
+        self._osm_id.append(int(osm_id or 0))
+        self.names.append(name)
+        if address:
+            self._address[row] = address
+        self._arrays = None; self._index = None; self.dist_km = None
+        return row
+
+    def add_place(self, p: Dict[str,Any]) -> Optional[int]:
+        """Append an `overpass_places`-style dict (malformed rows are skipped)."""
+        try:
+            lat = float(p.get("lat", 0) or 0); lon = float(p.get("lon", 0) or 0)
+        except (TypeError, ValueError):
+            return None
+        m = _OSM_URL.search(p.get("url") or "")
+        return self.add(p.get("name", ""), lat, lon, p.get("category", ""),
+                        m.group(1) if m else "", int(m.group(2)) if m else 0,
+                        p.get("address", ""))
+
+    # ---- columns ----
+    def _cols(self):
+        if self._arrays is None:
+            self._arrays = (np.array(self._lat, dtype=np.float64), np.array(self._lon, dtype=np.float64),
+                            np.array(self._cat, dtype=np.uint8))
+        return self._arrays
+
+    @property
+    def lat(self) -> np.ndarray:
+        return self._cols()[0]
+
+    @property
+    def lon(self) -> np.ndarray:
+        return self._cols()[1]
+
+    def category_mask(self, category: str) -> np.ndarray:
+        code = self._cat_codes.get(category)
+        if code is None:
+            return np.zeros(len(self), dtype=bool)
+        return self._cols()[2] == code
+
+    def category(self, i: int) -> str:
+        return self.categories[self._cat[i]]
+
+    def url(self, i: int) -> str:
+        t = self._osm_type[i]
+        if t:
+            return f"{OSM_BASE}{_OSM_TYPES[t]}/{self._osm_id[i]}"
+        return f"{OSM_BASE}?mlat={self._lat[i]}&mlon={self._lon[i]}"
+
+    @property
+    def index(self) -> GridIndex:
+        if self._index is None:
+            self._index = GridIndex(self.lat, self.lon)
+        return self._index
+
+    def distances_to(self, point: Tuple[float,float]) -> np.ndarray:
+        """km from `point` to every candidate; also kept as the dist_km column."""
+        self.dist_km = np.round(haversine_to(point, self.lat, self.lon), 2)
+        return self.dist_km
+
+    # ---- rows ----
+    def row(self, i: int) -> Dict[str,Any]:
+        i = int(i)
+        out = {"name": self.names[i], "lat": self._lat[i], "lon": self._lon[i],
+               "category": self.category(i), "address": self._address.get(i, ""), "url": self.url(i)}
+        if self.dist_km is not None:
+            out["dist_km"] = float(self.dist_km[i])
+        return out
+
+    def to_dicts(self) -> List[Dict[str,Any]]:
+        return [self.row(i) for i in range(len(self))]
@@ -0,0 +1,116 @@
+"""Client for the planning service (routeforge.server).
+
+    from routeforge.client import from_env
+    svc = from_env()          # None unless ROUTEFORGE_SERVICE_URL is set
+    plan = svc.plan({"origin": "...", "final_destination": "..."}, geometry=True)
+
+`plan` returns the same fields as `planner.plan_trip` (minus the server-side
+discovery) plus `geometry`. Progress callbacks get the same events as
+`plan_trip`'s `on_progress`. A 503 from an overloaded service is retried
+after its Retry-After, up to `retries` times; 422 raises PlanningError.
+Connection failures raise ServiceUnavailable, so callers can plan
+in-process instead.
+"""
+import os, json, time
+from typing import Any, Dict, Optional
+
+import requests
+
+from routeforge.planner import PlanningError, Progress
+
+class ServiceError(RuntimeError):
+    pass
+
+class ServiceBusy(ServiceError):
+    """The service kept answering 503 (queue full)."""
+
+class ServiceUnavailable(ServiceError):
+    """The service could not be reached, or dropped the connection."""
+
+# events whose data is a geocode tuple (JSON turns it into a list)
+_GEOCODE_EVENTS = ("center", "origin", "destination")
+
+def _raise_for(status: int, body: Dict[str,Any]):
+    msg = body.get("error") or f"HTTP {status}"
+    if status == 422:
+        raise PlanningError(msg)
+    if status == 503:
+        raise ServiceBusy(msg)
+    raise ServiceError(f"planning service: {msg}")
+
+def _plan_from_json(plan: Dict[str,Any]) -> Dict[str,Any]:
+    plan["geometry"] = [tuple(p) for p in plan["geometry"]] if plan.get("geometry") else None
+    return plan
+
+class ServiceClient:
+    def __init__(self, url: str, timeout: float = 300.0, retries: int = 3, max_wait_s: float = 30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.max_wait_s = max_wait_s
+        self._session = requests.Session()
+
+    def plan(self, inputs: Dict[str,Any], geometry: bool = False,
+             on_progress: Optional[Progress] = None) -> Dict[str,Any]:
+        body = {"inputs": inputs, "geometry": geometry, "stream": on_progress is not None}
+        for attempt in range(self.retries + 1):
+            try:
+                r = self._session.post(f"{self.url}/plan", json=body, timeout=self.timeout, stream=on_progress is not None)
+            except requests.RequestException as e:
+                raise ServiceUnavailable(f"planning service unreachable: {e}") from e
+            if r.status_code == 503 and attempt < self.retries:
+                # backpressure: wait as long as the service asks (bounded)
+                r.close()
+                time.sleep(min(self.max_wait_s, float(r.headers.get("Retry-After") or 1)))
+                continue
+            if r.status_code != 200:
+                _raise_for(r.status_code, _json_or_empty(r))
+            if on_progress is None:
+                try:
+                    return _plan_from_json(r.json())
+                except ValueError as e:
+                    raise ServiceError(f"planning service: bad response: {e}") from e
+            return self._read_stream(r, on_progress)
+        raise ServiceBusy("planning service overloaded")
+
+    def _read_stream(self, r: requests.Response, on_progress: Progress) -> Dict[str,Any]:
+        try:
+            return self._read_events(r, on_progress)
+        except requests.RequestException as e:
+            raise ServiceUnavailable(f"planning service connection lost: {e}") from e
+
+    def _read_events(self, r: requests.Response, on_progress: Progress) -> Dict[str,Any]:
+        with r:
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                msg = json.loads(line)
+                event = msg.get("event")
+                if event == "result":
+                    plan = _plan_from_json(msg["plan"])
+                    on_progress("plan", plan)
+                    return plan
+                if event == "error":
+                    _raise_for(int(msg.get("status", 500)), msg)
+                data = msg.get("data")
+                if event in _GEOCODE_EVENTS and data:
+                    data = tuple(data)
+                on_progress(event, data)
+        raise ServiceError("planning service closed the stream without a result")
+
+    def stats(self) -> Dict[str,Any]:
+        try:
+            return self._session.get(f"{self.url}/stats", timeout=10).json()
+        except requests.RequestException as e:
+            raise ServiceUnavailable(f"planning service unreachable: {e}") from e
+
+def _json_or_empty(r: requests.Response) -> Dict[str,Any]:
+    try:
+        body = r.json()
+        return body if isinstance(body, dict) else {}
+    except ValueError:
+        return {}
+
+def from_env() -> Optional[ServiceClient]:
+    url = os.environ.get("ROUTEFORGE_SERVICE_URL", "").strip()
+    return ServiceClient(url) if url else None
@@ -0,0 +1,134 @@
+"""Route corridors: candidate stops along the road, not around one city.
+
+A `Corridor` buffers the origin → destination road geometry by `buffer_m`.
+Stations are placed along it every `buffer_m`, each reaching a little past
+the buffer so neighbouring circles overlap, and their slippy-map tiles are
+fetched through the shared TileStore (routeforge.tiles): in batches, in
+parallel, and shared with city searches and earlier trips.
+
+Query cost is bounded whatever the trip length: when the tiles would
+exceed `MAX_TILES`, stations are spread out (every 2×, 4×, ... `buffer_m`)
+and the corridor is sampled in evenly spaced windows that always include
+both ends, instead of being covered end to end.
+
+Candidates are ranked by detour, twice their distance from the route (out
+and back), smallest first.
+"""
+from math import ceil, cos, radians
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from routeforge.polyline import simplify
+from routeforge.tiles import TILE_ZOOM, Tile, tiles_for_circle
+
+Point = Tuple[float,float]
+
+MAX_BUFFER_M = 2000.0
+MAX_TILES = 216          # 6 merged Overpass queries at zoom 13
+REACH = 1.12             # station radius / buffer (≈ hypot(1, 1/2))
+SIMPLIFY_M = 50.0        # route detail kept for detour distances
+
+_M_PER_DEG = 111_320.0
+_CHUNK = 256             # candidates per vectorized distance block
+
+def _seg_lengths(pts: np.ndarray) -> np.ndarray:
+    mid = np.radians((pts[:-1, 0] + pts[1:, 0]) / 2.0)
+    dx = np.diff(pts[:, 1]) * np.cos(mid) * _M_PER_DEG
+    dy = np.diff(pts[:, 0]) * _M_PER_DEG
+    return np.hypot(dx, dy)
+
+class Corridor:
+    """`path` buffered by `buffer_m`, covered by at most `max_tiles` tiles."""
+    def __init__(self, path: Sequence[Point], buffer_m: float, max_tiles: int = MAX_TILES):
+        self.buffer_m = float(buffer_m)
+        self.reach_m = self.buffer_m * REACH
+        pts = np.asarray(simplify(list(path), SIMPLIFY_M), dtype=np.float64).reshape(-1, 2)
+        if len(pts) < 2:
+            pts = np.vstack([pts, pts])
+        self.points = pts
+        self._cum = np.concatenate(([0.0], np.cumsum(_seg_lengths(pts))))
+        self.length_m = float(self._cum[-1])
+        # thin the stations until the corridor fits the tile budget
+        self.spacing_m = self.buffer_m
+        while True:
+            self.stations = self._stations(self.spacing_m)
+            self._tiles = {TILE_ZOOM: self._cover(TILE_ZOOM)}
+            if len(self._tiles[TILE_ZOOM]) <= max_tiles or self.spacing_m >= self.length_m:
+                break
+            self.spacing_m *= 2.0
+        self._tiles[TILE_ZOOM] = self._tiles[TILE_ZOOM][:max_tiles]
+
+    def _stations(self, spacing: float) -> List[Point]:
+        n = max(2, int(ceil(self.length_m / max(spacing, 1.0))) + 1)
+        at = np.linspace(0.0, self.length_m, n)
+        lat = np.interp(at, self._cum, self.points[:, 0])
+        lon = np.interp(at, self._cum, self.points[:, 1])
+        return list(zip(lat.tolist(), lon.tolist()))
+
+    def _cover(self, z: int) -> List[Tile]:
+        seen = {}
+        for lat, lon in self.stations:
+            for t in tiles_for_circle(lat, lon, self.reach_m, z):
+                seen.setdefault(t, None)
+        return list(seen)  # in route order, so tile batches stay compact
+
+    def tiles(self, z: int = TILE_ZOOM) -> List[Tile]:
+        if z not in self._tiles:
+            self._tiles[z] = self._cover(z)
+        return self._tiles[z]
+
+    @property
+    def sampled(self) -> bool:
+        """True when the tile budget left gaps between stations."""
+        return self.spacing_m > self.buffer_m
+
+    def summary(self) -> dict:
+        return {"length_km": round(self.length_m / 1000.0, 2), "buffer_m": round(self.buffer_m),
+                "stations": len(self.stations), "tiles": len(self.tiles()), "sampled": self.sampled}
+
+    def offsets(self, lat, lon, within_m: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(distance from the route, position along it) in meters per point.
+
+        With `within_m`, points farther than that from the route get inf
+        (only nearby segments are measured, which is much faster)."""
+        lat = np.asarray(lat, dtype=np.float64); lon = np.asarray(lon, dtype=np.float64)
+        off = np.full(len(lat), np.inf); along = np.zeros(len(lat))
+        a, b = self.points[:-1], self.points[1:]
+        # chunks of points sorted along the route's longer axis see few segments
+        ext = np.ptp(self.points, axis=0) * (_M_PER_DEG, _M_PER_DEG * cos(radians(float(self.points[0, 0]))))
+        axis = 0 if ext[0] >= ext[1] else 1
+        coord = lat if axis == 0 else lon
+        lo_seg = np.minimum(a[:, axis], b[:, axis]); hi_seg = np.maximum(a[:, axis], b[:, axis])
+        # a degree of longitude is shortest at the route's highest latitude
+        m_per_deg = _M_PER_DEG * (1.0 if axis == 0 else max(0.05, cos(radians(float(np.abs(self.points[:, 0]).max())))))
+        reach = np.inf if within_m is None else float(within_m)
+        pad = reach / m_per_deg
+        order = np.argsort(coord, kind="stable")
+        for s in range(0, len(order), _CHUNK):
+            rows = order[s:s + _CHUNK]
+            segs = np.flatnonzero((lo_seg <= coord[rows[-1]] + pad) & (hi_seg >= coord[rows[0]] - pad))
+            if not len(segs):
+                continue
+            sa, sb = a[segs], b[segs]
+            la = lat[rows, None]; lo = lon[rows, None]
+            kx = np.cos(np.radians(la)) * _M_PER_DEG
+            ax = (sa[:, 1] - lo) * kx; ay = (sa[:, 0] - la) * _M_PER_DEG
+            dx = (sb[:, 1] - lo) * kx - ax; dy = (sb[:, 0] - la) * _M_PER_DEG - ay
+            l2 = dx * dx + dy * dy
+            t = np.clip(-(ax * dx + ay * dy) / np.where(l2 > 0, l2, 1.0), 0.0, 1.0)
+            d2 = (ax + t * dx) ** 2 + (ay + t * dy) ** 2
+            j = d2.argmin(axis=1); r = np.arange(len(j))
+            d = np.sqrt(d2[r, j])
+            near = d <= reach
+            off[rows[near]] = d[near]
+            along[rows[near]] = (self._cum[segs[j]] + t[r, j] * np.sqrt(l2[r, j]))[near]
+        return off, along
+
+    def select(self, lat, lon, limit: Optional[int] = None) -> Tuple[List[int], np.ndarray]:
+        """Indices of the points inside the buffer, smallest detour first
+        (ties in route order), and their detours in meters."""
+        off, along = self.offsets(lat, lon, self.buffer_m)
+        idx = np.flatnonzero(off <= self.buffer_m)
+        idx = idx[np.lexsort((along[idx], off[idx]))][:limit]
+        return idx.tolist(), 2.0 * off[idx]
@@ -0,0 +1,271 @@
+"""trip_plan.json export: streamed, optionally compact and compressed.
+
+Three layouts of the same document:
+
+  pretty   the classic indented JSON (unchanged schema)
+  compact  no whitespace; lists of records (candidates, stops, route legs)
+           become column arrays with dictionary-encoded categories, and the
+           OpenStreetMap URL prefix is stored once as `url_base`
+  ndjson   one JSON record per line ({"record": "trip" | "candidate" |
+           "specific" | "stop" | "leg", ...}) for batch pipelines
+
+Output is written incrementally (one value or record at a time), so no full
+JSON string of the plan is ever built. gzip is built in; zstd needs the
+optional `zstandard` package. `load` reads any layout/compression back into
+the original schema.
+"""
+import io, json, gzip
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+from routeforge.candidates import OSM_BASE
+
+COMPACT_FORMAT = "routeforge-compact/1"
+NDJSON_FORMAT = "routeforge-ndjson/1"
+LAYOUTS = ("pretty", "compact", "ndjson")
+COMPRESSIONS = (None, "gzip", "zstd")
+EXTENSIONS = {"pretty": ".json", "compact": ".json", "ndjson": ".ndjson", "gzip": ".gz", "zstd": ".zst"}
+
+# top-level lists of records that go columnar in the compact layout
+_RECORD_LISTS = ("all_candidates", "specific_candidates", "selected_stops")
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def filename(layout: str = "pretty", compression: Optional[str] = None, stem: str = "trip_plan") -> str:
+    return stem + EXTENSIONS[layout] + (EXTENSIONS[compression] if compression else "")
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd output needs the optional 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+# =========================
+# Columnar records
+# =========================
+def _strip_url(url: Any) -> Any:
+    return url[len(OSM_BASE):] if isinstance(url, str) and url.startswith(OSM_BASE) else url
+
+def _restore_url(url: Any, base: str) -> Any:
+    return base + url if isinstance(url, str) and url and "://" not in url else url
+
+def to_columns(rows: List[Dict[str,Any]]) -> Dict[str,Any]:
+    """Records → {"n", "columns": {key: [...]}, "sparse": {key: {row: value}}}.
+
+    Keys present in every row become dense columns; the rest are stored
+    sparsely so `from_columns` restores each row exactly. `category` is
+    dictionary-encoded and URLs lose the OpenStreetMap prefix."""
+    n = len(rows)
+    counts: Dict[str,int] = {}
+    for r in rows:
+        for k in r:
+            counts[k] = counts.get(k, 0) + 1
+    cols: Dict[str,Any] = {}
+    sparse: Dict[str,Dict[str,Any]] = {}
+    for k, c in counts.items():
+        if c == n:
+            cols[k] = [r[k] for r in rows]
+        else:
+            sparse[k] = {str(i): r[k] for i, r in enumerate(rows) if k in r}
+    if "url" in cols:
+        cols["url"] = [_strip_url(u) for u in cols["url"]]
+    if "category" in cols and all(isinstance(c, str) for c in cols["category"]):
+        labels: Dict[str,int] = {}
+        codes = [labels.setdefault(c, len(labels)) for c in cols["category"]]
+        cols["category"] = {"labels": list(labels), "codes": codes}
+    out: Dict[str,Any] = {"n": n, "columns": cols}
+    if sparse:
+        out["sparse"] = sparse
+    return out
+
+def from_columns(block: Dict[str,Any], url_base: str = OSM_BASE) -> List[Dict[str,Any]]:
+    cols = dict(block.get("columns") or {})
+    cat = cols.get("category")
+    if isinstance(cat, dict):
+        cols["category"] = [cat["labels"][c] for c in cat["codes"]]
+    if "url" in cols:
+        cols["url"] = [_restore_url(u, url_base) for u in cols["url"]]
+    rows = [{k: v[i] for k, v in cols.items()} for i in range(int(block.get("n", 0)))]
+    for k, vals in (block.get("sparse") or {}).items():
+        for i, v in vals.items():
+            rows[int(i)][k] = v
+    return rows
+
+def _compact_doc(payload: Dict[str,Any]) -> Dict[str,Any]:
+    """Shallow rewrite: only the record lists are re-shaped; values are shared."""
+    doc: Dict[str,Any] = {"format": COMPACT_FORMAT, "url_base": OSM_BASE}
+    for k, v in payload.items():
+        if k in _RECORD_LISTS and isinstance(v, list):
+            doc[k] = to_columns(v)
+        elif k == "route" and isinstance(v, dict) and isinstance(v.get("legs"), list):
+            doc[k] = {**v, "legs": to_columns(v["legs"])}
+        else:
+            doc[k] = v
+    return doc
+
+# =========================
+# Streaming writers
+# =========================
+def iter_json(payload: Dict[str,Any], layout: str = "pretty", trip_id: Optional[str] = None) -> Iterator[str]:
+    """The document as text chunks: one top-level value (or list element)
+    at a time. `trip_id` tags NDJSON records."""
+    if layout == "ndjson":
+        yield from iter_ndjson(payload, trip_id)
+        return
+    compact = layout == "compact"
+    doc = _compact_doc(payload) if compact else payload
+    indent = None if compact else 2
+    seps = (",", ":") if compact else (",", ": ")
+    pad = "" if compact else "\n  "
+    yield "{"
+    for n, (k, v) in enumerate(doc.items()):
+        yield ("," if n else "") + pad + json.dumps(k) + seps[1]
+        if isinstance(v, list) and v and not compact:
+            # large lists go element by element
+            yield "["
+            for i, item in enumerate(v):
+                body = json.dumps(item, ensure_ascii=False, indent=indent, separators=seps)
+                yield ("," if i else "") + "\n    " + body.replace("\n", "\n    ")
+            yield "\n  ]"
+        else:
+            body = json.dumps(v, ensure_ascii=False, indent=indent, separators=seps)
+            yield body if compact else body.replace("\n", "\n  ")
+    yield ("\n" if not compact else "") + "}"
+
+def iter_ndjson(payload: Dict[str,Any], trip_id: Optional[str] = None) -> Iterator[str]:
+    """One line per record: the trip header first, then candidates, specific
+    candidates, selected stops and route legs."""
+    head: Dict[str,Any] = {"record": "trip", "format": NDJSON_FORMAT}
+    if trip_id is not None:
+        head["trip_id"] = trip_id
+    for k, v in payload.items():
+        # record lists (and route legs) keep their slot as null; the records follow
+        if k in _RECORD_LISTS:
+            head[k] = None
+        elif k == "route" and isinstance(v, dict) and "legs" in v:
+            head[k] = {**v, "legs": None}
+        else:
+            head[k] = v
+    dumps = lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")) + "\n"
+    yield dumps(head)
+    extra = {"trip_id": trip_id} if trip_id is not None else {}
+    for key, kind in (("all_candidates", "candidate"), ("specific_candidates", "specific"), ("selected_stops", "stop")):
+        for row in payload.get(key) or []:
+            yield dumps({"record": kind, **extra, **row})
+    for leg in (payload.get("route") or {}).get("legs") or []:
+        yield dumps({"record": "leg", **extra, **leg})
+
+class _Closing:
+    """Compressor wrapper whose close() finishes the stream but leaves the
+    caller's file open."""
+    def __init__(self, raw: BinaryIO, compression: Optional[str], level: Optional[int]):
+        self.raw = raw
+        if compression == "gzip":
+            self.w = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6 if level is None else level, mtime=0)
+        elif compression == "zstd":
+            self.w = _zstd().ZstdCompressor(level=3 if level is None else level).stream_writer(raw, closefd=False)
+        elif compression is None:
+            self.w = None
+        else:
+            raise ValueError(f"unknown compression {compression!r}")
+
+    def write(self, b: bytes):
+        (self.w or self.raw).write(b)
+
+    def close(self):
+        if self.w is not None:
+            self.w.close()
+
+def dump(payload: Dict[str,Any], fp: BinaryIO, layout: str = "pretty", compression: Optional[str] = None,
+         level: Optional[int] = None, chunk_bytes: int = 64 * 1024, trip_id: Optional[str] = None) -> None:
+    """Stream `payload` into the binary file `fp`."""
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown layout {layout!r}")
+    out = _Closing(fp, compression, level)
+    buf: List[str] = []
+    size = 0
+    for chunk in iter_json(payload, layout, trip_id):
+        buf.append(chunk); size += len(chunk)
+        if size >= chunk_bytes:
+            out.write("".join(buf).encode("utf-8")); buf.clear(); size = 0
+    if buf:
+        out.write("".join(buf).encode("utf-8"))
+    out.close()
+
+def dumps(payload: Dict[str,Any], layout: str = "pretty", compression: Optional[str] = None,
+          level: Optional[int] = None) -> bytes:
+    """Bytes for a download button; only the (compressed) output is held."""
+    bio = io.BytesIO()
+    dump(payload, bio, layout, compression, level)
+    return bio.getvalue()
+
+def save(payload: Dict[str,Any], path: str, layout: str = "pretty", compression: Optional[str] = None,
+         trip_id: Optional[str] = None) -> str:
+    with open(path, "wb") as f:
+        dump(payload, f, layout, compression, trip_id=trip_id)
+    return path
+
+# =========================
+# Loading
+# =========================
+def _decompressed(data: bytes) -> bytes:
+    if data[:2] == _GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == _ZSTD_MAGIC:
+        return _zstd().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+def from_ndjson(lines: Iterable[str]) -> Dict[str,Any]:
+    head: Dict[str,Any] = {}
+    records: Dict[str,List[Dict[str,Any]]] = {"candidate": [], "specific": [], "stop": [], "leg": []}
+    for line in lines:
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        kind = rec.pop("record")
+        rec.pop("trip_id", None)
+        if kind == "trip":
+            rec.pop("format", None)
+            head = rec
+        else:
+            records[kind].append(rec)
+    slots = {"all_candidates": "candidate", "specific_candidates": "specific", "selected_stops": "stop"}
+    out: Dict[str,Any] = {}
+    for k, v in head.items():
+        if k in slots and v is None:
+            v = records[slots[k]]
+        elif k == "route" and isinstance(v, dict) and "legs" in v and v["legs"] is None:
+            v = {**v, "legs": records["leg"]}
+        out[k] = v
+    return out
+
+def from_document(doc: Dict[str,Any]) -> Dict[str,Any]:
+    """A parsed pretty or compact document in the original schema."""
+    if doc.get("format") != COMPACT_FORMAT:
+        return doc
+    base = doc.get("url_base", OSM_BASE)
+    out: Dict[str,Any] = {}
+    for k, v in doc.items():
+        if k in ("format", "url_base"):
+            continue
+        if k in _RECORD_LISTS and isinstance(v, dict):
+            v = from_columns(v, base)
+        elif k == "route" and isinstance(v, dict) and isinstance(v.get("legs"), dict):
+            v = {**v, "legs": from_columns(v["legs"], base)}
+        out[k] = v
+    return out
+
+def load(src: Union[str, bytes, BinaryIO]) -> Dict[str,Any]:
+    """Read any layout/compression (path, bytes or binary file)."""
+    if isinstance(src, (bytes, bytearray)):
+        data = bytes(src)
+    elif isinstance(src, str):
+        with open(src, "rb") as f:
+            data = f.read()
+    else:
+        data = src.read()
+    text = _decompressed(data).decode("utf-8")
+    first = text.lstrip()[:64]
+    if first.startswith('{"record"'):
+        return from_ndjson(text.splitlines())
+    return from_document(json.loads(text))
@@ -0,0 +1,156 @@
+"""Small helpers for running the planning pipeline's network calls concurrently.
+
+`TaskGraph` runs named tasks on a thread pool as soon as their dependencies
+resolve, so independent geocodes and POI queries overlap and wall-clock time
+tracks the slowest chain rather than the sum of all calls. `first_by_priority`
+races fallback strategies speculatively and keeps the best-ranked answer.
+`SingleFlight` coalesces identical concurrent calls into one.
+"""
+import threading, contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+from routeforge.telemetry import fallback, run_in_context
+
+class TaskGraph:
+    """Dependency-ordered fan-out. Use as a context manager:
+
+        with TaskGraph() as g:
+            g.add("center", geocode, "Lahore")
+            g.add("pois", lambda c: overpass(c), deps=["center"])
+        g.result("pois")
+
+    A task's callable receives its dependencies' results as leading
+    positional arguments (in `deps` order) followed by `args`. If a
+    dependency fails the dependent task fails with the same exception.
+    """
+    def __init__(self, max_workers: int = 8):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rf-plan")
+        self._futures: Dict[str, Future] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # dependents are submitted from completion callbacks, so drain the
+        # graph before closing the pool to them
+        wait(list(self._futures.values()))
+        self._pool.shutdown(wait=True)
+
+    def add(self, name: str, fn: Callable, *args, deps: Sequence[str] = ()) -> Future:
+        if name in self._futures:
+            raise ValueError(f"duplicate task {name!r}")
+        out: Future = Future()
+        self._futures[name] = out
+        parents = [self._futures[d] for d in deps]
+        remaining = [len(parents)]
+        lock = threading.Lock()
+        ctx = contextvars.copy_context()  # the caller's trace follows the task
+
+        def launch():
+            try:
+                dep_vals = [p.result() for p in parents]
+            except BaseException as e:
+                out.set_exception(e)
+                return
+            inner = self._pool.submit(ctx.run, fn, *dep_vals, *args)
+            inner.add_done_callback(lambda f: _transfer(f, out))
+
+        def on_parent_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                launch()
+
+        if not parents:
+            launch()
+        for p in parents:
+            p.add_done_callback(on_parent_done)
+        return out
+
+    def future(self, name: str) -> Future:
+        return self._futures[name]
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        return self._futures[name].result(timeout=timeout)
+
+    def as_completed(self, timeout: Optional[float] = None) -> Iterator[str]:
+        """Names of the tasks added so far, in completion order. Runs on the
+        caller's thread, so it is safe for UI callbacks."""
+        names = {f: n for n, f in self._futures.items()}
+        for f in as_completed(list(names), timeout=timeout):
+            yield names[f]
+
+def _transfer(src: Future, dst: Future):
+    if src.cancelled():
+        dst.cancel()
+    elif src.exception() is not None:
+        dst.set_exception(src.exception())
+    else:
+        dst.set_result(src.result())
+
+def first_by_priority(strategies: List[Callable[[threading.Event], Any]], timeout: Optional[float] = None) -> Any:
+    """Run all strategies at once; return the first truthy result in list order.
+
+    Lower-ranked strategies start speculatively so a fallback is already in
+    flight when a preferred one comes back empty. Once a winner is known the
+    rest are cancelled: queued ones never start and running ones see their
+    `cancelled` event set (strategies should check it between upstream calls).
+    Exceptions count as an empty result. Returns the last result (falsy) if
+    nobody produced anything.
+    """
+    if not strategies:
+        return None
+    cancelled = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=len(strategies), thread_name_prefix="rf-race")
+    futs = [pool.submit(run_in_context(s, cancelled)) for s in strategies]
+    last = None
+    try:
+        for f in futs:
+            try:
+                last = f.result(timeout=timeout)
+            except Exception as e:
+                fallback("strategy-error", e)
+                last = None
+            if last:
+                return last
+        return last
+    finally:
+        cancelled.set()
+        for f in futs:
+            f.cancel()
+        pool.shutdown(wait=False)
+
+class SingleFlight:
+    """Coalesce identical in-flight calls: the first caller for a key runs
+    `fn`, concurrent callers with the same key wait for its outcome (result
+    or exception). Nothing is remembered once the call finishes."""
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(result, shared): `shared` is True for callers that waited."""
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._calls[key] = Future()
+        if not leader:
+            return fut.result(), True
+        try:
+            res = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(res)
+            return res, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,42 @@
+"""Great-circle distances, scalar and vectorized (NumPy).
+
+`haversine_matrix` builds a full many-to-many matrix in one pass and
+`haversine_to` measures one point against an array of candidates, so
+scoring thousands of POIs or filling the OSRM fallback matrix costs a few
+array operations instead of a Python double loop.
+"""
+from math import radians, sin, cos, asin, sqrt
+from typing import Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(a: Tuple[float,float], b: Tuple[float,float]) -> float:
+    lat1, lon1 = radians(a[0]), radians(a[1])
+    lat2, lon2 = radians(b[0]), radians(b[1])
+    dlat = lat2 - lat1; dlon = lon2 - lon1
+    h = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
+    return 2*EARTH_RADIUS_KM*asin(sqrt(h))
+
+def as_latlon(points) -> np.ndarray:
+    """(n, 2) float array of (lat, lon) from tuples, lists or an array."""
+    arr = np.asarray(points, dtype=np.float64)
+    return arr.reshape(-1, 2)
+
+def haversine_to(point: Tuple[float,float], lats, lons) -> np.ndarray:
+    """Distances (km) from one point to each of `lats`/`lons`."""
+    lat1 = np.radians(point[0]); lon1 = np.radians(point[1])
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    h = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def haversine_matrix(a: Sequence[Tuple[float,float]], b: Sequence[Tuple[float,float]] = None) -> np.ndarray:
+    """(len(a), len(b)) distance matrix in km; `b` defaults to `a`."""
+    pa = np.radians(as_latlon(a))
+    pb = pa if b is None else np.radians(as_latlon(b))
+    lat1 = pa[:, 0][:, None]; lon1 = pa[:, 1][:, None]
+    lat2 = pb[:, 0][None, :]; lon2 = pb[:, 1][None, :]
+    h = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
@@ -0,0 +1,379 @@
+"""Shared HTTP transport for the public OSM services.
+
+One pooled keep-alive `requests.Session` per host, bounded retries with
+jittered exponential backoff, per-host token-bucket rate limits (Nominatim's
+usage policy is 1 req/s), per-endpoint health (latency window, error rate)
+and hedged requests: `hedged_post_json` sends to the healthiest mirror and
+races the next one once the first runs past its usual latency percentile.
+Once one answers, attempts still waiting for a host slot or rate-limit
+token are dropped (`Superseded`), so a lost race doesn't hold a slot.
+
+Identical requests already in flight (same method, URL, parameters and
+body) are coalesced: later callers wait for the first one's response
+instead of hitting the upstream again. Each host also has a bounded number
+of concurrency slots (Overpass grants two per client IP); callers queue for
+a slot and get `UpstreamBusy` after `queue_timeout_s`, so overload turns
+into backpressure rather than a pile of upstream timeouts.
+"""
+import json, time, random, threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from routeforge.fanout import SingleFlight
+from routeforge.telemetry import UPSTREAM_QUEUE_SECONDS, record_coalesced, record_http, run_in_context, span
+
+_UA = {"User-Agent": "RouteForge/1.1 (no-keys; contact: https://github.com/vinabi)"}
+
+# host -> (requests per second, burst)
+DEFAULT_RATE_LIMITS: Dict[str, tuple] = {
+    "nominatim.openstreetmap.org": (1.0, 1),
+    "photon.komoot.io": (2.0, 2),
+    "router.project-osrm.org": (1.0, 2),
+}
+
+# host -> requests in flight at once (others queue)
+DEFAULT_CONCURRENCY: Dict[str, int] = {
+    "nominatim.openstreetmap.org": 2,
+    "photon.komoot.io": 4,
+    "router.project-osrm.org": 4,
+    "overpass-api.de": 2,
+    "overpass.kumi.systems": 2,
+    "z.overpass-api.de": 2,
+}
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class TransportError(RuntimeError):
+    pass
+
+class UpstreamBusy(TransportError):
+    """No concurrency slot for the host freed up within the queue timeout."""
+
+class Superseded(TransportError):
+    """A hedged attempt was dropped before it was sent: another mirror answered."""
+
+# =========================
+# Rate limiting
+# =========================
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.capacity = float(max(1, burst))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait_s = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+# =========================
+# Endpoint health
+# =========================
+class EndpointHealth:
+    """Rolling latency window plus success/failure counters for one endpoint."""
+    def __init__(self, window: int = 50):
+        self.latencies = deque(maxlen=window)
+        self.ok = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.last_failure_at = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency_s: float, success: bool):
+        with self._lock:
+            if success:
+                self.ok += 1
+                self.consecutive_failures = 0
+                self.latencies.append(latency_s)
+            else:
+                self.failed += 1
+                self.consecutive_failures += 1
+                self.last_failure_at = time.time()
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            xs = sorted(self.latencies)
+        if not xs:
+            return None
+        return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+    def score(self) -> float:
+        """Expected cost of using this endpoint (lower is better)."""
+        p50 = self.percentile(0.5)
+        total = self.ok + self.failed
+        err = self.failed / total if total else 0.0
+        base = p50 if p50 is not None else 5.0  # unknown endpoints rank mid-pack
+        # recent consecutive failures push an endpoint to the back for a while
+        penalty = 0.0
+        if self.consecutive_failures and time.time() - self.last_failure_at < 300:
+            penalty = 30.0 * self.consecutive_failures
+        return base * (1.0 + 4.0 * err) + penalty
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"ok": self.ok, "failed": self.failed,
+                "consecutive_failures": self.consecutive_failures,
+                "p50_s": self.percentile(0.5), "p90_s": self.percentile(0.9),
+                "score": round(self.score(), 3)}
+
+# =========================
+# Transport
+# =========================
+class Transport:
+    def __init__(self, rate_limits: Optional[Dict[str, tuple]] = None, retries: int = 2,
+                 backoff_s: float = 0.5, pool_size: int = 8, concurrency: Optional[Dict[str, int]] = None,
+                 default_concurrency: Optional[int] = None, queue_timeout_s: float = 60.0):
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.pool_size = pool_size
+        self._limits = dict(DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits)
+        self._concurrency = dict(DEFAULT_CONCURRENCY if concurrency is None else concurrency)
+        self.default_concurrency = default_concurrency or pool_size
+        self.queue_timeout_s = queue_timeout_s
+        self._sessions: Dict[str, requests.Session] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._flights = SingleFlight()
+        self._health: Dict[str, EndpointHealth] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="rf-hedge")
+
+    # ---- per-host state ----
+    def _session(self, host: str) -> requests.Session:
+        with self._lock:
+            s = self._sessions.get(host)
+            if s is None:
+                s = requests.Session()
+                s.headers.update(_UA)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                s.mount("https://", adapter); s.mount("http://", adapter)
+                self._sessions[host] = s
+            return s
+
+    def _bucket(self, host: str) -> Optional[TokenBucket]:
+        if host not in self._limits:
+            return None
+        with self._lock:
+            b = self._buckets.get(host)
+            if b is None:
+                b = self._buckets[host] = TokenBucket(*self._limits[host])
+            return b
+
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._slots.get(host)
+            if sem is None:
+                sem = self._slots[host] = threading.BoundedSemaphore(self._concurrency.get(host, self.default_concurrency))
+            return sem
+
+    def health(self, endpoint: str) -> EndpointHealth:
+        endpoint = _endpoint_key(endpoint)
+        with self._lock:
+            h = self._health.get(endpoint)
+            if h is None:
+                h = self._health[endpoint] = EndpointHealth()
+            return h
+
+    def health_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = list(self._health.items())
+        return {ep: h.snapshot() for ep, h in items}
+
+    def rank(self, endpoints: Sequence[str]) -> List[str]:
+        """Endpoints ordered healthiest first (stable for ties)."""
+        return sorted(endpoints, key=lambda ep: self.health(ep).score())
+
+    # ---- requests ----
+    def _acquire(self, slot: threading.BoundedSemaphore, host: str, cancelled: Optional[threading.Event]):
+        """Wait for a host slot; give up early once `cancelled` is set."""
+        deadline = time.monotonic() + self.queue_timeout_s
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise Superseded(host)
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise UpstreamBusy(f"{host}: no free upstream slot after {self.queue_timeout_s:.0f} s")
+            if slot.acquire(timeout=min(left, 0.25) if cancelled is not None else left):
+                return
+
+    def _once(self, method: str, url: str, timeout: float, cancelled: Optional[threading.Event] = None,
+              **kw) -> requests.Response:
+        host = urlsplit(url).netloc
+        slot = self._slot(host)
+        t_q = time.monotonic()
+        self._acquire(slot, host, cancelled)
+        try:
+            UPSTREAM_QUEUE_SECONDS.observe(time.monotonic() - t_q, host)
+            bucket = self._bucket(host)
+            if bucket:
+                bucket.acquire()
+            if cancelled is not None and cancelled.is_set():
+                raise Superseded(host)  # don't spend the slot on an answer nobody wants
+            endpoint = _endpoint_key(url)
+            t0 = time.monotonic()
+            with span("http", endpoint=endpoint):
+                try:
+                    r = self._session(host).request(method, url, timeout=timeout, **kw)
+                except requests.RequestException as e:
+                    dt = time.monotonic() - t0
+                    self.health(url).record(dt, False)
+                    record_http(endpoint, dt, type(e).__name__)
+                    raise
+            dt = time.monotonic() - t0
+            self.health(url).record(dt, r.status_code < 500 and r.status_code != 429)
+            record_http(endpoint, dt, "ok" if r.status_code < 400 else str(r.status_code))
+            return r
+        finally:
+            slot.release()
+
+    def _request_text(self, method: str, url: str, timeout: float, retries: int, **kw) -> str:
+        attempt = 0
+        while True:
+            try:
+                r = self._once(method, url, timeout, **kw)
+                if r.status_code in _RETRY_STATUS and attempt < retries:
+                    self._sleep_backoff(attempt, r.headers.get("Retry-After"))
+                    attempt += 1
+                    continue
+                r.raise_for_status()
+                return r.text
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
+                self._sleep_backoff(attempt, None)
+                attempt += 1
+
+    def _coalesced(self, key: tuple, endpoint: str, fn) -> Any:
+        # the shared value is the response text: every caller parses its own copy
+        text, shared = self._flights.do(key, fn)
+        if shared:
+            record_coalesced(endpoint)
+        return json.loads(text)
+
+    def request_json(self, method: str, url: str, timeout: float = 20, retries: Optional[int] = None, **kw) -> Any:
+        """JSON request with bounded retries on connection errors, 429 and 5xx."""
+        retries = self.retries if retries is None else retries
+        key = (method, url, json.dumps(kw.get("params"), sort_keys=True, default=str), _body_key(kw.get("data")))
+        return self._coalesced(key, _endpoint_key(url),
+                               lambda: self._request_text(method, url, timeout, retries, **kw))
+
+    def _sleep_backoff(self, attempt: int, retry_after: Optional[str]):
+        delay = self.backoff_s * (2 ** attempt)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        # full jitter keeps concurrent workers from retrying in lockstep
+        time.sleep(min(30.0, random.uniform(0, delay) + 0.05))
+
+    def get_json(self, url: str, params: Optional[dict] = None, timeout: float = 20, **kw) -> Any:
+        return self.request_json("GET", url, timeout=timeout, params=params or {}, **kw)
+
+    def post_json(self, url: str, data: Any = None, timeout: float = 90, **kw) -> Any:
+        return self.request_json("POST", url, timeout=timeout, data=data, **kw)
+
+    def hedged_post_json(self, endpoints: Sequence[str], data: Any, timeout: float = 90,
+                         hedge_percentile: float = 0.9, min_hedge_s: float = 2.0,
+                         default_hedge_s: float = 10.0) -> Any:
+        """POST to the healthiest endpoint; race the next mirror once the
+        current attempt outlives that endpoint's `hedge_percentile` latency, and
+        fail over immediately on errors. First successful response wins."""
+        key = ("HEDGED", tuple(sorted(endpoints)), _body_key(data))
+        return self._coalesced(key, _endpoint_key(endpoints[0]) if endpoints else "",
+                               lambda: self._hedged_text(endpoints, data, timeout, hedge_percentile,
+                                                         min_hedge_s, default_hedge_s))
+
+    def _hedged_text(self, endpoints: Sequence[str], data: Any, timeout: float, hedge_percentile: float,
+                     min_hedge_s: float, default_hedge_s: float) -> str:
+        order = self.rank(endpoints)
+        if not order:
+            raise TransportError("no endpoints")
+        pending = {}
+        last_err: Optional[BaseException] = None
+        nxt = 0
+        # set on return: losing attempts still queued for a slot or token drop out
+        cancelled = threading.Event()
+
+        def launch():
+            nonlocal nxt
+            ep = order[nxt]; nxt += 1
+            pending[self._hedge_pool.submit(run_in_context(self._request_text, "POST", ep, timeout, 0,
+                                                           data=data, cancelled=cancelled))] = ep
+            return ep
+
+        deadline = time.monotonic() + timeout
+        try:
+            current = launch()
+            while pending:
+                p = self.health(current).percentile(hedge_percentile)
+                hedge_after = max(min_hedge_s, p) if p is not None else default_hedge_s
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait_s = min(remaining, hedge_after) if nxt < len(order) else remaining
+                done, _ = wait(list(pending), timeout=wait_s, return_when=FIRST_COMPLETED)
+                if not done:
+                    if nxt < len(order):
+                        current = launch()  # slow: hedge with the next mirror
+                    continue
+                for f in done:
+                    pending.pop(f)
+                    try:
+                        return f.result()
+                    except Exception as e:
+                        last_err = e
+                if nxt < len(order):
+                    current = launch()  # failed: fail over right away
+        finally:
+            cancelled.set()
+            for f in pending:
+                f.cancel()
+        raise last_err or TransportError(f"all endpoints timed out: {list(order)}")
+
+def _body_key(data: Any) -> Any:
+    if data is None or isinstance(data, (str, bytes)):
+        return data
+    return json.dumps(data, sort_keys=True, default=str)
+
+def _endpoint_key(url: str) -> str:
+    """OSRM encodes coordinates in the path; health is tracked per service."""
+    parts = urlsplit(url)
+    path = parts.path
+    for svc in ("/table/", "/route/"):
+        if svc in path:
+            path = path.split(svc, 1)[0] + svc.rstrip("/")
+            break
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> Transport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
+
+def configure(transport: Optional[Transport] = None) -> Transport:
+    """Swap the process-wide transport (e.g. without rate limits for local stand-ins)."""
+    global _transport
+    with _transport_lock:
+        _transport = transport or Transport()
+    return _transport
@@ -0,0 +1,169 @@
+"""Incremental distance matrices from a pairwise leg cache.
+
+Every (mode, origin, destination) leg a routing backend returns is cached
+on its own, with coordinates snapped to 1e-5° (~1 m). `leg_matrix` rebuilds
+the n×n matrix from cached legs and asks the backend only for the rows and
+columns of points it has not seen, using OSRM's `sources` / `destinations`
+parameters. Adding or swapping a stop costs one row and one column instead
+of a full table, and a replan that only changes cost rates needs no
+network I/O at all.
+
+Local copies expire when the shared entry stops being fresh. Stale legs
+(past the "osrm-leg" TTL) are fetched again like missing ones, and only
+used if that fetch fails. Pairs the backend reports as unreachable are
+remembered locally for `UNREACHABLE_TTL_S`, so a replan does not ask for
+them again straight away. Each `leg_matrix` call counts as one cache
+lookup in the metrics: a hit when no leg had to be fetched.
+"""
+import math, time, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from routeforge.cache import Cache, get_cache
+from routeforge.telemetry import fallback, record_cache
+
+Point = Tuple[float,float]
+# fetch(coords, sources, destinations) -> OSRM-style table for those indices
+Fetch = Callable[[Sequence[Point], Optional[List[int]], Optional[List[int]]], Dict[str,Any]]
+
+# LegCache.get result for a pair the backend recently found unreachable
+UNREACHABLE: Tuple[float,float] = (math.inf, math.inf)
+UNREACHABLE_TTL_S = 600.0
+
+def snap(p: Point) -> Point:
+    return (round(float(p[0]), 5), round(float(p[1]), 5))
+
+class LegCache:
+    """Per-leg (duration_s, distance_m) store: a process-local LRU with
+    expiry in front of the shared cache backend (source "osrm-leg")."""
+    SOURCE = "osrm-leg"
+
+    def __init__(self, cache: Optional[Cache] = None, max_local: int = 200_000):
+        self._cache = cache
+        # key -> (expires_at, value)
+        self._local: "OrderedDict[str, Tuple[float, Tuple[float,float]]]" = OrderedDict()
+        self._max_local = max_local
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> Cache:
+        return self._cache or get_cache()
+
+    @classmethod
+    def key(cls, mode: str, a: Point, b: Point) -> str:
+        return f"{cls.SOURCE}:{mode}:{a[0]:.5f},{a[1]:.5f}:{b[0]:.5f},{b[1]:.5f}"
+
+    def get(self, mode: str, a: Point, b: Point) -> Optional[Tuple[Tuple[float,float], bool]]:
+        """(leg, fresh) or None if unknown; leg is (duration_s, distance_m)
+        or UNREACHABLE."""
+        k = self.key(mode, a, b)
+        now = time.time()
+        with self._lock:
+            hit = self._local.get(k)
+            if hit is not None:
+                if hit[0] > now:
+                    self._local.move_to_end(k)
+                    return hit[1], True
+                del self._local[k]
+        v = self.cache.peek(k, self.SOURCE, record=False)
+        if v is None:
+            return None
+        leg, fresh_for = (float(v[0][0]), float(v[0][1])), v[1]
+        if fresh_for > 0:
+            self._remember(k, leg, fresh_for)  # no longer than the shared copy stays fresh
+        return leg, fresh_for > 0
+
+    def put(self, mode: str, a: Point, b: Point, duration_s: float, distance_m: float):
+        k = self.key(mode, a, b)
+        self._remember(k, (duration_s, distance_m), self.cache.policy(self.SOURCE)[0])
+        self.cache.put(k, self.SOURCE, [duration_s, distance_m])
+
+    def put_unreachable(self, mode: str, a: Point, b: Point):
+        """Remember locally (only) that the backend found no route a → b."""
+        self._remember(self.key(mode, a, b), UNREACHABLE, UNREACHABLE_TTL_S)
+
+    def _remember(self, k: str, v: Tuple[float,float], ttl_s: float):
+        with self._lock:
+            self._local[k] = (time.time() + ttl_s, v)
+            self._local.move_to_end(k)
+            while len(self._local) > self._max_local:
+                self._local.popitem(last=False)
+
+_legs = LegCache()
+
+def leg_matrix(coords: Sequence[Point], mode: str, fetch: Fetch, legs: Optional[LegCache] = None) -> Dict[str,Any]:
+    """OSRM-shaped {"durations", "distances"} for `coords`, fetching only missing legs.
+
+    Also reports `fetched_pairs` (how many legs came from the backend) so
+    callers can tell a warm replan from a cold one.
+    """
+    legs = legs or _legs
+    pts = [snap(c) for c in coords]
+    n = len(pts)
+    dur: List[List[Optional[float]]] = [[None]*n for _ in range(n)]
+    dist: List[List[Optional[float]]] = [[None]*n for _ in range(n)]
+    unreachable = set()
+    stale: Dict[Tuple[int,int], Tuple[float,float]] = {}
+    for i in range(n):
+        for j in range(n):
+            if pts[i] == pts[j]:
+                dur[i][j] = dist[i][j] = 0.0
+                continue
+            hit = legs.get(mode, pts[i], pts[j])
+            if hit is None:
+                continue
+            leg, fresh = hit
+            if not fresh:
+                stale[(i, j)] = leg  # refetched below; kept in case that fails
+            elif leg is UNREACHABLE:
+                unreachable.add((i, j))
+            else:
+                dur[i][j], dist[i][j] = leg
+
+    # points whose legs to every other known point are cached; the rest are "new"
+    known_leg = lambda i, j: dur[i][j] is not None or (i, j) in unreachable
+    known, new = [], []
+    for i in range(n):
+        if all(known_leg(i, k) and known_leg(k, i) for k in known):
+            known.append(i)
+        else:
+            new.append(i)
+
+    fetched = 0
+    record_cache(LegCache.SOURCE, "miss" if new else "hit")
+    if new:
+        if len(known) <= 1:  # the first point is trivially "known"; this is a cold table
+            calls = [(None, None)]
+        else:
+            # new rows against everything, then known rows against new columns
+            calls = [(new, list(range(n))), (known, new)]
+        try:
+            for sources, destinations in calls:
+                table = fetch(coords, sources, destinations)
+                src = list(range(n)) if sources is None else sources
+                dst = list(range(n)) if destinations is None else destinations
+                t_dur = table.get("durations") or []
+                t_dist = table.get("distances") or []
+                for a, i in enumerate(src):
+                    for b, j in enumerate(dst):
+                        if i == j or pts[i] == pts[j]:
+                            continue
+                        try:
+                            dv, mv = t_dur[a][b], t_dist[a][b]
+                        except (IndexError, TypeError):
+                            continue
+                        if dv is None or mv is None:
+                            unreachable.add((i, j))
+                            legs.put_unreachable(mode, pts[i], pts[j])
+                            continue  # unreachable: leave for the caller's fallback
+                        dur[i][j], dist[i][j] = float(dv), float(mv)
+                        legs.put(mode, pts[i], pts[j], float(dv), float(mv))
+                        fetched += 1
+        except Exception as e:
+            if not stale:
+                raise
+            fallback("osrm-leg-stale", e)  # the stale legs beat a haversine guess
+        for (i, j), leg in stale.items():
+            if dur[i][j] is None and (i, j) not in unreachable:
+                dur[i][j], dist[i][j] = leg
+    return {"code": "Ok", "durations": dur, "distances": dist, "fetched_pairs": fetched}
@@ -0,0 +1,50 @@
+"""Folium map for a plan. folium is imported lazily so the planner (and the
+batch CLI) never pay for it.
+
+The route line is simplified for the zoom the map opens at (plus
+`DETAIL_ZOOMS` levels of headroom for zooming in), which cuts the HTML
+shipped to the browser for long `overview=full` routes by one to two
+orders of magnitude without a visible change at that scale.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from routeforge.polyline import fit_zoom, simplify, tolerance_m
+
+DETAIL_ZOOMS = 2
+
+def node_label(idx: int, count: int) -> str:
+    return "Origin" if idx==0 else ("Destination" if idx==count-1 else f"Stop {idx}")
+
+def map_line(geom: List[Tuple[float,float]], zoom: int) -> List[Tuple[float,float]]:
+    """`geom` reduced to what is visible at `zoom` + DETAIL_ZOOMS (~1 px)."""
+    lat = sum(p[0] for p in geom) / len(geom)
+    return simplify(geom, tolerance_m(zoom + DETAIL_ZOOMS, lat))
+
+def build_map(ordered_nodes: List[Dict[str,Any]], geom: Optional[List[Tuple[float,float]]] = None,
+              width_px: int = 900, height_px: int = 560):
+    import folium
+    mid_lat = sum(n["lat"] for n in ordered_nodes)/len(ordered_nodes)
+    mid_lon = sum(n["lon"] for n in ordered_nodes)/len(ordered_nodes)
+    extent = [(n["lat"], n["lon"]) for n in ordered_nodes] + list(geom or [])
+    zoom = fit_zoom(extent, width_px, height_px)
+    fmap = folium.Map(location=[mid_lat, mid_lon], zoom_start=zoom, control_scale=True)
+    if geom:
+        folium.PolyLine(map_line(geom, zoom), weight=4, opacity=0.8, color="#2E86AB").add_to(fmap)
+    for idx, n in enumerate(ordered_nodes):
+        label = node_label(idx, len(ordered_nodes))
+        popup = f"{label}: {n['name']}<br>({n['lat']:.5f}, {n['lon']:.5f})"
+        folium.Marker([n["lat"], n["lon"]], tooltip=label, popup=popup).add_to(fmap)
+    return fmap
+
+# endpoint markers first, then candidates, for the progressive preview
+PREVIEW_COLORS = {"endpoint": "#D7263D", "specific": "#F49D37", "candidate": "#2E86AB"}
+
+def preview_points(endpoints: List[Tuple[float,float]], places: List[Dict[str,Any]]) -> Dict[str,List[Any]]:
+    """Column data for `st.map`: endpoints plus the candidates found so far."""
+    lat, lon, color, size = [], [], [], []
+    for p in endpoints:
+        lat.append(p[0]); lon.append(p[1]); color.append(PREVIEW_COLORS["endpoint"]); size.append(120)
+    for p in places:
+        kind = "specific" if p.get("category") == "specific" else "candidate"
+        lat.append(p["lat"]); lon.append(p["lon"]); color.append(PREVIEW_COLORS[kind]); size.append(40)
+    return {"lat": lat, "lon": lon, "color": color, "size": size}
@@ -0,0 +1,160 @@
+"""Stop ordering for the fixed-start / fixed-end path used by `plan_route`.
+
+Node 0 is the origin and node n-1 the destination; everything in between is
+a stop to visit exactly once. Solvers take a (possibly asymmetric) weight
+matrix, so they can optimize distance, duration or the combined cost model.
+
+  held-karp     exact dynamic programme, O(2^m * m^2) for m stops
+  local-search  greedy start improved by 2-opt and Or-opt within a time budget
+  greedy        nearest-neighbour baseline
+
+`solve(..., solver="auto")` picks Held-Karp up to `exact_max` stops and
+local search beyond, and reports the gap to the greedy baseline.
+"""
+import time
+from typing import Callable, Dict, List, Sequence
+
+Matrix = Sequence[Sequence[float]]
+
+def path_cost(w: Matrix, order: Sequence[int]) -> float:
+    return sum(w[order[i]][order[i+1]] for i in range(len(order)-1))
+
+def weight_matrix(dist: Matrix, dur: Matrix, objective: str = "cost",
+                  cost_per_km: float = 0.0, time_value_per_hr: float = 0.0) -> List[List[float]]:
+    """Edge weights for `objective` in {"distance", "duration", "cost"}.
+
+    "cost" is the itinerary's budget model (km × cost_per_km + hr × time
+    value); with both rates at zero it degrades to duration.
+    """
+    n = len(dist)
+    if objective == "distance":
+        return [[float(dist[i][j] or 0) for j in range(n)] for i in range(n)]
+    if objective == "duration" or (objective == "cost" and not cost_per_km and not time_value_per_hr):
+        return [[float(dur[i][j] or 0) for j in range(n)] for i in range(n)]
+    if objective != "cost":
+        raise ValueError(f"unknown objective {objective!r}")
+    return [[(dist[i][j] or 0)/1000.0*cost_per_km + (dur[i][j] or 0)/3600.0*time_value_per_hr
+             for j in range(n)] for i in range(n)]
+
+# =========================
+# Solvers
+# =========================
+def greedy(w: Matrix, time_budget_s: float = 0.0) -> List[int]:
+    n = len(w)
+    if n <= 2:
+        return list(range(n))
+    unvisited = set(range(1, n-1))
+    route = [0]; curr = 0
+    while unvisited:
+        nxt = min(unvisited, key=lambda j: w[curr][j])
+        route.append(nxt); unvisited.remove(nxt); curr = nxt
+    route.append(n-1)
+    return route
+
+def held_karp(w: Matrix, time_budget_s: float = 0.0) -> List[int]:
+    """Exact shortest Hamiltonian path 0 → (all stops) → n-1."""
+    n = len(w)
+    m = n - 2
+    if m <= 1:
+        return list(range(n))
+    stops = list(range(1, n-1))
+    full = (1 << m) - 1
+    INF = float("inf")
+    # best[mask][k]: cheapest path from 0 covering `mask`, ending at stop k
+    best = [[INF]*m for _ in range(1 << m)]
+    parent = [[-1]*m for _ in range(1 << m)]
+    for k in range(m):
+        best[1 << k][k] = w[0][stops[k]]
+    rows = [[w[stops[a]][stops[b]] for b in range(m)] for a in range(m)]
+    for mask in range(1, full + 1):
+        bm = best[mask]
+        for k in range(m):
+            ck = bm[k]
+            if ck == INF or not (mask >> k) & 1:
+                continue
+            rk = rows[k]
+            for j in range(m):
+                if (mask >> j) & 1:
+                    continue
+                nm = mask | (1 << j)
+                c = ck + rk[j]
+                if c < best[nm][j]:
+                    best[nm][j] = c
+                    parent[nm][j] = k
+    last_row = [best[full][k] + w[stops[k]][n-1] for k in range(m)]
+    k = min(range(m), key=last_row.__getitem__)
+    seq = []
+    mask = full
+    while k != -1:
+        seq.append(stops[k])
+        k, mask = parent[mask][k], mask & ~(1 << k)
+    return [0] + seq[::-1] + [n-1]
+
+def local_search(w: Matrix, time_budget_s: float = 1.0) -> List[int]:
+    """Greedy start, then 2-opt and Or-opt moves until no improvement or
+    the time budget runs out. Moves are evaluated on full path cost so
+    asymmetric matrices (OSRM durations) are handled correctly."""
+    route = greedy(w)
+    n = len(route)
+    if n <= 3:
+        return route
+    deadline = time.monotonic() + max(0.0, time_budget_s)
+    best = path_cost(w, route)
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        # 2-opt: reverse route[i..j] (interior only)
+        for i in range(1, n-2):
+            for j in range(i+1, n-1):
+                cand = route[:i] + route[i:j+1][::-1] + route[j+1:]
+                c = path_cost(w, cand)
+                if c < best - 1e-9:
+                    route, best, improved = cand, c, True
+            if time.monotonic() >= deadline:
+                break
+        # Or-opt: move a segment of 1..3 stops to another position
+        for seg in (1, 2, 3):
+            for i in range(1, n-1-seg+1):
+                segment = route[i:i+seg]
+                rest = route[:i] + route[i+seg:]
+                for p in range(1, len(rest)):
+                    if p == i:
+                        continue
+                    cand = rest[:p] + segment + rest[p:]
+                    c = path_cost(w, cand)
+                    if c < best - 1e-9:
+                        route, best, improved = cand, c, True
+                        break
+                if time.monotonic() >= deadline:
+                    break
+    return route
+
+SOLVERS: Dict[str, Callable[[Matrix, float], List[int]]] = {
+    "greedy": greedy,
+    "held-karp": held_karp,
+    "local-search": local_search,
+}
+
+def register_solver(name: str, fn: Callable[[Matrix, float], List[int]]):
+    """Plug in another ordering engine: fn(weights, time_budget_s) -> order."""
+    SOLVERS[name] = fn
+
+def solve(w: Matrix, solver: str = "auto", time_budget_s: float = 1.0, exact_max: int = 12) -> Dict[str, object]:
+    """Order the stops of `w` and report how the answer compares to greedy.
+
+    Returns {"order", "solver", "cost", "greedy_cost", "improvement_pct"}.
+    """
+    n = len(w)
+    if solver == "auto":
+        solver = "held-karp" if n - 2 <= exact_max else "local-search"
+    if solver not in SOLVERS:
+        raise ValueError(f"unknown solver {solver!r}")
+    baseline = greedy(w)
+    base_cost = path_cost(w, baseline)
+    order = SOLVERS[solver](w, time_budget_s) if solver != "greedy" else baseline
+    cost = path_cost(w, order)
+    if cost > base_cost:  # a budget-limited heuristic must never lose to its own start
+        order, cost = baseline, base_cost
+    gain = (base_cost - cost) / base_cost * 100.0 if base_cost > 0 else 0.0
+    return {"order": order, "solver": solver, "cost": cost,
+            "greedy_cost": base_cost, "improvement_pct": round(gain, 2)}
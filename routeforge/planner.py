@@ -0,0 +1,462 @@
+"""Headless trip planner: geocode → discover → pick → route → report.
+
+    from routeforge.planner import plan_trip
+    plan = plan_trip({"origin": "Bahria Town, Lahore", "final_destination": "DHA Phase 7, Islamabad"})
+    plan["payload"]   # the trip_plan.json document
+    plan["markdown"]  # Itinerary.md
+
+`discover` (network-heavy) and `build_plan` (picking, ordering, totals) are
+also exposed separately so callers can reuse a discovery when only top_k,
+mode, the cost rates or the budget change.
+
+Stops are chosen by `select_stops` (selector "orienteering": fun against
+detour cost from every candidate, within the optional `budget` /
+`max_hours`) or by `score_and_pick` (selector "proximity": nearest to the
+destination, alternating sights and food).
+
+Candidates come from a circle of `radius_m` around the exploration city
+(discovery "city") or from a corridor along the origin → destination road
+(discovery "corridor", routeforge.corridor: `radius_m`, capped at 2 km, is
+the half-width), where they are ranked by detour instead of by distance.
+"""
+import json, hashlib, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from routeforge.candidates import CandidateStore, PointGrid
+from routeforge.corridor import MAX_BUFFER_M, Corridor
+from routeforge.fanout import TaskGraph
+from routeforge.geo import haversine_matrix
+from routeforge import orienteering, polyline
+from routeforge.ordering import solve, weight_matrix
+from routeforge.polyline import simplify
+from routeforge.services import (corridor_places, find_specific, geocode_best, geocode_fallbacks,
+                                 geocode_nominatim, overpass_places, route_geometry, route_table)
+from routeforge.telemetry import fallback, span, trace, traced
+
+DEFAULT_INPUTS: Dict[str,Any] = {
+    "origin": "", "final_destination": "", "city": "", "mode": "driving",
+    "top_k": 6, "radius_m": 4000, "cost_per_km": 0.25, "time_value_per_hr": 5.0,
+    "specific_need": "", "selector": "orienteering", "budget": 0.0, "max_hours": 0.0,
+    "discovery": "city",
+}
+SELECTORS = ("orienteering", "proximity")
+DISCOVERIES = ("city", "corridor")
+MAX_STOPS = 25
+# field names used by the notebook's trip_plan.json
+INPUT_ALIASES = {"city_for_guides": "city", "specific_need_free": "specific_need"}
+# inputs that change geocoding/discovery; everything else only re-picks/re-routes
+DISCOVERY_KEYS = ("origin", "final_destination", "city", "radius_m", "specific_need", "discovery")
+
+class PlanningError(ValueError):
+    """The trip can't be planned as requested (e.g. an address didn't geocode)."""
+
+def normalize_inputs(raw: Dict[str,Any]) -> Dict[str,Any]:
+    """Fill defaults and clamp to the ranges the UI allows."""
+    inputs = dict(DEFAULT_INPUTS)
+    for alias, key in INPUT_ALIASES.items():
+        if raw.get(alias) is not None and raw.get(key) is None:
+            inputs[key] = raw[alias]
+    inputs.update({k: v for k, v in raw.items() if k in DEFAULT_INPUTS and v is not None})
+    inputs["origin"] = str(inputs["origin"]).strip()
+    inputs["final_destination"] = str(inputs["final_destination"]).strip()
+    inputs["city"] = str(inputs["city"] or "").strip() or inputs["final_destination"]
+    inputs["specific_need"] = str(inputs["specific_need"] or "").strip()
+    if inputs["mode"] not in ("driving", "walking", "cycling"):
+        raise PlanningError(f"unknown mode {inputs['mode']!r}")
+    if inputs["selector"] not in SELECTORS:
+        raise PlanningError(f"unknown selector {inputs['selector']!r}")
+    if inputs["discovery"] not in DISCOVERIES:
+        raise PlanningError(f"unknown discovery {inputs['discovery']!r}")
+    inputs["top_k"] = min(MAX_STOPS, max(1, int(inputs["top_k"])))
+    inputs["radius_m"] = min(10000, max(500, int(inputs["radius_m"])))
+    inputs["cost_per_km"] = float(inputs["cost_per_km"])
+    inputs["time_value_per_hr"] = float(inputs["time_value_per_hr"])
+    inputs["budget"] = max(0.0, float(inputs["budget"] or 0))
+    inputs["max_hours"] = max(0.0, float(inputs["max_hours"] or 0))
+    if not inputs["origin"] or not inputs["final_destination"]:
+        raise PlanningError("origin and final_destination are required")
+    return inputs
+
+def discovery_key(inputs: Dict[str,Any]) -> tuple:
+    key = tuple(inputs[k] for k in DISCOVERY_KEYS)
+    # a corridor follows the road of the chosen mode
+    return key + (inputs["mode"],) if inputs["discovery"] == "corridor" else key
+
+def plan_fingerprint(inputs: Dict[str,Any]) -> str:
+    """Stable id of the plan normalized `inputs` produce (for UI/session caches)."""
+    blob = json.dumps(normalize_inputs(inputs), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+# on_progress(event, data): "center" / "origin" / "destination" get a geocode
+# (lat, lon, label) or None, "attractions" / "restaurants" / "specific" a list
+# of places, "plan" the finished plan. Called on the planning thread.
+Progress = Callable[[str, Any], None]
+_PROGRESS_EVENTS = {"center": "center", "origin": "origin", "dest": "destination",
+                    "attractions": "attractions", "restaurants": "restaurants", "specific": "specific"}
+
+# =========================
+# Discovery (network)
+# =========================
+@traced()
+def discover(inputs: Dict[str,Any], on_progress: Optional[Progress] = None) -> Dict[str,Any]:
+    """Geocode the endpoints and collect candidate stops.
+
+    Network stages run as a dependency graph: the exploration center gates
+    biased geocoding and POI discovery (the endpoints and their road
+    geometry gate corridor discovery), everything else overlaps. Partial
+    results are reported to `on_progress` as they arrive.
+    Raises PlanningError when the city or an endpoint can't be geocoded.
+    """
+    radius = int(inputs["radius_m"])
+    along = inputs["discovery"] == "corridor"
+    def _center():
+        return geocode_best(inputs["city"]) or geocode_best(inputs["final_destination"])
+    def _biased(pre, center, q):
+        # unbiased Nominatim already ran speculatively (and missed if `pre`
+        # is empty): go straight to the city-biased and Photon fallbacks
+        if pre: return pre
+        return geocode_fallbacks(q, bias_city=(center[0], center[1])) if center else None
+    def _discover(center, kind):
+        return overpass_places(center[0], center[1], radius, kind) if center else []
+    def _corridor(g1, g2):
+        if not g1 or not g2: return None
+        ends = [(g1[0], g1[1]), (g2[0], g2[1])]
+        path = route_geometry(ends, mode=inputs["mode"])
+        if not path:
+            fallback("corridor-straight")
+            path = ends
+        return Corridor(path, min(radius, MAX_BUFFER_M))
+    def _along(corridor, kind):
+        return corridor_places(corridor, kind) if corridor else []
+    def _specific(center, corridor=None):
+        if not center or not inputs["specific_need"]: return []
+        return find_specific((center[0], center[1]), radius, inputs["specific_need"], corridor)
+
+    with TaskGraph() as g:
+        g.add("center", _center)
+        g.add("origin_pre", geocode_nominatim, inputs["origin"])
+        g.add("dest_pre", geocode_nominatim, inputs["final_destination"])
+        g.add("origin", _biased, inputs["origin"], deps=["origin_pre", "center"])
+        g.add("dest", _biased, inputs["final_destination"], deps=["dest_pre", "center"])
+        if along:
+            # the corridor needs both endpoints and their road geometry first
+            g.add("corridor", _corridor, deps=["origin", "dest"])
+            g.add("attractions", _along, "attraction", deps=["corridor"])
+            g.add("restaurants", _along, "restaurant", deps=["corridor"])
+            g.add("specific", _specific, deps=["center", "corridor"])
+        else:
+            g.add("attractions", _discover, "attraction", deps=["center"])
+            g.add("restaurants", _discover, "restaurant", deps=["center"])
+            g.add("specific", _specific, deps=["center"])
+        if on_progress:
+            for name in g.as_completed():
+                f = g.future(name)
+                if name in _PROGRESS_EVENTS and f.exception() is None:
+                    on_progress(_PROGRESS_EVENTS[name], f.result())
+
+    g3 = g.result("center")
+    if not g3:
+        raise PlanningError("Could not geocode the exploration city/area or destination. Try a clearer city name.")
+    g1 = g.result("origin")
+    g2 = g.result("dest")
+    missing = []
+    if not g1: missing.append("origin")
+    if not g2: missing.append("destination")
+    if missing:
+        raise PlanningError(f"Could not geocode: {', '.join(missing)}. Try including city & country (e.g., 'Bahria Town, Lahore, Pakistan').")
+
+    places = g.result("attractions") + g.result("restaurants")
+    specific_found = g.result("specific")
+    # Merge and de-dup (specific finds first so they win ties)
+    store = CandidateStore.from_places((specific_found or []) + (places or []))
+    return {"key": discovery_key(inputs), "geocodes": (g1, g2, g3),
+            "specific_found": specific_found, "places": store,
+            "corridor": g.result("corridor") if along else None}
+
+# =========================
+# Routing
+# =========================
+@traced()
+def plan_route(origin: Tuple[float,float], dest: Tuple[float,float], stops: List[Dict[str,Any]], mode="driving",
+               objective: str = "cost", cost_per_km: float = 0.0, time_value_per_hr: float = 0.0,
+               solver: str = "auto", time_budget_s: float = 1.0) -> Dict[str,Any]:
+    coords = [origin] + [(p["lat"], p["lon"]) for p in stops] + [dest]
+    try:
+        table = route_table(coords, mode=mode)
+        dist = table.get("distances"); dur = table.get("durations")
+    except Exception as e:
+        fallback("routing-table", e)
+        dist = dur = None
+    # fallback to haversine if routing fails (whole table, or unreachable pairs)
+    speed_kmh = 40 if mode=="driving" else (5 if mode=="walking" else 15)
+    d = haversine_matrix(coords)
+    if not dist or not dur:
+        fallback("haversine-table")
+        dist = (d*1000).tolist()
+        dur = (d/speed_kmh*3600).tolist()
+    else:
+        missing = 0
+        for i in range(len(coords)):
+            for j in range(len(coords)):
+                if dist[i][j] is None or dur[i][j] is None:
+                    missing += 1
+                    dist[i][j] = float(d[i][j])*1000
+                    dur[i][j] = float(d[i][j])/speed_kmh*3600
+        if missing:
+            fallback("haversine-leg", detail=f"{missing} of {len(coords)**2} cells")
+    # order 0 -> visit all -> n-1 on the chosen objective (exact for small trips)
+    w = weight_matrix(dist, dur, objective, cost_per_km, time_value_per_hr)
+    with span("solve", solver=solver, stops=len(coords)-2):
+        sol = solve(w, solver=solver, time_budget_s=time_budget_s)
+    route = sol["order"]
+    legs, total_m, total_s = [], 0.0, 0.0
+    for i in range(len(route)-1):
+        a, b = route[i], route[i+1]
+        total_m += dist[a][b]; total_s += dur[a][b]
+        legs.append({"from_index": a, "to_index": b, "distance_m": dist[a][b], "duration_s": dur[a][b]})
+    return {"order": route, "legs": legs, "total_distance_m": total_m, "total_duration_s": total_s,
+            "solver": {"name": sol["solver"], "objective": objective, "cost": sol["cost"],
+                       "greedy_cost": sol["greedy_cost"], "improvement_pct": sol["improvement_pct"]}}
+
+# =========================
+# Picking & Markdown
+# =========================
+@traced()
+def score_and_pick(places, center: Tuple[float,float], top_k: int, force_specific: bool,
+                   detour_km: Optional[np.ndarray] = None) -> List[Dict[str,Any]]:
+    """`places` is a CandidateStore (or a list of place dicts); nearest to
+    `center` first, or smallest `detour_km` (one per candidate) if given."""
+    store = places if isinstance(places, CandidateStore) else CandidateStore.from_places(places)
+    if not len(store):
+        return []
+    dists = store.distances_to(center)
+    if detour_km is not None:
+        dists = detour_km
+    is_rest = store.category_mask("restaurant")
+    def by_dist(mask):
+        idx = np.flatnonzero(mask)
+        return idx[np.argsort(dists[idx], kind="stable")].tolist()
+    attractions = by_dist(~is_rest)
+    restaurants = by_dist(is_rest)
+    specifics = by_dist(store.category_mask("specific"))
+    picks = []
+    taken = PointGrid(cell_m=50.0, lat0=center[0])
+    def take(i):
+        # skip near-duplicates (within 10 m of an existing pick)
+        lat, lon = float(store.lat[i]), float(store.lon[i])
+        if taken.any_within(lat, lon, 10.0):
+            return
+        picks.append(store.row(i)); taken.add(lat, lon)
+    if force_specific and specifics:
+        take(specifics[0])
+    i=j=0
+    while len(picks) < max(2, top_k) and (i < len(attractions) or j < len(restaurants)):
+        if i < len(attractions):
+            take(attractions[i]); i+=1
+        if len(picks) >= top_k: break
+        if j < len(restaurants):
+            take(restaurants[j]); j+=1
+    return picks
+
+# orienteering search: wall-clock limit and candidate pool size
+SELECT_TIME_LIMIT_S = 0.5
+SELECT_POOL_MAX = 400
+# re-selections with tightened caps when the routed plan overruns its budget
+BUDGET_RETRIES = 2
+
+def _select_report(**kw) -> Dict[str,Any]:
+    return {"name": "orienteering", "candidates": 0, "fun": 0.0, "iterations": 0,
+            "seconds": 0.0, "feasible": True, **kw}
+
+@traced()
+def select_stops(places, origin: Tuple[float,float], dest: Tuple[float,float], inputs: Dict[str,Any],
+                 tighten: float = 1.0) -> Tuple[List[Dict[str,Any]], Dict[str,Any]]:
+    """Choose and order stops together from every candidate (orienteering).
+
+    Works on a straight-line estimate of the road matrix; `plan_route`
+    re-orders the picks on the real one. `tighten` (>= 1) scales the budget
+    caps down when the estimate proved optimistic. Returns the picks in
+    visiting order and the solver report.
+    """
+    store = places if isinstance(places, CandidateStore) else CandidateStore.from_places(places)
+    if not len(store):
+        return [], _select_report()
+    store.distances_to(dest)
+    # skip near-duplicates (within 10 m of an earlier candidate)
+    taken = PointGrid(cell_m=50.0, lat0=dest[0])
+    rows = []
+    for i in range(len(store)):
+        lat, lon = float(store.lat[i]), float(store.lon[i])
+        if not taken.any_within(lat, lon, 10.0):
+            rows.append(i); taken.add(lat, lon)
+    rows = np.asarray(rows)
+    cats = [store.category(i) for i in rows]
+    fun = orienteering.fun_scores([store.names[i] for i in rows], cats)
+    specific = np.asarray([c == "specific" for c in cats], dtype=bool) & bool(inputs["specific_need"])
+    if len(rows) > SELECT_POOL_MAX:
+        # keep the best fun-per-detour candidates (and the nearest specific ones)
+        d = haversine_matrix([origin, dest], np.column_stack((store.lat[rows], store.lon[rows])))
+        detour = (d[0] + d[1] - haversine_matrix([origin], [dest])[0, 0]) / max(d[0].max(), 1e-9)
+        keep = np.argsort(-(fun - detour), kind="stable")[:SELECT_POOL_MAX]
+        keep = np.union1d(keep, np.flatnonzero(specific)[np.argsort(detour[specific], kind="stable")[:20]])
+        rows, fun, specific = rows[keep], fun[keep], specific[keep]
+        cats = [cats[k] for k in keep]
+    codes = {c: k for k, c in enumerate(dict.fromkeys(cats))}
+    points = [origin] + list(zip(store.lat[rows].tolist(), store.lon[rows].tolist())) + [dest]
+    dist_m, dur_s = orienteering.estimate_matrices(points, inputs["mode"])
+    cpk, tv = inputs["cost_per_km"], inputs["time_value_per_hr"]
+    cost = dist_m / 1000.0 * cpk + dur_s / 3600.0 * tv
+    sol = orienteering.solve(
+        cost if (cpk or tv) else dur_s,
+        np.concatenate(([0.0], fun, [0.0])),
+        [0] + [codes[c] for c in cats] + [0],
+        max_stops=int(inputs["top_k"]),
+        required=(np.flatnonzero(specific) + 1).tolist(),
+        limits=[(cost, inputs["budget"] / tighten), (dur_s, inputs["max_hours"] * 3600.0 / tighten)],
+        time_limit_s=SELECT_TIME_LIMIT_S)
+    picks = [store.row(rows[k - 1]) for k in sol["order"][1:-1]]
+    return picks, _select_report(candidates=len(rows), fun=sol["fun"], iterations=sol["iterations"],
+                                 seconds=sol["seconds"], feasible=sol["feasible"])
+
+def _budget_overrun(route: Dict[str,Any], inputs: Dict[str,Any]) -> float:
+    """Routed total over the tightest cap (<= 1.0: within budget)."""
+    km = route["total_distance_m"] / 1000.0; hr = route["total_duration_s"] / 3600.0
+    ratio = 0.0
+    if inputs["budget"] > 0:
+        ratio = max(ratio, (km * inputs["cost_per_km"] + hr * inputs["time_value_per_hr"]) / inputs["budget"])
+    if inputs["max_hours"] > 0:
+        ratio = max(ratio, hr / inputs["max_hours"])
+    return ratio
+
+def make_markdown(inputs: Dict[str,Any], ordered_nodes: List[Dict[str,Any]], total_km: float, total_hr: float, cost_est: float) -> str:
+    lines = []
+    lines.append(f"# Trip Plan: {inputs['origin']} → {inputs['final_destination']}")
+    lines.append("")
+    lines.append("## Overview")
+    lines.append(f"- Mode: **{inputs['mode']}**")
+    how = ("most fun for the detour cost" if inputs.get("selector", "orienteering") == "orienteering"
+           else "proximity & diversity")
+    lines.append(f"- Stops before destination: **{len(ordered_nodes)-2}** of up to {inputs['top_k']} (auto-selected by {how})")
+    if inputs.get("discovery") == "corridor":
+        lines.append(f"- Search corridor: **{min(inputs['radius_m'], int(MAX_BUFFER_M))} m** either side of the route")
+    else:
+        lines.append(f"- Search radius: **{inputs['radius_m']} m**")
+    lines.append(f"- Total distance: **{total_km:.1f} km**, total time: **{total_hr:.1f} hr**, est. cost: **{cost_est:.2f}**")
+    if inputs.get("specific_need"):
+        lines.append(f"- Specific request honored: **{inputs['specific_need']}**")
+    lines.append("")
+    lines.append("## Ordered Stops")
+    for idx, n in enumerate(ordered_nodes):
+        label = "Origin" if idx==0 else ("Destination" if idx==len(ordered_nodes)-1 else f"Stop {idx}")
+        url = n.get("url","")
+        extra = f" — {n.get('category','')}" if n.get("category") else ""
+        if url:
+            lines.append(f"- **{label}:** [{n['name']}]({url}) ({n['lat']:.5f}, {n['lon']:.5f}){extra}")
+        else:
+            lines.append(f"- **{label}:** {n['name']} ({n['lat']:.5f}, {n['lon']:.5f}){extra}")
+    lines.append("")
+    lines.append("## Budget (Simple Model)")
+    lines.append(f"- Transport cost = distance_km × cost_per_km + hours × time_value_per_hr")
+    lines.append(f"- Using: cost_per_km = {inputs['cost_per_km']}, time_value_per_hr = {inputs['time_value_per_hr']}")
+    if inputs.get("budget"):
+        lines.append(f"- Budget cap: {inputs['budget']:.2f}")
+    if inputs.get("max_hours"):
+        lines.append(f"- Time cap: {inputs['max_hours']:.1f} hr")
+    lines.append(f"- **Estimated total: {cost_est:.2f}**")
+    lines.append("")
+    lines.append("## Notes")
+    lines.append("- Places sourced from OpenStreetMap; treat details as approximate.")
+    lines.append("- OSRM public server estimates travel time; traffic not included.")
+    return "\n".join(lines)
+
+# =========================
+# Pipeline
+# =========================
+@traced()
+def build_plan(inputs: Dict[str,Any], disc: Dict[str,Any]) -> Dict[str,Any]:
+    """Pick, order and cost the stops for a discovery result."""
+    g1, g2, g3 = disc["geocodes"]
+    places = disc["places"]
+    origin_xy = (g1[0], g1[1]); dest_xy = (g2[0], g2[1])
+
+    # Pick (with specific-stop guarantee), then order on the routing table
+    if inputs["selector"] == "orienteering":
+        picks, selection = select_stops(places, origin_xy, dest_xy, inputs)
+    else:
+        corridor = disc.get("corridor")
+        detour = (2.0 * corridor.offsets(places.lat, places.lon)[0] / 1000.0
+                  if corridor is not None and len(places) else None)
+        picks = score_and_pick(places, dest_xy, int(inputs["top_k"]), force_specific=bool(inputs["specific_need"]),
+                               detour_km=detour)
+        selection = {"name": "proximity"}
+    tighten = 1.0
+    for attempt in range(BUDGET_RETRIES + 1):
+        route = plan_route(origin_xy, dest_xy, picks, mode=inputs["mode"], objective="cost",
+                           cost_per_km=inputs["cost_per_km"], time_value_per_hr=inputs["time_value_per_hr"])
+        over = _budget_overrun(route, inputs)
+        if over <= 1.0 or selection["name"] != "orienteering" or not selection["feasible"] or attempt == BUDGET_RETRIES:
+            break
+        # the straight-line estimate was optimistic: select again under tighter caps
+        tighten *= over * 1.05
+        picks, selection = select_stops(places, origin_xy, dest_xy, inputs, tighten)
+    route["selection"] = {**selection, "within_budget": _budget_overrun(route, inputs) <= 1.0}
+    total_km = route["total_distance_m"]/1000.0
+    total_hr = route["total_duration_s"]/3600.0
+    cost_est = total_km*inputs["cost_per_km"] + total_hr*inputs["time_value_per_hr"]
+
+    # Ordered nodes for map/report
+    all_nodes = [{"name":"Origin","lat":origin_xy[0],"lon":origin_xy[1]}] + picks + [{"name":"Destination","lat":dest_xy[0],"lon":dest_xy[1]}]
+    ordered_nodes = [ all_nodes[i] for i in route["order"] ]
+
+    payload = {
+        "inputs": inputs,
+        "geocodes": {"origin": g1, "destination": g2, "center": g3},
+        "specific_candidates": disc["specific_found"],
+        "all_candidates": places.to_dicts(),
+        "selected_stops": picks,
+        "route": route,
+        "totals": {"distance_km": round(total_km,2), "duration_hr": round(total_hr,2), "cost_est": round(cost_est,2)},
+        "generated_at": datetime.datetime.utcnow().isoformat()+"Z"
+    }
+    if disc.get("corridor") is not None:
+        payload["corridor"] = disc["corridor"].summary()
+    return {"inputs": inputs, "picks": picks, "route": route, "ordered_nodes": ordered_nodes,
+            "total_km": total_km, "total_hr": total_hr, "cost_est": cost_est,
+            "markdown": make_markdown(inputs, ordered_nodes, total_km, total_hr, cost_est),
+            "payload": payload}
+
+def plan_trip(raw_inputs: Dict[str,Any], disc: Optional[Dict[str,Any]] = None,
+              on_progress: Optional[Progress] = None) -> Dict[str,Any]:
+    """Full pipeline. Pass a previous `discover` result to skip the network stages.
+
+    The payload's `timings` section summarizes the trace of this call
+    (stage seconds, upstream calls, cache hits, fallbacks).
+    """
+    with trace("plan_trip") as tr:
+        inputs = normalize_inputs(raw_inputs)
+        tr.attrs.update(origin=inputs["origin"], destination=inputs["final_destination"], mode=inputs["mode"])
+        reused = disc is not None and disc.get("key") == discovery_key(inputs)
+        if not reused:
+            disc = discover(inputs, on_progress)
+        plan = build_plan(inputs, disc)
+        plan["discovery"] = disc
+        plan["payload"]["timings"] = {**tr.summary(), "discovery_reused": reused}
+    if on_progress:
+        on_progress("plan", plan)
+    return plan
+
+# tolerance for the geometry stored in trip_plan.json: finer than any map needs
+PAYLOAD_GEOMETRY_TOLERANCE_M = 5.0
+
+def plan_geometry(plan: Dict[str,Any]) -> Optional[List[Tuple[float,float]]]:
+    """Road geometry through the plan's ordered stops (None if routing fails).
+
+    Also stored in the payload as `route.polyline`: an encoded polyline
+    (precision 5) simplified to PAYLOAD_GEOMETRY_TOLERANCE_M.
+    """
+    geom = route_geometry([(n["lat"], n["lon"]) for n in plan["ordered_nodes"]], mode=plan["inputs"]["mode"])
+    if geom:
+        plan["payload"]["route"]["polyline"] = polyline.encode(simplify(geom, PAYLOAD_GEOMETRY_TOLERANCE_M))
+    return geom
@@ -0,0 +1,336 @@
+"""Offline POI engine: OSM extract → memory-mapped, grid-indexed POI file.
+
+Build once per region, then answer `overpass_places`-style queries locally:
+
+    python -m routeforge.poi_offline build pakistan-latest.osm.pbf pk.rfpoi
+    python -m routeforge.poi_offline query pk.rfpoi 31.52 74.35 4000 restaurant
+
+Only the tags RouteForge uses are kept (tourism=attraction, amenity/leisure=
+park, amenity=restaurant/pharmacy/toilets/cafe). Nodes are stored as-is and
+ways by the centroid of their nodes. `.osm` XML is parsed with the standard
+library; `.osm.pbf` needs the optional `osmium` package (pyosmium).
+
+File layout (little-endian): 8-byte magic, u32 header length, JSON header,
+then 8-byte aligned sections — records sorted by grid cell, the cell
+directory (key / start / count) and a UTF-8 string blob. Everything is
+opened with `np.memmap`, so a region file costs no load time and only the
+cells a query touches are paged in.
+
+Set ROUTEFORGE_POI_FILE to make the app query this file before Overpass.
+"""
+import os, sys, json, argparse, threading
+import xml.etree.ElementTree as ET
+from math import floor, cos, radians
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from routeforge.geo import haversine_to
+
+MAGIC = b"RFPOI1\0\0"
+
+# tag bit -> (key, value)
+TAGS: List[Tuple[str,str]] = [
+    ("tourism", "attraction"),
+    ("amenity", "park"),
+    ("leisure", "park"),
+    ("amenity", "restaurant"),
+    ("amenity", "pharmacy"),
+    ("amenity", "toilets"),
+    ("amenity", "cafe"),
+]
+_TAG_BITS = {kv: 1 << i for i, kv in enumerate(TAGS)}
+# overpass_places kinds -> tag mask (mirrors the node selectors of
+# routeforge.tiles.tile_query)
+KIND_MASKS = {
+    "attraction": _TAG_BITS[("tourism","attraction")] | _TAG_BITS[("amenity","park")] | _TAG_BITS[("leisure","park")],
+    "restaurant": _TAG_BITS[("amenity","restaurant")],
+}
+_OSM_TYPES = ["node", "way", "relation"]
+
+RECORD = np.dtype([
+    ("lat", "<f8"), ("lon", "<f8"), ("osm_id", "<i8"),
+    ("name_off", "<u4"), ("addr_off", "<u4"),
+    ("name_len", "<u2"), ("addr_len", "<u2"),
+    ("tags", "<u2"), ("osm_type", "u1"), ("_pad", "u1"),
+])
+
+DEFAULT_CELL_DEG = 0.02  # ~2 km cells
+
+def amenity_mask(amenity: str) -> int:
+    return _TAG_BITS.get(("amenity", amenity), 0)
+
+def _tag_mask(tags: Dict[str,str]) -> int:
+    m = 0
+    for k, v in tags.items():
+        m |= _TAG_BITS.get((k, v), 0)
+    return m
+
+def _cell_key(ilat, ilon):
+    return np.asarray(ilat, dtype=np.int64) * (1 << 32) + (np.asarray(ilon, dtype=np.int64) + (1 << 31))
+
+# =========================
+# Extract readers
+# =========================
+# Each yields (osm_type, osm_id, lat, lon, tags) for matching features.
+def _iter_xml(path: str) -> Iterator[Tuple[str,int,float,float,Dict[str,str]]]:
+    # pass 1: ways we keep and the node refs they need for a centroid
+    ways: Dict[int, Tuple[Dict[str,str], List[int]]] = {}
+    needed = set()
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if _tag_mask(tags):
+                refs = [int(nd.get("ref")) for nd in el.iter("nd")]
+                ways[int(el.get("id"))] = (tags, refs)
+                needed.update(refs)
+            el.clear()
+        elif el.tag in ("node", "relation"):
+            el.clear()
+    # pass 2: tagged nodes + coordinates for way centroids
+    coords: Dict[int, Tuple[float,float]] = {}
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "node":
+            nid = int(el.get("id"))
+            lat, lon = float(el.get("lat")), float(el.get("lon"))
+            if nid in needed:
+                coords[nid] = (lat, lon)
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if _tag_mask(tags):
+                yield "node", nid, lat, lon, tags
+            el.clear()
+        elif el.tag in ("way", "relation"):
+            el.clear()
+    for wid, (tags, refs) in ways.items():
+        pts = [coords[r] for r in refs if r in coords]
+        if pts:
+            yield "way", wid, sum(p[0] for p in pts)/len(pts), sum(p[1] for p in pts)/len(pts), tags
+
+def _iter_pbf(path: str) -> Iterator[Tuple[str,int,float,float,Dict[str,str]]]:
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("reading .osm.pbf needs the optional 'osmium' package (pip install osmium)")
+    out: List[Tuple[str,int,float,float,Dict[str,str]]] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if _tag_mask(tags) and n.location.valid():
+                out.append(("node", n.id, n.location.lat, n.location.lon, tags))
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if not _tag_mask(tags):
+                return
+            pts = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if pts:
+                out.append(("way", w.id, sum(p[0] for p in pts)/len(pts), sum(p[1] for p in pts)/len(pts), tags))
+
+    Handler().apply_file(path, locations=True)
+    return iter(out)
+
+def read_extract(path: str) -> Iterator[Tuple[str,int,float,float,Dict[str,str]]]:
+    if path.endswith(".pbf"):
+        return _iter_pbf(path)
+    return _iter_xml(path)
+
+# =========================
+# Build
+# =========================
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+def build(src: str, dst: str, cell_deg: float = DEFAULT_CELL_DEG) -> Dict[str,Any]:
+    """Convert an OSM extract into a .rfpoi file; returns the header."""
+    rows = []
+    blob = bytearray()
+    strings: Dict[str,Tuple[int,int]] = {"": (0, 0)}
+
+    def intern(s: str) -> Tuple[int,int]:
+        hit = strings.get(s)
+        if hit is None:
+            # cut at 64 KiB on a codepoint boundary so the entry still decodes
+            b = s.encode("utf-8")[:65535].decode("utf-8", "ignore").encode("utf-8")
+            hit = strings[s] = (len(blob), len(b))
+            blob.extend(b)
+        return hit
+
+    for osm_type, osm_id, lat, lon, tags in read_extract(src):
+        n_off, n_len = intern(tags.get("name", ""))
+        a_off, a_len = intern(tags.get("addr:full", ""))
+        rows.append((lat, lon, osm_id, n_off, a_off, n_len, a_len, _tag_mask(tags), _OSM_TYPES.index(osm_type), 0))
+
+    rec = np.array(rows, dtype=RECORD)
+    if len(rec):
+        keys = _cell_key(np.floor(rec["lat"] / cell_deg), np.floor(rec["lon"] / cell_deg))
+        order = np.argsort(keys, kind="stable")
+        rec = rec[order]; keys = keys[order]
+        cell_keys, cell_starts, cell_counts = np.unique(keys, return_index=True, return_counts=True)
+        bbox = [float(rec["lat"].min()), float(rec["lon"].min()), float(rec["lat"].max()), float(rec["lon"].max())]
+    else:
+        cell_keys = cell_starts = cell_counts = np.empty(0, dtype=np.int64)
+        bbox = None
+
+    sections = [("records", rec.tobytes()),
+                ("cell_keys", cell_keys.astype("<i8").tobytes()),
+                ("cell_starts", cell_starts.astype("<i8").tobytes()),
+                ("cell_counts", cell_counts.astype("<i8").tobytes()),
+                ("strings", bytes(blob))]
+    header = {"version": 1, "count": int(len(rec)), "cells": int(len(cell_keys)), "cell_deg": cell_deg,
+              "bbox": bbox, "tags": [f"{k}={v}" for k, v in TAGS], "source": os.path.basename(src)}
+    # offsets depend on the header length, so size the header with placeholders first
+    header["offsets"] = {name: 10**12 for name, _ in sections}
+    hbytes = json.dumps(header).encode("utf-8")
+    pos = _align8(len(MAGIC) + 4 + len(hbytes))
+    offsets = {}
+    for name, data in sections:
+        offsets[name] = pos
+        pos = _align8(pos + len(data))
+    header["offsets"] = offsets
+    hbytes = json.dumps(header).encode("utf-8").ljust(len(hbytes))
+    tmp = dst + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC); f.write(len(hbytes).to_bytes(4, "little")); f.write(hbytes)
+        for name, data in sections:
+            f.seek(offsets[name]); f.write(data)
+        f.truncate(pos)
+    os.replace(tmp, dst)
+    return header
+
+# =========================
+# Query
+# =========================
+class OfflinePOIIndex:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a RouteForge POI file")
+            hlen = int.from_bytes(f.read(4), "little")
+            self.header = json.loads(f.read(hlen).decode("utf-8"))
+        off = self.header["offsets"]
+        n, c = self.header["count"], self.header["cells"]
+        self.cell_deg = float(self.header["cell_deg"])
+        mm = lambda name, dtype, count: (np.memmap(path, dtype=dtype, mode="r", offset=off[name], shape=(count,))
+                                         if count else np.empty(0, dtype=dtype))
+        self.records = mm("records", RECORD, n)
+        self.cell_keys = mm("cell_keys", "<i8", c)
+        self.cell_starts = mm("cell_starts", "<i8", c)
+        self.cell_counts = mm("cell_counts", "<i8", c)
+        size = os.path.getsize(path) - off["strings"]
+        self.strings = mm("strings", "u1", size)
+
+    def __len__(self):
+        return self.header["count"]
+
+    def covers(self, lat: float, lon: float) -> bool:
+        """True if (lat, lon) lies inside the extract's POI bounding box."""
+        bb = self.header.get("bbox")
+        return bool(bb) and bb[0] <= lat <= bb[2] and bb[1] <= lon <= bb[3]
+
+    def _text(self, off: int, length: int) -> str:
+        return bytes(self.strings[off:off+length]).decode("utf-8") if length else ""
+
+    def query(self, lat: float, lon: float, radius_m: float, mask: int, limit: Optional[int] = None) -> np.ndarray:
+        """Records within `radius_m` carrying any tag in `mask`, nearest first."""
+        if not len(self.records):
+            return self.records[:0]
+        dlat = radius_m / 110540.0
+        dlon = radius_m / (111320.0 * max(0.05, cos(radians(lat))))
+        i0, i1 = floor((lat - dlat) / self.cell_deg), floor((lat + dlat) / self.cell_deg)
+        j0, j1 = floor((lon - dlon) / self.cell_deg), floor((lon + dlon) / self.cell_deg)
+        parts = []
+        for i in range(i0, i1 + 1):
+            lo = int(_cell_key(i, j0)); hi = int(_cell_key(i, j1))
+            a = int(np.searchsorted(self.cell_keys, lo, side="left"))
+            b = int(np.searchsorted(self.cell_keys, hi, side="right"))
+            if a < b:
+                s = int(self.cell_starts[a]); e = int(self.cell_starts[b-1] + self.cell_counts[b-1])
+                parts.append(self.records[s:e])  # a row's cells are contiguous in key order
+        if not parts:
+            return self.records[:0]
+        cand = np.concatenate(parts)
+        cand = cand[(cand["tags"] & mask) != 0]
+        if not len(cand):
+            return cand
+        d = haversine_to((lat, lon), cand["lat"], cand["lon"]) * 1000.0
+        keep = d <= radius_m
+        cand, d = cand[keep], d[keep]
+        cand = cand[np.argsort(d, kind="stable")]
+        return cand[:limit] if limit else cand
+
+    def _rows(self, recs: np.ndarray, category: str, default_name: str) -> List[Dict[str,Any]]:
+        out = []
+        for r in recs:
+            out.append({
+                "name": self._text(int(r["name_off"]), int(r["name_len"])) or default_name,
+                "lat": float(r["lat"]), "lon": float(r["lon"]),
+                "category": category,
+                "address": self._text(int(r["addr_off"]), int(r["addr_len"])),
+                "url": f"https://www.openstreetmap.org/{_OSM_TYPES[int(r['osm_type'])]}/{int(r['osm_id'])}",
+            })
+        return out
+
+    def places(self, lat: float, lon: float, radius_m: int, kind: str, limit: Optional[int] = None) -> List[Dict[str,Any]]:
+        """Same output shape as `overpass_places`."""
+        mask = KIND_MASKS["restaurant" if kind == "restaurant" else "attraction"]
+        if limit is None:
+            limit = 120 if kind == "restaurant" else 150
+        return self._rows(self.query(lat, lon, radius_m, mask, limit), kind, "Unnamed")
+
+    def amenity(self, lat: float, lon: float, radius_m: int, amenity: str, limit: int = 150) -> List[Dict[str,Any]]:
+        """Same output shape as the amenity branch of `find_specific`."""
+        mask = amenity_mask(amenity)
+        if not mask:
+            return []
+        return self._rows(self.query(lat, lon, radius_m, mask, limit), "specific", amenity.title())
+
+_default: Optional[OfflinePOIIndex] = None
+_default_path: Optional[str] = None
+_default_lock = threading.Lock()
+
+def get_default_index() -> Optional[OfflinePOIIndex]:
+    """Index named by ROUTEFORGE_POI_FILE, or None when unset/unreadable."""
+    global _default, _default_path
+    path = os.environ.get("ROUTEFORGE_POI_FILE", "").strip() or None
+    if path != _default_path:
+        with _default_lock:
+            if path != _default_path:  # another thread may have opened it meanwhile
+                try:
+                    index = OfflinePOIIndex(path) if path else None
+                except (OSError, ValueError):
+                    index = None
+                # publish the index before the path, so a reader that sees the path sees its index
+                _default = index
+                _default_path = path
+    return _default
+
+# =========================
+# CLI
+# =========================
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m routeforge.poi_offline", description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="convert an .osm / .osm.pbf extract into a .rfpoi file")
+    b.add_argument("extract"); b.add_argument("output")
+    b.add_argument("--cell-deg", type=float, default=DEFAULT_CELL_DEG)
+    q = sub.add_parser("query", help="radius query against a .rfpoi file")
+    q.add_argument("poi_file"); q.add_argument("lat", type=float); q.add_argument("lon", type=float)
+    q.add_argument("radius_m", type=int); q.add_argument("kind", help="attraction, restaurant, or an amenity (cafe, pharmacy, toilets)")
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        h = build(args.extract, args.output, cell_deg=args.cell_deg)
+        print(f"wrote {args.output}: {h['count']} POIs in {h['cells']} cells, bbox={h['bbox']}")
+    else:
+        idx = OfflinePOIIndex(args.poi_file)
+        if args.kind in ("attraction", "restaurant"):
+            rows = idx.places(args.lat, args.lon, args.radius_m, args.kind)
+        else:
+            rows = idx.amenity(args.lat, args.lon, args.radius_m, args.kind)
+        for r in rows:
+            print(json.dumps(r, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
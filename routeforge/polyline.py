@@ -0,0 +1,136 @@
+"""Route geometry: encoded polylines and zoom-aware simplification.
+
+  encode / decode   Google's encoded polyline format (precision 5, or 6 for
+                    OSRM's `polyline6`); ~5x smaller than GeoJSON arrays
+  simplify          Douglas–Peucker in a local metric projection
+  tolerance_m       ground size of `px` screen pixels at a web-map zoom
+  fit_zoom          largest zoom at which a bounding box fits a viewport
+  split_at          cut a multi-stop geometry into per-leg pieces
+
+A route drawn at zoom z never needs detail below the ground size of a
+pixel, so `simplify(points, tolerance_m(z, lat))` keeps the line visually
+identical while dropping most vertices of a long `overview=full` route.
+"""
+from math import cos, log2, radians
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+Point = Tuple[float,float]
+
+_M_PER_DEG = 111_320.0
+_WEB_MERCATOR_M_PER_PX = 156_543.03392  # at zoom 0, equator, 256 px tiles
+
+# =========================
+# Encoding
+# =========================
+def encode(points: Sequence[Point], precision: int = 5) -> str:
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat = int(round(lat * factor)); ilon = int(round(lon * factor))
+        for d in (ilat - prev_lat, ilon - prev_lon):
+            v = ~(d << 1) if d < 0 else d << 1
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1F)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+def decode(s: str, precision: int = 5) -> List[Point]:
+    factor = float(10 ** precision)
+    points = []
+    i = lat = lon = 0
+    n = len(s)
+    while i < n:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(s[i]) - 63; i += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]; lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+# =========================
+# Simplification
+# =========================
+def _project(points: Sequence[Point]) -> np.ndarray:
+    a = np.asarray(points, dtype=np.float64)
+    lat0 = radians(float(a[:, 0].mean()))
+    return np.column_stack((a[:, 1] * _M_PER_DEG * cos(lat0), a[:, 0] * _M_PER_DEG))
+
+def simplify(points: Sequence[Point], tolerance_m: float) -> List[Point]:
+    """Douglas–Peucker: drop vertices closer than `tolerance_m` to the
+    simplified line. Endpoints are always kept."""
+    n = len(points)
+    if n <= 2 or tolerance_m <= 0:
+        return list(points)
+    xy = _project(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    tol2 = tolerance_m * tolerance_m
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = xy[b] - xy[a]
+        rel = xy[a+1:b] - xy[a]
+        seg2 = float(seg @ seg)
+        if seg2 == 0.0:
+            d2 = (rel * rel).sum(axis=1)
+        else:
+            t = np.clip(rel @ seg / seg2, 0.0, 1.0)
+            diff = rel - np.outer(t, seg)
+            d2 = (diff * diff).sum(axis=1)
+        k = int(np.argmax(d2))
+        if d2[k] > tol2:
+            m = a + 1 + k
+            keep[m] = True
+            stack.append((a, m)); stack.append((m, b))
+    return [points[i] for i in np.flatnonzero(keep)]
+
+def tolerance_m(zoom: float, lat: float, px: float = 1.0) -> float:
+    return _WEB_MERCATOR_M_PER_PX * max(0.05, cos(radians(lat))) / (2.0 ** zoom) * px
+
+def fit_zoom(points: Sequence[Point], width_px: int = 900, height_px: int = 560, max_zoom: int = 18) -> int:
+    a = np.asarray(points, dtype=np.float64)
+    lat = float(a[:, 0].mean())
+    span_x = (a[:, 1].max() - a[:, 1].min()) * _M_PER_DEG * max(0.05, cos(radians(lat)))
+    span_y = (a[:, 0].max() - a[:, 0].min()) * _M_PER_DEG
+    need = max(span_x / width_px, span_y / height_px, 1e-9)  # metres per pixel
+    z = log2(_WEB_MERCATOR_M_PER_PX * max(0.05, cos(radians(lat))) / need)
+    return int(max(0, min(max_zoom, z)))
+
+# =========================
+# Per-leg splitting
+# =========================
+def split_at(geom: Sequence[Point], leg_m: Sequence[float]) -> List[List[Point]]:
+    """Cut `geom` into len(leg_m) legs where its along-route length reaches
+    the running total of `leg_m` (OSRM's per-leg `distance`, rescaled to the
+    geometry's own length). Distance, unlike nearness to a waypoint, is not
+    fooled by a route that passes a later waypoint earlier. Adjacent legs
+    share their joint vertex."""
+    k = len(leg_m)
+    if k < 1 or len(geom) < 2:
+        return [list(geom)] if k == 1 else []
+    xy = _project(geom)
+    cum = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))))
+    total = float(sum(leg_m))
+    targets = np.cumsum(leg_m)[:-1] * (cum[-1] / total if total > 0 else 0.0)
+    cuts = [0]
+    n = len(geom)
+    for i, at in enumerate(targets, 1):
+        lo = cuts[-1]
+        hi = max(lo + 1, n - (k - i))  # leave a vertex for every later leg
+        cuts.append(lo + int(np.argmin(np.abs(cum[lo:hi] - at))))
+    cuts.append(n - 1)
+    return [list(geom[cuts[i]:cuts[i+1] + 1]) for i in range(k)]
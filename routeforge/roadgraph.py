@@ -0,0 +1,679 @@
+"""Local routing engine: OSM road graph + contraction hierarchies.
+
+Build a routing file once per region, offline:
+
+    python -m routeforge.roadgraph build lahore.osm.pbf lahore.rfroute.npz
+    python -m routeforge.roadgraph table lahore.rfroute.npz driving 31.52,74.35 31.47,74.27
+
+then set ROUTEFORGE_ROUTER=lahore.rfroute.npz and the app answers distance
+tables and route geometries for driving / walking / cycling locally instead
+of calling router.project-osrm.org (which stays the default and the
+fallback for points outside the extract).
+
+Only junctions (nodes shared by several ways, and way ends) become graph
+vertices: the degree-2 chains between them collapse into one edge each,
+and their intermediate coordinates are kept for snapping and for route
+geometry. Contraction runs in pure Python, so builds are meant for
+city-sized extracts (a few hundred thousand junctions); country extracts
+take hours and several GB.
+
+Each profile gets its own contraction hierarchy: nodes are contracted in
+edge-difference order with bounded witness searches, and the upward
+forward/backward graphs (CSR arrays, with the contracted middle node of
+every shortcut) are stored in a NumPy .npz file. Many-to-many tables use the
+bucket algorithm — one backward upward search per target, one forward
+upward search per source — so an n×m table costs n+m small searches rather
+than n×m shortest-path queries. Output matches OSRM's table/route shape.
+"""
+import os, sys, json, math, heapq, argparse, threading
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from routeforge.candidates import GridIndex
+from routeforge.geo import haversine_km
+
+PROFILES = ("driving", "walking", "cycling")
+
+# highway=* -> km/h per profile; missing means "not routable for this profile"
+SPEEDS: Dict[str, Dict[str, float]] = {
+    "driving": {
+        "motorway": 100, "motorway_link": 60, "trunk": 80, "trunk_link": 50,
+        "primary": 65, "primary_link": 45, "secondary": 55, "secondary_link": 40,
+        "tertiary": 45, "tertiary_link": 35, "unclassified": 35, "road": 30,
+        "residential": 25, "living_street": 10, "service": 15,
+    },
+    "cycling": {
+        "primary": 16, "primary_link": 16, "secondary": 16, "secondary_link": 16,
+        "tertiary": 16, "tertiary_link": 16, "unclassified": 16, "road": 15,
+        "residential": 15, "living_street": 12, "service": 12, "cycleway": 18,
+        "path": 12, "track": 12, "footway": 6, "pedestrian": 6,
+    },
+    "walking": {
+        "primary": 5, "primary_link": 5, "secondary": 5, "secondary_link": 5,
+        "tertiary": 5, "tertiary_link": 5, "unclassified": 5, "road": 5,
+        "residential": 5, "living_street": 5, "service": 5, "cycleway": 5,
+        "path": 5, "track": 5, "footway": 5, "pedestrian": 5, "steps": 3,
+    },
+}
+# snapping offset (coordinate -> nearest road point) is costed at this speed
+_SNAP_KMH = {"driving": 15.0, "cycling": 12.0, "walking": 5.0}
+FORMAT_VERSION = 2
+
+Point = Tuple[float,float]
+Anchor = Tuple[int,float]   # (segment, metres from its first vertex)
+
+# =========================
+# Extract readers
+# =========================
+# Each yields (highway_tags, [node ids]) for ways with a highway tag, and
+# fills `coords` with the coordinates of every node those ways reference.
+def _ways_xml(path: str, coords: Dict[int, Tuple[float,float]]) -> List[Tuple[Dict[str,str], List[int]]]:
+    ways = []
+    needed = set()
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in el.iter("tag")}
+            if "highway" in tags:
+                refs = [int(nd.get("ref")) for nd in el.iter("nd")]
+                ways.append((tags, refs))
+                needed.update(refs)
+            el.clear()
+        elif el.tag in ("node", "relation"):
+            el.clear()
+    for _, el in ET.iterparse(path, events=("end",)):
+        if el.tag == "node":
+            nid = int(el.get("id"))
+            if nid in needed:
+                coords[nid] = (float(el.get("lat")), float(el.get("lon")))
+            el.clear()
+        elif el.tag in ("way", "relation"):
+            el.clear()
+    return ways
+
+def _ways_pbf(path: str, coords: Dict[int, Tuple[float,float]]) -> List[Tuple[Dict[str,str], List[int]]]:
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("reading .osm.pbf needs the optional 'osmium' package (pip install osmium)")
+    ways = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            if "highway" not in w.tags:
+                return
+            refs = []
+            for nd in w.nodes:
+                if nd.location.valid():
+                    coords[nd.ref] = (nd.lat, nd.lon)
+                    refs.append(nd.ref)
+            ways.append(({t.k: t.v for t in w.tags}, refs))
+
+    Handler().apply_file(path, locations=True)
+    return ways
+
+def _oneway(tags: Dict[str,str], profile: str) -> int:
+    """1 forward only, -1 reverse only, 0 both directions."""
+    if profile == "walking":
+        return 0
+    if profile == "cycling" and tags.get("oneway:bicycle") == "no":
+        return 0
+    ow = tags.get("oneway", "")
+    if ow in ("yes", "1", "true"):
+        return 1
+    if ow == "-1":
+        return -1
+    if tags.get("highway") in ("motorway", "motorway_link") or tags.get("junction") == "roundabout":
+        return 1
+    return 0
+
+def _speed(tags: Dict[str,str], profile: str) -> Optional[float]:
+    base = SPEEDS[profile].get(tags.get("highway", ""))
+    if base is None:
+        return None
+    access = tags.get({"driving": "motor_vehicle", "cycling": "bicycle", "walking": "foot"}[profile]) or tags.get("access")
+    if access in ("no", "private"):
+        return None
+    if profile == "driving":
+        try:
+            return min(base, float(tags.get("maxspeed", "").split()[0]))
+        except (ValueError, IndexError):
+            pass
+    return base
+
+# =========================
+# Contraction hierarchies
+# =========================
+class _Contractor:
+    """In-memory CH construction on a directed graph with (duration, distance) edges."""
+    def __init__(self, n: int, edges: Dict[Tuple[int,int], Tuple[float,float]]):
+        self.n = n
+        self.out: List[Dict[int, Tuple[float,float,int]]] = [dict() for _ in range(n)]
+        self.inn: List[Dict[int, Tuple[float,float,int]]] = [dict() for _ in range(n)]
+        for (u, v), (w, d) in edges.items():
+            self.out[u][v] = (w, d, -1)
+            self.inn[v][u] = (w, d, -1)
+        self.contracted = [False]*n
+        self.deleted_neighbours = [0]*n
+
+    def _witness(self, src: int, skip: int, limit: float, targets: set, max_settled: int = 60) -> Dict[int,float]:
+        dist = {src: 0.0}
+        heap = [(0.0, src)]
+        settled = 0
+        found = {}
+        while heap and settled < max_settled:
+            d, u = heapq.heappop(heap)
+            if d > limit:
+                break
+            if d > dist.get(u, float("inf")):
+                continue
+            settled += 1
+            if u in targets:
+                found[u] = d
+                if len(found) == len(targets):
+                    break
+            for v, (w, _, _) in self.out[u].items():
+                if v == skip or self.contracted[v]:
+                    continue
+                nd = d + w
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return found
+
+    def _shortcuts(self, v: int) -> List[Tuple[int,int,float,float]]:
+        out = []
+        succ = [(x, e) for x, e in self.out[v].items() if not self.contracted[x]]
+        if not succ:
+            return out
+        max_out = max(e[0] for _, e in succ)
+        for u, (wu, du, _) in self.inn[v].items():
+            if self.contracted[u]:
+                continue
+            targets = {x for x, _ in succ if x != u}
+            if not targets:
+                continue
+            witness = self._witness(u, v, wu + max_out, targets)
+            for x, (wx, dx, _) in succ:
+                if x == u:
+                    continue
+                via = wu + wx
+                if witness.get(x, float("inf")) > via:
+                    out.append((u, x, via, du + dx))
+        return out
+
+    def _priority(self, v: int) -> float:
+        sc = len(self._shortcuts(v))
+        deg = sum(1 for x in self.out[v] if not self.contracted[x]) + sum(1 for u in self.inn[v] if not self.contracted[u])
+        return (sc - deg) + self.deleted_neighbours[v]
+
+    def run(self):
+        """Contract every node; returns (rank, fwd_up, bwd_up) adjacency lists.
+
+        fwd_up[u]: (v, w, d, mid) for edges u→v with rank[v] > rank[u]
+        bwd_up[v]: (u, w, d, mid) for edges u→v with rank[u] > rank[v]
+        """
+        heap = [(self._priority(v), v) for v in range(self.n)]
+        heapq.heapify(heap)
+        rank = [0]*self.n
+        fwd_up: List[List[Tuple[int,float,float,int]]] = [[] for _ in range(self.n)]
+        bwd_up: List[List[Tuple[int,float,float,int]]] = [[] for _ in range(self.n)]
+        level = 0
+        while heap:
+            p, v = heapq.heappop(heap)
+            if self.contracted[v]:
+                continue
+            # lazy update: re-evaluate and requeue if it got worse than the next candidate
+            p2 = self._priority(v)
+            if heap and p2 > heap[0][0]:
+                heapq.heappush(heap, (p2, v))
+                continue
+            for u, x, w, d in self._shortcuts(v):
+                cur = self.out[u].get(x)
+                if cur is None or w < cur[0]:
+                    self.out[u][x] = (w, d, v)
+                    self.inn[x][u] = (w, d, v)
+            for x, (w, d, mid) in self.out[v].items():
+                if not self.contracted[x]:
+                    fwd_up[v].append((x, w, d, mid))
+                    self.deleted_neighbours[x] += 1
+            for u, (w, d, mid) in self.inn[v].items():
+                if not self.contracted[u]:
+                    bwd_up[v].append((u, w, d, mid))
+                    self.deleted_neighbours[u] += 1
+            self.contracted[v] = True
+            rank[v] = level; level += 1
+        return rank, fwd_up, bwd_up
+
+def _csr(adj: List[List[Tuple[int,float,float,int]]]):
+    indptr = np.zeros(len(adj) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(a) for a in adj])
+    flat = [e for a in adj for e in a]
+    to = np.array([e[0] for e in flat], dtype=np.int64)
+    w = np.array([e[1] for e in flat], dtype=np.float64)
+    d = np.array([e[2] for e in flat], dtype=np.float64)
+    mid = np.array([e[3] for e in flat], dtype=np.int64)
+    return indptr, to, w, d, mid
+
+# =========================
+# Build
+# =========================
+def _junctions(ways: List[Tuple[Dict[str,str], List[int]]]) -> set:
+    """Way ends and nodes referenced more than once (by several ways, or twice by one)."""
+    seen, out = set(), set()
+    for _, refs in ways:
+        out.add(refs[0]); out.add(refs[-1])
+        for r in refs:
+            if r in seen:
+                out.add(r)
+            seen.add(r)
+    return out
+
+def _chains(ways, junctions: set) -> List[Tuple[int, List[int]]]:
+    """(way index, node ids) for each stretch of a way between two junctions."""
+    out = []
+    for w, (_, refs) in enumerate(ways):
+        start = 0
+        for k in range(1, len(refs)):
+            if refs[k] in junctions:
+                out.append((w, refs[start:k + 1])); start = k
+    return out
+
+def build(src: str, dst: str, profiles: Sequence[str] = PROFILES) -> Dict[str,Any]:
+    """Read an OSM extract and write a routing .npz with one CH per profile."""
+    coords: Dict[int, Tuple[float,float]] = {}
+    ways = []
+    for tags, refs in (_ways_pbf(src, coords) if src.endswith(".pbf") else _ways_xml(src, coords)):
+        refs = [r for r in refs if r in coords]
+        refs = [r for k, r in enumerate(refs) if k == 0 or r != refs[k - 1]]
+        if len(refs) > 1:
+            ways.append((tags, refs))
+    junctions = _junctions(ways)
+    # a closed chain (A ... A) is split at its middle node, so every edge joins two vertices
+    loops = [c[len(c) // 2] for _, c in _chains(ways, junctions) if c[0] == c[-1]]
+    if loops:
+        junctions.update(loops)
+    chains = _chains(ways, junctions)
+    ids = sorted(junctions)
+    idx = {nid: i for i, nid in enumerate(ids)}
+    lat = np.array([coords[i][0] for i in ids], dtype=np.float64)
+    lon = np.array([coords[i][1] for i in ids], dtype=np.float64)
+    # segments: the collapsed chains, shared by every profile
+    seg_u = np.array([idx[c[0]] for _, c in chains], dtype=np.int64)
+    seg_v = np.array([idx[c[-1]] for _, c in chains], dtype=np.int64)
+    seg_m = np.zeros(len(chains), dtype=np.float64)
+    seg_indptr = np.zeros(len(chains) + 1, dtype=np.int64)
+    shape_lat: List[float] = []; shape_lon: List[float] = []; shape_a: List[float] = []
+    for k, (_, c) in enumerate(chains):
+        a = 0.0
+        for p, q in zip(c, c[1:]):
+            a += haversine_km(coords[p], coords[q]) * 1000.0
+            if q != c[-1]:
+                shape_lat.append(coords[q][0]); shape_lon.append(coords[q][1]); shape_a.append(a)
+        seg_m[k] = a
+        seg_indptr[k + 1] = len(shape_a)
+    arrays: Dict[str, np.ndarray] = {
+        "lat": lat, "lon": lon, "seg_u": seg_u, "seg_v": seg_v, "seg_m": seg_m, "seg_indptr": seg_indptr,
+        "shape_lat": np.array(shape_lat, dtype=np.float64), "shape_lon": np.array(shape_lon, dtype=np.float64),
+        "shape_a": np.array(shape_a, dtype=np.float64)}
+    meta = {"version": FORMAT_VERSION, "nodes": len(ids), "segments": len(chains), "profiles": {},
+            "source": os.path.basename(src)}
+    for profile in profiles:
+        # seconds along each segment, forward (u→v) and backward; nan where not allowed
+        seg_s = np.full((len(chains), 2), np.nan)
+        edges: Dict[Tuple[int,int], Tuple[float,float,int]] = {}
+        for k, (w, _) in enumerate(chains):
+            tags = ways[w][0]
+            kmh = _speed(tags, profile)
+            if kmh is None:
+                continue
+            ow = _oneway(tags, profile)
+            u, v, m = int(seg_u[k]), int(seg_v[k]), float(seg_m[k])
+            s = m / (kmh / 3.6)
+            for back in ([False] if ow == 1 else ([True] if ow == -1 else [False, True])):
+                seg_s[k, int(back)] = s
+                e = (v, u) if back else (u, v)
+                if e not in edges or s < edges[e][0]:
+                    edges[e] = (s, m, ~k if back else k)
+        rank, fwd, bwd = _Contractor(len(ids), {e: (s, m) for e, (s, m, _) in edges.items()}).run()
+        arrays[f"{profile}_rank"] = np.array(rank, dtype=np.int64)
+        arrays[f"{profile}_seg_s"] = seg_s
+        # which segment (~k when run backwards) each original edge stands for
+        arrays[f"{profile}_edge_u"] = np.array([u for u, _ in edges], dtype=np.int64)
+        arrays[f"{profile}_edge_v"] = np.array([v for _, v in edges], dtype=np.int64)
+        arrays[f"{profile}_edge_seg"] = np.array([e[2] for e in edges.values()], dtype=np.int64)
+        for name, adj in (("fwd", fwd), ("bwd", bwd)):
+            for part, arr in zip(("indptr", "to", "w", "d", "mid"), _csr(adj)):
+                arrays[f"{profile}_{name}_{part}"] = arr
+        meta["profiles"][profile] = {"edges": len(edges), "shortcuts": int(sum(len(a) for a in fwd) + sum(len(a) for a in bwd))}
+    if len(ids):
+        meta["bbox"] = [float(min(lat.min(), min(shape_lat, default=90.0))), float(min(lon.min(), min(shape_lon, default=180.0))),
+                        float(max(lat.max(), max(shape_lat, default=-90.0))), float(max(lon.max(), max(shape_lon, default=-180.0)))]
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+    tmp = dst + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, dst)
+    return meta
+
+# =========================
+# Query
+# =========================
+class _Shapes:
+    """Segment geometry: end vertices, length and intermediate coordinates."""
+    def __init__(self, z):
+        self.lat = z["lat"].tolist(); self.lon = z["lon"].tolist()
+        self.u = z["seg_u"].tolist(); self.v = z["seg_v"].tolist(); self.m = z["seg_m"].tolist()
+        self.indptr = z["seg_indptr"].tolist()
+        self.shape_lat = z["shape_lat"].tolist(); self.shape_lon = z["shape_lon"].tolist(); self.shape_a = z["shape_a"].tolist()
+
+    def between(self, k: int, a0: float, a1: float) -> List[Point]:
+        """Points of segment k from a0 to a1 metres along it (either direction)."""
+        lo, hi = self.indptr[k], self.indptr[k + 1]
+        u, v = self.u[k], self.v[k]
+        at = [0.0] + self.shape_a[lo:hi] + [self.m[k]]
+        pts = [(self.lat[u], self.lon[u])] + list(zip(self.shape_lat[lo:hi], self.shape_lon[lo:hi])) + [(self.lat[v], self.lon[v])]
+        if a0 <= a1:
+            return [p for p, x in zip(pts, at) if a0 <= x <= a1]
+        return [p for p, x in zip(pts, at) if a1 <= x <= a0][::-1]
+
+def _extend(out: List[Point], pts: List[Point]):
+    out.extend(pts[1:] if out and pts and out[-1] == pts[0] else pts)
+
+class _ProfileGraph:
+    def __init__(self, z, profile: str, shapes: _Shapes):
+        self.profile = profile
+        self.shapes = shapes
+        def adj(name):
+            indptr = z[f"{profile}_{name}_indptr"].tolist()
+            to = z[f"{profile}_{name}_to"].tolist(); w = z[f"{profile}_{name}_w"].tolist()
+            d = z[f"{profile}_{name}_d"].tolist(); mid = z[f"{profile}_{name}_mid"].tolist()
+            return [list(zip(to[indptr[i]:indptr[i+1]], w[indptr[i]:indptr[i+1]],
+                             d[indptr[i]:indptr[i+1]], mid[indptr[i]:indptr[i+1]]))
+                    for i in range(len(indptr) - 1)]
+        self.fwd = adj("fwd")
+        self.bwd = adj("bwd")
+        self.rank = z[f"{profile}_rank"].tolist()
+        seg_s = z[f"{profile}_seg_s"]
+        self.seg_s = seg_s.tolist()
+        self.geom = dict(zip(zip(z[f"{profile}_edge_u"].tolist(), z[f"{profile}_edge_v"].tolist()),
+                             z[f"{profile}_edge_seg"].tolist()))
+        # snap candidates: every point (vertices and intermediate) of the segments this profile can use
+        usable = ~np.isnan(seg_s).all(axis=1) if len(seg_s) else np.zeros(0, dtype=bool)
+        used = np.flatnonzero(usable)
+        indptr = z["seg_indptr"]
+        of = np.repeat(np.arange(len(usable)), np.diff(indptr))
+        inner = np.flatnonzero(usable[of]) if len(of) else np.zeros(0, dtype=np.int64)
+        lat, lon, u, v = z["lat"], z["lon"], z["seg_u"], z["seg_v"]
+        self.cand_seg = np.concatenate([used, used, of[inner]]).tolist()
+        self.cand_a = np.concatenate([np.zeros(len(used)), z["seg_m"][used], z["shape_a"][inner]]).tolist()
+        clat = np.concatenate([lat[u[used]], lat[v[used]], z["shape_lat"][inner]])
+        clon = np.concatenate([lon[u[used]], lon[v[used]], z["shape_lon"][inner]])
+        self.index = GridIndex(clat, clon, cell_m=200.0) if len(clat) else None
+        self._edge_mid: Optional[Dict[Tuple[int,int], Tuple[int,float,float]]] = None
+
+    def snap(self, lat: float, lon: float) -> Tuple[Anchor, Point]:
+        """Nearest road point usable by this profile, and its coordinates."""
+        c = int(self.index.knn(lat, lon, 1)[0])
+        k, a = self.cand_seg[c], self.cand_a[c]
+        pt = self.shapes.between(k, a, a)[0]
+        return (k, a), pt
+
+    def _ends(self, anchor: Anchor, leaving: bool) -> List[Tuple[int,float,float]]:
+        """(vertex, duration, distance) from an anchor to the ends of its
+        segment when `leaving`, else from those ends to the anchor."""
+        k, a = anchor
+        sh = self.shapes
+        m = sh.m[k]
+        fw, bw = self.seg_s[k]
+        out = []
+        to_u = bw if leaving else fw      # moving towards u when leaving is a backward move
+        if a <= 0.0:
+            out.append((sh.u[k], 0.0, 0.0))
+        elif not math.isnan(to_u):
+            out.append((sh.u[k], to_u * a / m, a))
+        to_v = fw if leaving else bw
+        if a >= m:
+            out.append((sh.v[k], 0.0, 0.0))
+        elif not math.isnan(to_v):
+            out.append((sh.v[k], to_v * (m - a) / m, m - a))
+        return out
+
+    def _direct(self, s: Anchor, t: Anchor) -> Optional[Tuple[float,float]]:
+        """Duration and distance from s to t along their shared segment, if any."""
+        if s[0] != t[0]:
+            return None
+        k, m = s[0], self.shapes.m[s[0]]
+        along = t[1] - s[1]
+        if along == 0.0:
+            return 0.0, 0.0
+        sec = self.seg_s[k][0 if along > 0 else 1]
+        return None if math.isnan(sec) else (sec * abs(along) / m, abs(along))
+
+    def _upward(self, starts: List[Tuple[int,float,float]], adj) -> Dict[int, Tuple[float,float,int]]:
+        """Dijkstra over upward edges from (vertex, duration, distance)
+        starts: vertex -> (duration, distance, parent); starts have parent -1."""
+        best: Dict[int, Tuple[float,float,int]] = {}
+        for x, w, d in starts:
+            if x not in best or w < best[x][0]:
+                best[x] = (w, d, -1)
+        heap = [(w, x) for x, (w, _, _) in best.items()]
+        heapq.heapify(heap)
+        done = set()
+        while heap:
+            w, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            _, du, _ = best[u]
+            for v, ew, ed, _ in adj[u]:
+                nw = w + ew
+                if v not in best or nw < best[v][0]:
+                    best[v] = (nw, du + ed, u)
+                    heapq.heappush(heap, (nw, v))
+        return best
+
+    def many_to_many(self, sources: List[Anchor], targets: List[Anchor]):
+        buckets: Dict[int, List[Tuple[int,float,float]]] = {}
+        for j, t in enumerate(targets):
+            for x, (w, d, _) in self._upward(self._ends(t, False), self.bwd).items():
+                buckets.setdefault(x, []).append((j, w, d))
+        dur = [[None]*len(targets) for _ in sources]
+        dist = [[None]*len(targets) for _ in sources]
+        for i, s in enumerate(sources):
+            row_w, row_d = dur[i], dist[i]
+            for x, (w1, d1, _) in self._upward(self._ends(s, True), self.fwd).items():
+                for j, w2, d2 in buckets.get(x, ()):
+                    if row_w[j] is None or w1 + w2 < row_w[j]:
+                        row_w[j] = w1 + w2; row_d[j] = d1 + d2
+            for j, t in enumerate(targets):
+                direct = self._direct(s, t)
+                if direct is not None and (row_w[j] is None or direct[0] < row_w[j]):
+                    row_w[j], row_d[j] = direct
+        return dur, dist
+
+    def _edges(self) -> Dict[Tuple[int,int], Tuple[int,float,float]]:
+        if self._edge_mid is None:
+            m = {}
+            for u, lst in enumerate(self.fwd):
+                for v, w, d, mid in lst:
+                    m[(u, v)] = (mid, w, d)
+            for v, lst in enumerate(self.bwd):
+                for u, w, d, mid in lst:
+                    m[(u, v)] = (mid, w, d)
+            self._edge_mid = m
+        return self._edge_mid
+
+    def _unpack(self, u: int, v: int, out: List[int]):
+        edges = self._edges()
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            mid = edges[(a, b)][0]
+            if mid < 0:
+                out.append(b)
+            else:
+                stack.append((mid, b)); stack.append((a, mid))
+
+    def _edge_points(self, u: int, v: int) -> List[Point]:
+        k = self.geom[(u, v)]
+        return self.shapes.between(k, 0.0, self.shapes.m[k]) if k >= 0 else self.shapes.between(~k, self.shapes.m[~k], 0.0)
+
+    def path(self, s: Anchor, t: Anchor) -> Optional[List[Point]]:
+        """Geometry of the shortest s→t path (shortcuts and chains unpacked)."""
+        fw = self._upward(self._ends(s, True), self.fwd)
+        bw = self._upward(self._ends(t, False), self.bwd)
+        meet = min((x for x in fw if x in bw), key=lambda x: fw[x][0] + bw[x][0], default=None)
+        direct = self._direct(s, t)
+        if direct is not None and (meet is None or direct[0] <= fw[meet][0] + bw[meet][0]):
+            return self.shapes.between(s[0], s[1], t[1])
+        if meet is None:
+            return None
+        up = [meet]
+        while fw[up[-1]][2] >= 0:
+            up.append(fw[up[-1]][2])
+        up.reverse()
+        down = []
+        x = meet
+        while bw[x][2] >= 0:
+            x = bw[x][2]; down.append(x)
+        hops = up + down
+        nodes = [hops[0]]
+        for a, b in zip(hops, hops[1:]):
+            self._unpack(a, b, nodes)
+        sh = self.shapes
+        out: List[Point] = []
+        _extend(out, sh.between(s[0], s[1], 0.0 if nodes[0] == sh.u[s[0]] else sh.m[s[0]]))
+        for a, b in zip(nodes, nodes[1:]):
+            _extend(out, self._edge_points(a, b))
+        _extend(out, sh.between(t[0], 0.0 if nodes[-1] == sh.u[t[0]] else sh.m[t[0]], t[1]))
+        return out
+
+class LocalRouter:
+    def __init__(self, path: str):
+        self.path = path
+        z = np.load(path)
+        self.meta = json.loads(bytes(z["meta"]).decode("utf-8"))
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is routing format {self.meta.get('version')}, rebuild it (expected {FORMAT_VERSION})")
+        self._z = z
+        self._shapes: Optional[_Shapes] = None
+        self._graphs: Dict[str, _ProfileGraph] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def profiles(self) -> List[str]:
+        return list(self.meta["profiles"])
+
+    def covers(self, coords: Sequence[Tuple[float,float]]) -> bool:
+        bb = self.meta.get("bbox")
+        return bool(bb) and all(bb[0] <= la <= bb[2] and bb[1] <= lo <= bb[3] for la, lo in coords)
+
+    def graph(self, mode: str) -> _ProfileGraph:
+        with self._lock:
+            g = self._graphs.get(mode)
+            if g is None:
+                if mode not in self.meta["profiles"]:
+                    raise ValueError(f"profile {mode!r} not in {self.path}")
+                if self._shapes is None:
+                    self._shapes = _Shapes(self._z)
+                g = self._graphs[mode] = _ProfileGraph(self._z, mode, self._shapes)
+            return g
+
+    def _snap(self, g: _ProfileGraph, coords) -> List[Tuple[Anchor, Point, float]]:
+        """(anchor, snapped point, offset metres) for each coordinate."""
+        out = []
+        for la, lo in coords:
+            anchor, pt = g.snap(la, lo)
+            out.append((anchor, pt, haversine_km((la, lo), pt) * 1000.0))
+        return out
+
+    def table(self, coords: Sequence[Tuple[float,float]], mode: str = "driving",
+              sources: Optional[Sequence[int]] = None, destinations: Optional[Sequence[int]] = None) -> Dict[str,Any]:
+        """OSRM-compatible table response (durations in s, distances in m; null if unreachable)."""
+        g = self.graph(mode)
+        snapped = self._snap(g, coords)
+        src = list(range(len(coords))) if sources is None else list(sources)
+        dst = list(range(len(coords))) if destinations is None else list(destinations)
+        dur, dist = g.many_to_many([snapped[i][0] for i in src], [snapped[j][0] for j in dst])
+        mps = _SNAP_KMH[mode] / 3.6
+        for a, i in enumerate(src):
+            for b, j in enumerate(dst):
+                if i == j:
+                    dur[a][b] = 0.0; dist[a][b] = 0.0
+                elif dur[a][b] is not None:
+                    off = snapped[i][2] + snapped[j][2]
+                    dur[a][b] += off / mps; dist[a][b] += off
+        return {"code": "Ok", "durations": dur, "distances": dist,
+                "sources": [{"location": [snapped[i][1][1], snapped[i][1][0]]} for i in src],
+                "destinations": [{"location": [snapped[j][1][1], snapped[j][1][0]]} for j in dst]}
+
+    def route_legs(self, coords: Sequence[Tuple[float,float]], mode: str = "driving") -> Optional[List[List[Point]]]:
+        """Geometry of each leg between consecutive waypoints, or None if any is unreachable."""
+        g = self.graph(mode)
+        snapped = self._snap(g, coords)
+        legs = []
+        for (a, _, _), (b, _, _) in zip(snapped, snapped[1:]):
+            pts = g.path(a, b)
+            if pts is None:
+                return None
+            legs.append(pts)
+        return legs
+
+    def route(self, coords: Sequence[Tuple[float,float]], mode: str = "driving") -> Optional[List[Tuple[float,float]]]:
+        """Geometry through all waypoints as (lat, lon) tuples, or None if unreachable."""
+        legs = self.route_legs(coords, mode)
+        if legs is None:
+            return None
+        out: List[Tuple[float,float]] = []
+        for pts in legs:
+            out.extend(pts[1:] if out else pts)
+        return out
+
+_router: Optional[LocalRouter] = None
+_router_spec: Optional[str] = None
+_router_lock = threading.Lock()
+
+def get_router() -> Optional[LocalRouter]:
+    """Router selected by ROUTEFORGE_ROUTER: unset/"osrm" for the public OSRM
+    server, otherwise the path of a routing file built by `build`."""
+    global _router, _router_spec
+    spec = os.environ.get("ROUTEFORGE_ROUTER", "").strip()
+    if spec != _router_spec:
+        with _router_lock:
+            if spec != _router_spec:  # another thread may have loaded it meanwhile
+                try:
+                    router = LocalRouter(spec) if spec and spec != "osrm" else None
+                except (OSError, ValueError, KeyError):
+                    router = None
+                # publish the router before the spec, so a reader that sees the spec sees its router
+                _router = router
+                _router_spec = spec
+    return _router
+
+# =========================
+# CLI
+# =========================
+def _latlon(s: str) -> Tuple[float,float]:
+    la, lo = s.split(",")
+    return float(la), float(lo)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m routeforge.roadgraph", description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build a routing file from an .osm / .osm.pbf extract")
+    b.add_argument("extract"); b.add_argument("output")
+    b.add_argument("--profiles", default=",".join(PROFILES))
+    t = sub.add_parser("table", help="duration/distance table for lat,lon points")
+    t.add_argument("graph"); t.add_argument("mode", choices=PROFILES); t.add_argument("points", nargs="+", type=_latlon)
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        meta = build(args.extract, args.output, [p for p in args.profiles.split(",") if p])
+        print(f"wrote {args.output}: {meta['nodes']} nodes, {meta['segments']} segments, {json.dumps(meta['profiles'])}")
+    else:
+        res = LocalRouter(args.graph).table(args.points, args.mode)
+        print(json.dumps({"durations": res["durations"], "distances": res["distances"]}))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
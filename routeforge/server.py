@@ -0,0 +1,323 @@
+"""Planning service: the planner behind a small asyncio HTTP/JSON API.
+
+    python -m routeforge.server --port 8765 --workers 8 --queue 32
+
+  POST /plan     {"inputs": {...}, "geometry": false, "stream": false}
+                 → the plan (inputs, picks, route, ordered_nodes, totals,
+                 markdown, payload, geometry). With "stream": true the
+                 answer is NDJSON: progress events ({"event": "origin",
+                 "data": ...}) as discovery runs, then {"event": "result",
+                 "plan": ...} or {"event": "error", ...}.
+  GET  /stats    queue depth, coalesced/rejected counts, upstream health
+  GET  /metrics  Prometheus text (routeforge.telemetry)
+  GET  /healthz
+
+Every Streamlit session and batch worker pointed at one service shares its
+transport, caches and discoveries:
+
+  * identical plans in flight (same normalized inputs) run once and every
+    caller gets the result; identical upstream requests from different
+    plans are coalesced by the transport (routeforge.http)
+  * each upstream host has a bounded number of concurrent requests
+  * plans run on `workers` threads with at most `queue` more waiting;
+    beyond that the service answers 503 with Retry-After (backpressure)
+  * recent discoveries are kept per discovery key, so a follow-up plan that
+    only changes top_k, mode, cost rates or budget needs no network I/O;
+    they are reused only while the shortest TTL of the sources they were
+    built from (DISCOVERY_SOURCES) has not run out
+
+Errors: 400 bad request, 422 the trip can't be planned (PlanningError),
+503 overloaded, 500 anything else.
+"""
+import sys, json, time, asyncio, argparse, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from routeforge.cache import get_cache
+from routeforge.http import get_transport
+from routeforge.planner import (PlanningError, discovery_key, normalize_inputs, plan_fingerprint,
+                                plan_geometry, plan_trip)
+from routeforge.telemetry import SERVICE_REQUESTS, log, render_prometheus
+
+MAX_BODY = 1 << 20
+# upstream sources a discovery is built from
+DISCOVERY_SOURCES = ("nominatim", "photon", "overpass-tile", "osrm-leg")
+# plan fields sent to clients (the discovery stays on the server)
+PLAN_FIELDS = ("inputs", "picks", "route", "ordered_nodes", "total_km", "total_hr", "cost_est",
+               "markdown", "payload")
+
+def _consume(task: asyncio.Future):
+    # the outcome may have no waiter left (all callers disconnected)
+    if not task.cancelled():
+        task.exception()
+
+class Overloaded(RuntimeError):
+    def __init__(self, retry_after_s: int):
+        super().__init__(f"planning queue full; retry in {retry_after_s} s")
+        self.retry_after_s = retry_after_s
+
+def plan_to_json(plan: Dict[str,Any], geometry: Optional[List[Tuple[float,float]]] = None) -> Dict[str,Any]:
+    out = {k: plan[k] for k in PLAN_FIELDS}
+    out["geometry"] = [list(p) for p in geometry] if geometry else None
+    return out
+
+# =========================
+# Service
+# =========================
+class PlanningService:
+    def __init__(self, workers: int = 8, queue: int = 32, discoveries: int = 256,
+                 discovery_max_age_s: Optional[float] = None):
+        self.workers, self.queue = workers, queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rf-svc")
+        self._pending = 0  # running + queued plans (event-loop thread only)
+        self._flights: Dict[str, asyncio.Task] = {}
+        # key -> (stored_at, discovery)
+        self._discoveries: "OrderedDict[tuple, Tuple[float, Dict[str,Any]]]" = OrderedDict()
+        self._max_discoveries = discoveries
+        self._disc_max_age_s = discovery_max_age_s
+        self._disc_lock = threading.Lock()
+        self.counts = {"plans": 0, "coalesced": 0, "rejected": 0, "invalid": 0, "errors": 0}
+
+    def _count(self, outcome: str):
+        self.counts[outcome] += 1
+        SERVICE_REQUESTS.inc(outcome)
+
+    # ---- discoveries (worker threads) ----
+    def _discovery_max_age(self) -> float:
+        if self._disc_max_age_s is not None:
+            return self._disc_max_age_s
+        cache = get_cache()
+        return float(min(cache.policy(s)[0] for s in DISCOVERY_SOURCES))
+
+    def _discovery(self, key: tuple) -> Optional[Dict[str,Any]]:
+        max_age = self._discovery_max_age()
+        with self._disc_lock:
+            hit = self._discoveries.get(key)
+            if hit is None:
+                return None
+            if time.time() - hit[0] > max_age:
+                del self._discoveries[key]  # stale upstream data: discover again
+                return None
+            self._discoveries.move_to_end(key)
+            return hit[1]
+
+    def _remember(self, key: tuple, disc: Dict[str,Any]):
+        with self._disc_lock:
+            self._discoveries[key] = (time.time(), disc)
+            self._discoveries.move_to_end(key)
+            while len(self._discoveries) > self._max_discoveries:
+                self._discoveries.popitem(last=False)
+
+    def _run(self, inputs: Dict[str,Any], geometry: bool, progress) -> Dict[str,Any]:
+        key = discovery_key(inputs)
+        plan = plan_trip(inputs, self._discovery(key), on_progress=progress)
+        self._remember(key, plan["discovery"])
+        return plan_to_json(plan, plan_geometry(plan) if geometry else None)
+
+    # ---- requests (event loop) ----
+    def retry_after(self) -> int:
+        return max(1, self._pending // max(1, self.workers))
+
+    async def plan(self, raw: Dict[str,Any], geometry: bool = False,
+                   on_event: Optional[asyncio.Queue] = None) -> Dict[str,Any]:
+        """Plan (or join the identical plan in flight). Progress events of
+        a plan this call started go to `on_event`."""
+        try:
+            inputs = normalize_inputs(raw)
+        except (PlanningError, TypeError, ValueError):
+            self._count("invalid")
+            raise
+        key = plan_fingerprint(inputs) + (":geometry" if geometry else "")
+        task = self._flights.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            if self._pending >= self.workers + self.queue:
+                self._count("rejected")
+                raise Overloaded(self.retry_after())
+            loop = asyncio.get_running_loop()
+            def progress(event, data):
+                if on_event is not None and event != "plan":
+                    loop.call_soon_threadsafe(on_event.put_nowait, (event, data))
+            self._pending += 1
+            task = self._flights[key] = asyncio.ensure_future(self._compute(key, inputs, geometry, progress))
+            task.add_done_callback(_consume)
+        # shielded: a caller that disconnects does not cancel the shared plan
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, inputs: Dict[str,Any], geometry: bool, progress) -> Dict[str,Any]:
+        try:
+            out = await asyncio.get_running_loop().run_in_executor(self._pool, self._run, inputs, geometry, progress)
+            self._count("plans")
+            return out
+        except PlanningError:
+            self._count("invalid")
+            raise
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._pending -= 1
+            self._flights.pop(key, None)
+
+    def stats(self) -> Dict[str,Any]:
+        return {"workers": self.workers, "queue": self.queue, "pending": self._pending,
+                "in_flight": len(self._flights), "discoveries": len(self._discoveries), **self.counts,
+                "upstream": get_transport().health_snapshot()}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+# =========================
+# HTTP (asyncio streams)
+# =========================
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+def _head(status: int, headers: Dict[str,str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"] + [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+async def _send(writer: asyncio.StreamWriter, status: int, body: Any, headers: Optional[Dict[str,str]] = None,
+                content_type: str = "application/json"):
+    data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+    writer.write(_head(status, {"Content-Type": content_type, "Content-Length": str(len(data)), **(headers or {})}) + data)
+    await writer.drain()
+
+def _error_status(e: BaseException) -> Tuple[int, Dict[str,Any], Dict[str,str]]:
+    if isinstance(e, Overloaded):
+        return 503, {"error": str(e)}, {"Retry-After": str(e.retry_after_s)}
+    if isinstance(e, (PlanningError, TypeError, ValueError)):
+        return 422, {"error": str(e)}, {}
+    log.exception("planning service: %s", e)
+    return 500, {"error": f"{type(e).__name__}: {e}"}, {}
+
+class Server:
+    def __init__(self, service: PlanningService):
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers: Dict[str,str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                n = int(headers.get("content-length") or 0)
+                if n > MAX_BODY:
+                    await _send(writer, 413, {"error": "request body too large"}, {"Connection": "close"})
+                    break
+                body = await reader.readexactly(n) if n else b""
+                await self.dispatch(method, target.split("?", 1)[0], body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if path == "/healthz":
+            await _send(writer, 200, {"ok": True})
+        elif path == "/stats":
+            await _send(writer, 200, self.service.stats())
+        elif path == "/metrics":
+            await _send(writer, 200, render_prometheus(), content_type="text/plain; version=0.0.4")
+        elif path != "/plan":
+            await _send(writer, 404, {"error": f"no route {path}"})
+        elif method != "POST":
+            await _send(writer, 405, {"error": "POST a JSON body to /plan"})
+        else:
+            try:
+                req = json.loads(body or b"{}")
+                inputs = req.get("inputs") if isinstance(req, dict) else None
+                if not isinstance(inputs, dict):
+                    raise ValueError("expected {\"inputs\": {...}}")
+            except ValueError as e:
+                await _send(writer, 400, {"error": str(e)})
+                return
+            if req.get("stream"):
+                await self.stream_plan(inputs, bool(req.get("geometry")), writer)
+                return
+            try:
+                plan = await self.service.plan(inputs, geometry=bool(req.get("geometry")))
+            except Exception as e:
+                await _send(writer, *_error_status(e))
+                return
+            await _send(writer, 200, plan)
+
+    async def stream_plan(self, inputs: Dict[str,Any], geometry: bool, writer: asyncio.StreamWriter):
+        """NDJSON over chunked encoding: progress events, then the result."""
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.service.plan(inputs, geometry, on_event=events))
+        task.add_done_callback(_consume)
+        started = False
+
+        async def chunk(obj: Dict[str,Any]):
+            nonlocal started
+            if not started:
+                writer.write(_head(200, {"Content-Type": "application/x-ndjson", "Transfer-Encoding": "chunked"}))
+                started = True
+            data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+
+        while not task.done():
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                event, data = getter.result()
+                await chunk({"event": event, "data": data})
+            else:
+                getter.cancel()
+        while not events.empty():
+            event, data = events.get_nowait()
+            await chunk({"event": event, "data": data})
+        err = task.exception()
+        if err is None:
+            await chunk({"event": "result", "plan": task.result()})
+        elif not started:
+            # nothing streamed yet: a plain status code is more useful
+            await _send(writer, *_error_status(err))
+            return
+        else:
+            status, body, _ = _error_status(err)
+            await chunk({"event": "error", "status": status, **body})
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 8, queue: int = 32):
+    service = PlanningService(workers=workers, queue=queue)
+    srv = await asyncio.start_server(Server(service).handle, host, port)
+    log.info("planning service on http://%s:%d (%d workers, queue %d)", host, port, workers, queue)
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        service.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m routeforge.server", description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=8, help="plans computed at once")
+    ap.add_argument("--queue", type=int, default=32, help="plans waiting before 503s")
+    args = ap.parse_args(argv)
+    print(f"export ROUTEFORGE_SERVICE_URL=http://{args.host}:{args.port}", flush=True)
+    try:
+        asyncio.run(serve(args.host, args.port, max(1, args.workers), max(0, args.queue)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
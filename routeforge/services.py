@@ -0,0 +1,337 @@
+"""Upstream services: geocoding, POI discovery and routing.
+
+Everything here is plain Python (no Streamlit): results are memoized in the
+shared cache (routeforge.cache) and requests go through the pooled
+transport (routeforge.http). Upstream base URLs can be overridden with
+ROUTEFORGE_NOMINATIM_URL, ROUTEFORGE_PHOTON_URL, ROUTEFORGE_OSRM_URL and
+ROUTEFORGE_OVERPASS_URLS (comma-separated), e.g. to point at self-hosted
+instances or the benchmark's replay servers.
+"""
+import os, math
+from typing import List, Dict, Any, Tuple, Optional
+
+from routeforge import polyline
+from routeforge.cache import cached, get_cache
+from routeforge.fanout import first_by_priority
+from routeforge.geo import haversine_km
+from routeforge.http import TransportError, get_transport
+from routeforge.legs import leg_matrix, snap
+from routeforge.poi_offline import get_default_index
+from routeforge.roadgraph import get_router
+from routeforge.telemetry import fallback, traced
+from routeforge.tiles import TileStore
+
+# =========================
+# Robust HTTP + caching
+# =========================
+# Upstream results go through the shared on-disk cache (routeforge.cache):
+# it survives restarts and is shared by every worker on the node. Requests
+# go through the pooled transport (routeforge.http): keep-alive sessions,
+# retries with backoff, per-host rate limits and endpoint health.
+def _get(url: str, params: dict = None, timeout: int = 20):
+    return get_transport().get_json(url, params=params, timeout=timeout)
+
+NOMINATIM_URL = os.environ.get("ROUTEFORGE_NOMINATIM_URL", "https://nominatim.openstreetmap.org").rstrip("/")
+PHOTON_URL = os.environ.get("ROUTEFORGE_PHOTON_URL", "https://photon.komoot.io").rstrip("/")
+OSRM_URL = os.environ.get("ROUTEFORGE_OSRM_URL", "https://router.project-osrm.org").rstrip("/")
+
+# =========================
+# Geocoding (Nominatim + Photon + city-bias)
+# =========================
+@cached("nominatim", casefold=True)
+def geocode_nominatim(q: str, limit=1) -> Optional[Tuple[float,float,str]]:
+    try:
+        data = _get(f"{NOMINATIM_URL}/search",
+                    {"q": q, "format": "json", "limit": limit})
+        if data:
+            lat = float(data[0]["lat"]); lon = float(data[0]["lon"])
+            disp = data[0].get("display_name", q)
+            return lat, lon, disp
+    except Exception as e:
+        fallback("nominatim", e)
+    return None
+
+@cached("photon", casefold=True)
+def geocode_photon(q: str) -> Optional[Tuple[float,float,str]]:
+    try:
+        data = _get(f"{PHOTON_URL}/api", {"q": q, "limit": 1})
+        feats = data.get("features") or []
+        if feats:
+            c = feats[0]["geometry"]["coordinates"]  # [lon, lat]
+            props = feats[0].get("properties", {})
+            lat, lon = float(c[1]), float(c[0])
+            label = props.get("name") or props.get("city") or q
+            return lat, lon, label
+    except Exception as e:
+        fallback("photon", e)
+    return None
+
+def _bbox(lat: float, lon: float, box_km: float = 12.0):
+    dlat = box_km / 111.0
+    dlon = box_km / (111.0 * max(0.1, math.cos(math.radians(lat))))
+    return (lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+@cached("nominatim", casefold=True)
+def geocode_in_city(fragment: str, city_center: Tuple[float,float], box_km: float = 12.0):
+    latc, lonc = city_center
+    lon_min, lat_min, lon_max, lat_max = _bbox(latc, lonc, box_km)
+    try:
+        data = _get(f"{NOMINATIM_URL}/search", {
+            "q": fragment, "format": "json", "limit": 1,
+            "viewbox": f"{lon_min},{lat_min},{lon_max},{lat_max}", "bounded": 1
+        })
+        if data:
+            lat = float(data[0]["lat"]); lon = float(data[0]["lon"])
+            disp = data[0].get("display_name", fragment)
+            return lat, lon, disp
+    except Exception as e:
+        fallback("nominatim", e)
+    return None
+
+@traced()
+def geocode_best(q: str, bias_city: Optional[Tuple[float,float]] = None):
+    """Try Nominatim → city-bias → Photon. Returns (lat, lon, label) or None."""
+    return geocode_nominatim(q) or geocode_fallbacks(q, bias_city)
+
+def geocode_fallbacks(q: str, bias_city: Optional[Tuple[float,float]] = None):
+    """`geocode_best` after a plain Nominatim miss: city-bias → Photon.
+    Misses aren't cached, so callers that already know Nominatim missed
+    skip straight here instead of spending another Nominatim request."""
+    if bias_city:
+        hit = geocode_in_city(q, bias_city, box_km=15.0)
+        if hit: return hit
+    return geocode_photon(q)
+
+# =========================
+# Overpass (multi-endpoint)
+# =========================
+_OVERPASS_ENDPOINTS = [u.strip() for u in os.environ.get("ROUTEFORGE_OVERPASS_URLS", "").split(",") if u.strip()] or [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://z.overpass-api.de/api/interpreter",
+]
+
+def overpass_query(query: str) -> dict:
+    """Healthiest mirror first; a second mirror is raced once the first runs slow.
+
+    Uncached: responses are cached per tile by `_tiles`. A query that hit
+    Overpass' timeout or memory limit still answers 200, with partial (often
+    empty) elements and a "runtime error" remark; it is raised as an error
+    so the tile store never caches the partial answer."""
+    data = get_transport().hedged_post_json(_OVERPASS_ENDPOINTS, query, timeout=90)
+    remark = str(data.get("remark") or "") if isinstance(data, dict) else ""
+    if "runtime error" in remark.lower():
+        raise TransportError(f"overpass: {remark}")
+    return data
+
+# POI lookups go through tile-aligned cached fetches (routeforge.tiles): one
+# merged query per tile serves every kind, radius and nearby center
+_tiles = TileStore(overpass_query)
+
+@traced()
+def overpass_places(lat: float, lon: float, radius_m: int, kind: str) -> List[Dict[str,Any]]:
+    # a local POI extract (ROUTEFORGE_POI_FILE) answers first; Overpass is the fallback
+    local = get_default_index()
+    if local is not None and local.covers(lat, lon):
+        return local.places(lat, lon, radius_m, kind)
+    return _tiles.places(lat, lon, radius_m, kind, limit=120 if kind == "restaurant" else 150)
+
+def _local_along(corridor, fetch) -> Optional[List[Dict[str,Any]]]:
+    """Rows from the local POI extract around every station, ranked by
+    detour; None unless the extract covers the whole corridor."""
+    local = get_default_index()
+    if local is None or not all(local.covers(lat, lon) for lat, lon in corridor.stations):
+        return None
+    seen: Dict[str, Dict[str,Any]] = {}
+    for lat, lon in corridor.stations:
+        for p in fetch(local, lat, lon, corridor.reach_m):
+            seen.setdefault(p["url"], p)
+    rows = list(seen.values())
+    order, _ = corridor.select([p["lat"] for p in rows], [p["lon"] for p in rows])
+    return [rows[i] for i in order]
+
+@traced()
+def corridor_places(corridor, kind: str) -> List[Dict[str,Any]]:
+    """`overpass_places` along a route corridor (routeforge.corridor):
+    smallest detour first."""
+    limit = 120 if kind == "restaurant" else 150
+    # per station the extract returns everything (limit 0); ranking cuts after
+    local = _local_along(corridor, lambda idx, lat, lon, r: idx.places(lat, lon, r, kind, limit=0))
+    if local is not None:
+        return local[:limit]
+    return _tiles.places_along(corridor, kind, limit=limit)
+
+# =========================
+# Specific-need resolver
+# =========================
+def _amenity_for(query_text: str) -> Optional[str]:
+    txt = query_text.lower()
+    if any(w in txt for w in ["pharmacy","chemist"]):
+        return "pharmacy"
+    if any(w in txt for w in ["restroom","toilet","washroom","bathroom"]):
+        return "toilets"
+    if any(w in txt for w in ["cafe","coffee","chai"]):
+        return "cafe"
+    if "restaurant" in txt:
+        return "restaurant"
+    return None
+
+def _specific_named(center_xy: Tuple[float,float], radius_m: int, query_text: str) -> List[Dict[str,Any]]:
+    """Resolve the text as a named place in the city (bias)."""
+    hit = geocode_in_city(query_text, center_xy, box_km=radius_m/1000.0 * 1.5)
+    if hit:
+        plat, plon, label = hit
+        return [{
+            "name": label, "lat": plat, "lon": plon, "category": "specific",
+            "address": label, "url": f"https://www.openstreetmap.org/?mlat={plat}&mlon={plon}"
+        }]
+    return []
+
+def _specific_amenity(center_xy: Tuple[float,float], radius_m: int, query_text: str,
+                      corridor=None) -> List[Dict[str,Any]]:
+    """Overpass lookup for an amenity guessed from the text (along the
+    corridor when one is given)."""
+    amenity = _amenity_for(query_text)
+    if not amenity:
+        return []
+    if corridor is not None:
+        local = _local_along(corridor, lambda idx, lat, lon, r: idx.amenity(lat, lon, r, amenity, limit=0))
+        return local[:150] if local is not None else _tiles.amenity_along(corridor, amenity)
+    latc, lonc = center_xy
+    local = get_default_index()
+    if local is not None and local.covers(latc, lonc):
+        return local.amenity(latc, lonc, radius_m, amenity)
+    return _tiles.amenity(latc, lonc, radius_m, amenity)
+
+def _specific_anywhere(query_text: str) -> List[Dict[str,Any]]:
+    """Last resort: best-effort geocode anywhere."""
+    hit = geocode_best(query_text)
+    if hit:
+        plat, plon, label = hit
+        return [{
+            "name": label, "lat": plat, "lon": plon, "category": "specific",
+            "address": label, "url": f"https://www.openstreetmap.org/?mlat={plat}&mlon={plon}"
+        }]
+    return []
+
+@traced()
+def find_specific(center_xy: Tuple[float,float], radius_m: int, query_text: str,
+                  corridor=None) -> List[Dict[str,Any]]:
+    """Named place in city → Overpass amenity guess → geocode anywhere.
+
+    The named and amenity strategies start together; the highest-ranked
+    non-empty answer wins and the other is cancelled. The last resort is
+    another Nominatim request, so it only runs once both came back empty.
+    With a `corridor`, amenities are looked up along the route instead of
+    around the city.
+    """
+    if not query_text.strip():
+        return []
+    return first_by_priority([
+        lambda cancelled: _specific_named(center_xy, radius_m, query_text),
+        lambda cancelled: [] if cancelled.is_set() else _specific_amenity(center_xy, radius_m, query_text, corridor),
+    ]) or _specific_anywhere(query_text)
+
+# =========================
+# Routing (OSRM public server, or a local CH router via ROUTEFORGE_ROUTER)
+# =========================
+@traced()
+def osrm_table(coords: List[Tuple[float,float]], mode="driving",
+               sources: Optional[List[int]] = None, destinations: Optional[List[int]] = None) -> Dict[str, Any]:
+    base = f"{OSRM_URL}/table/v1/{mode}/"
+    path = ";".join([f"{lon},{lat}" for lat,lon in coords])
+    params = {"annotations":"duration,distance"}
+    if sources is not None: params["sources"] = ";".join(map(str, sources))
+    if destinations is not None: params["destinations"] = ";".join(map(str, destinations))
+    return _get(base + path, params, timeout=60)
+
+def osrm_route_legs(coords: List[Tuple[float,float]], mode="driving") -> Optional[List[List[Tuple[float,float]]]]:
+    """Full-resolution road geometry of each leg (uncached; `route_geometry`
+    caches per leg). polyline6 is a fraction of the size of the equivalent
+    GeoJSON. The overview line is cut by each leg's `distance`."""
+    base = f"{OSRM_URL}/route/v1/{mode}/"
+    path = ";".join([f"{lon},{lat}" for lat,lon in coords])
+    try:
+        js = _get(base + path, {"overview":"full","geometries":"polyline6"}, timeout=60)
+        routes = js.get("routes") or []
+        if routes:
+            geom = polyline.decode(routes[0]["geometry"], 6)
+            leg_m = [float(leg.get("distance") or 0.0) for leg in routes[0].get("legs") or []]
+            if len(leg_m) != len(coords) - 1:
+                leg_m = [haversine_km(a, b) for a, b in zip(coords, coords[1:])]
+            return polyline.split_at(geom, leg_m)
+    except Exception as e:
+        fallback("osrm-route", e)
+    return None
+
+@traced()
+def route_table(coords: List[Tuple[float,float]], mode="driving") -> Dict[str, Any]:
+    router = get_router()
+    if router is not None and mode in router.profiles and router.covers(coords):
+        return router.table(coords, mode)
+    # public server: rebuild from cached legs, fetching only new rows/columns
+    return leg_matrix(coords, mode, lambda c, src, dst: osrm_table(c, mode=mode, sources=src, destinations=dst))
+
+_GEOM_SOURCE = "osrm-geom"
+
+def _leg_geometry_key(mode: str, a: Tuple[float,float], b: Tuple[float,float]) -> str:
+    return f"{_GEOM_SOURCE}:{mode}:{a[0]:.5f},{a[1]:.5f}:{b[0]:.5f},{b[1]:.5f}"
+
+def _fetch_legs(coords: List[Tuple[float,float]], mode: str) -> Optional[List[List[Tuple[float,float]]]]:
+    router = get_router()
+    if router is not None and mode in router.profiles and router.covers(coords):
+        legs = router.route_legs(coords, mode)
+        if legs:
+            return legs
+    return osrm_route_legs(coords, mode=mode)
+
+@traced()
+def route_geometry(coords: List[Tuple[float,float]], mode="driving") -> Optional[List[Tuple[float,float]]]:
+    """Road geometry through `coords`, assembled from per-leg pieces.
+
+    Each leg is cached on its own as a polyline6 string (source "osrm-geom"),
+    so reordering or adding a stop fetches only the legs that changed. Runs
+    of consecutive missing or stale legs are fetched in one request and
+    split per leg; stale pieces are used only if that fails. None if any
+    leg can't be routed.
+    """
+    if len(coords) < 2:
+        return None
+    cache = get_cache()
+    pts = [snap(c) for c in coords]
+    legs: List[Optional[List[Tuple[float,float]]]] = [None] * (len(pts) - 1)
+    stale: Dict[int, str] = {}
+    for i in range(len(legs)):
+        if pts[i] == pts[i+1]:
+            legs[i] = [tuple(coords[i]), tuple(coords[i+1])]
+            continue
+        hit = cache.peek(_leg_geometry_key(mode, pts[i], pts[i+1]), _GEOM_SOURCE)
+        if hit and hit[0]:
+            if hit[1] > 0:
+                legs[i] = polyline.decode(hit[0], 6)
+            else:
+                stale[i] = hit[0]  # refetched below; kept in case that fails
+    i = 0
+    while i < len(legs):
+        if legs[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < len(legs) and legs[j] is None:
+            j += 1
+        pieces = _fetch_legs(list(coords[i:j+1]), mode)
+        if pieces:
+            for k, piece in enumerate(pieces):
+                legs[i+k] = piece
+                cache.put(_leg_geometry_key(mode, pts[i+k], pts[i+k+1]), _GEOM_SOURCE, polyline.encode(piece, 6))
+        elif all(k in stale for k in range(i, j)):
+            fallback("osrm-geom-stale")
+            for k in range(i, j):
+                legs[k] = polyline.decode(stale[k], 6)
+        else:
+            return None
+        i = j
+    out = list(legs[0])
+    for leg in legs[1:]:
+        out.extend(leg[1:])
+    return out
@@ -0,0 +1,302 @@
+"""Lightweight tracing and metrics for the planning pipeline.
+
+`span("overpass_places")` times a stage. Inside a `trace("plan_trip")` the
+span is also recorded on that trace, whose `summary()` becomes the
+`timings` section of trip_plan.json. Spans, HTTP calls, cache lookups and
+fallbacks always update process-wide counters and histograms, which can be
+rendered in Prometheus text format (`render_prometheus`).
+
+The current trace lives in a context variable; `run_in_context` carries it
+into worker threads (TaskGraph, speculative races, hedged requests).
+
+Configuration (environment):
+  ROUTEFORGE_METRICS_PORT  serve GET /metrics on this port (off by default)
+  ROUTEFORGE_TRACE_LOG     append one JSON line per finished trace
+"""
+import os, json, time, logging, functools, threading, contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("routeforge")
+
+# =========================
+# Metrics
+# =========================
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, n: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + n
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str,str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            yield self.name, dict(zip(self.labels, lv)), v
+
+class Histogram:
+    kind = "histogram"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [bucket counts..., count, sum]
+        self._values: Dict[tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            row = self._values.get(label_values)
+            if row is None:
+                row = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += 1; row[-1] += value
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str,str], float]]:
+        with self._lock:
+            items = [(lv, list(row)) for lv, row in self._values.items()]
+        for lv, row in items:
+            labels = dict(zip(self.labels, lv))
+            for b, c in zip(self.buckets, row):
+                yield f"{self.name}_bucket", {**labels, "le": repr(b)}, c
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, row[-2]
+            yield f"{self.name}_count", labels, row[-2]
+            yield f"{self.name}_sum", labels, row[-1]
+
+_REGISTRY: List[Any] = []
+
+def _register(metric):
+    _REGISTRY.append(metric)
+    return metric
+
+STAGE_SECONDS = _register(Histogram("routeforge_stage_seconds", "Pipeline stage latency.", ("stage",)))
+HTTP_SECONDS = _register(Histogram("routeforge_http_request_seconds", "Upstream request latency per endpoint.",
+                                   ("endpoint", "outcome")))
+CACHE_LOOKUPS = _register(Counter("routeforge_cache_lookups_total", "Response cache lookups.", ("source", "result")))
+FALLBACKS = _register(Counter("routeforge_fallbacks_total", "Degraded answers (errors swallowed, haversine legs, ...).",
+                              ("kind",)))
+TRACES = _register(Counter("routeforge_traces_total", "Finished traces.", ("name", "status")))
+COALESCED = _register(Counter("routeforge_http_coalesced_total", "Upstream requests served by an identical one in flight.",
+                              ("endpoint",)))
+UPSTREAM_QUEUE_SECONDS = _register(Histogram("routeforge_upstream_queue_seconds",
+                                             "Wait for a per-host upstream concurrency slot.", ("host",)))
+SERVICE_REQUESTS = _register(Counter("routeforge_service_plans_total", "Planning service requests.", ("outcome",)))
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render_prometheus() -> str:
+    out = []
+    for m in _REGISTRY:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        for name, labels, v in m.samples():
+            lbl = ",".join(f'{k}="{_escape(val)}"' for k, val in labels.items())
+            out.append(f"{name}{{{lbl}}} {v:g}" if lbl else f"{name} {v:g}")
+    return "\n".join(out) + "\n"
+
+# =========================
+# Traces & spans
+# =========================
+class Trace:
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[Dict[str,Any]] = []
+        self.http: Dict[str, List[float]] = {}    # endpoint -> [calls, seconds, errors]
+        self.cache: Dict[str, int] = {}           # "hit" / "stale" / "miss"
+        self.fallbacks: Dict[str, int] = {}
+        self.coalesced = 0
+        self.status = "ok"
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def _add_span(self, name: str, start: float, seconds: float, error: Optional[str], attrs: Dict[str,Any]):
+        rec = {"name": name, "start_s": round(start - self._t0, 4), "seconds": round(seconds, 4)}
+        if error:
+            rec["error"] = error
+        if attrs:
+            rec.update(attrs)
+        with self._lock:
+            self.spans.append(rec)
+
+    def summary(self) -> Dict[str,Any]:
+        """Compact per-stage totals for the plan payload."""
+        with self._lock:
+            stages: Dict[str, float] = {}
+            for s in self.spans:
+                stages[s["name"]] = round(stages.get(s["name"], 0.0) + s["seconds"], 4)
+            return {"total_s": round(self.elapsed(), 4), "stages": stages,
+                    "http": {ep: {"calls": int(c), "seconds": round(sec, 4), "errors": int(err)}
+                             for ep, (c, sec, err) in self.http.items()},
+                    "cache": dict(self.cache), "fallbacks": dict(self.fallbacks), "coalesced": self.coalesced}
+
+    def to_record(self) -> Dict[str,Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {"trace": self.name, "status": self.status, "started_at": self.started_at,
+                **self.attrs, **self.summary(), "spans": spans}
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("routeforge_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Trace]:
+    """Collect the spans of one unit of work (e.g. a plan)."""
+    init_from_env()
+    tr = Trace(name, **attrs)
+    token = _current.set(tr)
+    try:
+        yield tr
+    except BaseException:
+        tr.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        TRACES.inc(name, tr.status)
+        _write_trace_log(tr)
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, name)
+        tr = _current.get()
+        if tr is not None:
+            tr._add_span(name, t0, dt, error, attrs)
+
+def traced(name: Optional[str] = None):
+    """Decorator form of `span` (defaults to the function name)."""
+    def deco(fn):
+        stage = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def run_in_context(fn: Callable, *args, **kwargs) -> Callable[[], Any]:
+    """Bind `fn` to the caller's context (current trace) for another thread."""
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(fn, *args, **kwargs)
+
+# =========================
+# Recording helpers (called by cache/http/services)
+# =========================
+def record_http(endpoint: str, seconds: float, outcome: str):
+    HTTP_SECONDS.observe(seconds, endpoint, outcome)
+    tr = _current.get()
+    if tr is not None:
+        with tr._lock:
+            row = tr.http.setdefault(endpoint, [0, 0.0, 0])
+            row[0] += 1; row[1] += seconds; row[2] += outcome != "ok"
+
+def record_coalesced(endpoint: str):
+    COALESCED.inc(endpoint)
+    tr = _current.get()
+    if tr is not None:
+        with tr._lock:
+            tr.coalesced += 1
+
+def record_cache(source: str, result: str):
+    CACHE_LOOKUPS.inc(source, result)
+    tr = _current.get()
+    if tr is not None:
+        with tr._lock:
+            tr.cache[result] = tr.cache.get(result, 0) + 1
+
+def fallback(kind: str, exc: Optional[BaseException] = None, detail: Optional[str] = None):
+    """Count (and log) a degraded answer instead of swallowing it silently.
+
+    Count once per degraded answer; `detail` says how much was degraded."""
+    FALLBACKS.inc(kind)
+    tr = _current.get()
+    if tr is not None:
+        with tr._lock:
+            tr.fallbacks[kind] = tr.fallbacks.get(kind, 0) + 1
+    if exc is not None:
+        log.warning("fallback %s: %s: %s", kind, type(exc).__name__, exc)
+    elif detail:
+        log.info("fallback %s: %s", kind, detail)
+    else:
+        log.info("fallback %s", kind)
+
+# =========================
+# Exporters
+# =========================
+_trace_log_lock = threading.Lock()
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_metrics_port_tried: Optional[str] = None
+_init_lock = threading.Lock()
+
+def _write_trace_log(tr: Trace):
+    path = os.environ.get("ROUTEFORGE_TRACE_LOG", "").strip()
+    if not path:
+        return
+    try:
+        line = json.dumps(tr.to_record(), default=str)
+        with _trace_log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        log.warning("trace log %s: %s", path, e)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Start the /metrics endpoint on a daemon thread (once per process)."""
+    global _metrics_server
+    with _init_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="rf-metrics", daemon=True).start()
+    return _metrics_server
+
+def init_from_env():
+    global _metrics_port_tried
+    port = os.environ.get("ROUTEFORGE_METRICS_PORT", "").strip()
+    if port and _metrics_server is None and port != _metrics_port_tried:
+        _metrics_port_tried = port
+        try:
+            serve_metrics(int(port))
+        except (OSError, ValueError) as e:  # e.g. a second Streamlit session on the same port
+            log.warning("metrics endpoint on %s: %s", port, e)
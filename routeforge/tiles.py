@@ -0,0 +1,295 @@
+"""Tile-aligned POI cache in front of Overpass.
+
+Radius queries are snapped to slippy-map tiles (zoom `TILE_ZOOM`, ~5 km at
+the equator). A tile is fetched once, with one merged Overpass query for
+every tag RouteForge uses (the `poi_offline.TAGS` set: attractions, parks,
+restaurants and the specific-need amenities). It is then cached under
+source "overpass-tile". `places` / `amenity` answer the exact circle by
+filtering the cached tiles locally, so plans with nearby centers or
+different radii share fetches, and the attraction, restaurant and amenity
+lookups of one plan cost a single upstream query.
+
+Missing tiles are fetched together: batches of up to `MAX_TILES_PER_QUERY`
+tiles, each one query whose selectors cover the batch's tiles exactly (as
+a few rectangles), with up to `MAX_PARALLEL_QUERIES` batches in flight.
+Concurrent lookups of the same tile in this process wait for the one fetch
+in flight instead of issuing their own. Tiles past the "overpass-tile" TTL
+are fetched again, and their stale rows are used only if that fetch fails;
+process-local copies expire with the shared entry. `places_along` / `amenity_along`
+answer a route corridor (routeforge.corridor) from the same tiles.
+"""
+import time, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import asinh, atan, cos, degrees, floor, pi, radians, sinh, tan
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from routeforge.cache import Cache, get_cache
+from routeforge.geo import haversine_to
+from routeforge.poi_offline import KIND_MASKS, TAGS, amenity_mask
+from routeforge.telemetry import fallback, run_in_context, span
+
+Tile = Tuple[int,int]          # (x, y) at TILE_ZOOM
+# row: [osm_type, osm_id, lat, lon, name, address, tag mask]
+Row = List[Any]
+
+TILE_ZOOM = 13
+MAX_TILES_PER_QUERY = 36
+MAX_PARALLEL_QUERIES = 3
+SOURCE = "overpass-tile"
+# bump when the tag set or row layout changes so old tiles are not reused
+TAGSET_VERSION = 1
+
+_TAG_BITS = {kv: 1 << i for i, kv in enumerate(TAGS)}
+# kinds come from node selectors only (as the per-kind queries did); the
+# specific-need amenities also match ways and relations
+_AMENITY_TAGS = {"restaurant", "pharmacy", "toilets", "cafe"}
+
+# =========================
+# Tile math
+# =========================
+def tile_of(lat: float, lon: float, z: int = TILE_ZOOM) -> Tile:
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    x = int(floor((lon + 180.0) / 360.0 * n))
+    y = int(floor((1.0 - asinh(tan(radians(lat))) / pi) / 2.0 * n))
+    return min(n - 1, max(0, x)), min(n - 1, max(0, y))
+
+def tile_bbox(t: Tile, z: int = TILE_ZOOM) -> Tuple[float,float,float,float]:
+    """(south, west, north, east) in degrees."""
+    n = 2 ** z
+    x, y = t
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = degrees(atan(sinh(pi * (1 - 2 * y / n))))
+    south = degrees(atan(sinh(pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+def tiles_for_circle(lat: float, lon: float, radius_m: float, z: int = TILE_ZOOM) -> List[Tile]:
+    dlat = radius_m / 111_320.0
+    dlon = radius_m / (111_320.0 * max(0.05, cos(radians(lat))))
+    x0, y0 = tile_of(lat + dlat, lon - dlon, z)
+    x1, y1 = tile_of(lat - dlat, lon + dlon, z)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+# =========================
+# Merged Overpass query
+# =========================
+def rectangles(tiles: Iterable[Tile]) -> List[Tuple[int,int,int,int]]:
+    """Cover `tiles` exactly with (x0, y0, x1, y1) rectangles: runs of
+    consecutive tiles per row, merged with the row below while it has the
+    same run. A square block is one rectangle; a diagonal corridor is about
+    one per row."""
+    rows: Dict[int, List[int]] = {}
+    for x, y in sorted(set(tiles), key=lambda t: (t[1], t[0])):
+        rows.setdefault(y, []).append(x)
+    out: List[List[int]] = []
+    open_: Dict[Tuple[int,int], List[int]] = {}
+    for y, xs in rows.items():
+        runs, start = [], xs[0]
+        for a, b in zip(xs, xs[1:] + [None]):
+            if b != a + 1:
+                runs.append((start, a)); start = b
+        for x0, x1 in runs:
+            r = open_.get((x0, x1))
+            if r is not None and r[3] == y - 1:
+                r[3] = y
+            else:
+                open_[(x0, x1)] = r = [x0, y, x1, y]
+                out.append(r)
+    return [tuple(r) for r in out]
+
+def tile_query(tiles: Iterable[Tile], z: int = TILE_ZOOM) -> str:
+    sel = []
+    for x0, y0, x1, y1 in rectangles(tiles):
+        s, w = tile_bbox((x0, y1), z)[:2]
+        n, e = tile_bbox((x1, y0), z)[2:]
+        bb = f"{s:.6f},{w:.6f},{n:.6f},{e:.6f}"
+        for k, v in TAGS:
+            sel.append(f'  node({bb})["{k}"="{v}"];')
+            if k == "amenity" and v in _AMENITY_TAGS:
+                sel.append(f'  way({bb})["{k}"="{v}"];')
+                sel.append(f'  relation({bb})["{k}"="{v}"];')
+    return "[out:json][timeout:90];\n(\n" + "\n".join(sel) + "\n);\nout center;\n"
+
+def _rows_by_tile(data: Dict[str,Any], wanted: set, z: int) -> Dict[Tile, List[Row]]:
+    out: Dict[Tile, List[Row]] = {t: [] for t in wanted}
+    for e in data.get("elements", []):
+        tags = e.get("tags", {}) or {}
+        mask = 0
+        for kv in tags.items():
+            mask |= _TAG_BITS.get(kv, 0)
+        plat = e.get("lat"); plon = e.get("lon")
+        if plat is None or plon is None:
+            c = (e.get("center") or {})
+            plat, plon = c.get("lat"), c.get("lon")
+        if not mask or plat is None or plon is None:
+            continue
+        t = tile_of(float(plat), float(plon), z)
+        if t in out:
+            out[t].append([e.get("type", "node"), e.get("id"), float(plat), float(plon),
+                           tags.get("name") or "", tags.get("addr:full", ""), mask])
+    return out
+
+# =========================
+# Store
+# =========================
+class TileStore:
+    """Cached tiles: a process-local LRU with expiry in front of the shared cache."""
+
+    def __init__(self, query: Callable[[str], Dict[str,Any]], cache: Optional[Cache] = None,
+                 z: int = TILE_ZOOM, max_local: int = 2048):
+        self.query = query
+        self.z = z
+        self._cache = cache
+        # tile -> (expires_at, rows)
+        self._local: "OrderedDict[Tile, Tuple[float, List[Row]]]" = OrderedDict()
+        self._max_local = max_local
+        self._inflight: Dict[Tile, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> Cache:
+        return self._cache or get_cache()
+
+    def key(self, t: Tile) -> str:
+        return f"{SOURCE}:v{TAGSET_VERSION}:{self.z}/{t[0]}/{t[1]}"
+
+    def _remember(self, t: Tile, rows: List[Row], ttl_s: float):
+        with self._lock:
+            self._local[t] = (time.time() + ttl_s, rows)
+            self._local.move_to_end(t)
+            while len(self._local) > self._max_local:
+                self._local.popitem(last=False)
+
+    def _local_rows(self, t: Tile) -> Optional[List[Row]]:
+        with self._lock:
+            hit = self._local.get(t)
+            if hit is None:
+                return None
+            if hit[0] <= time.time():
+                del self._local[t]
+                return None
+            self._local.move_to_end(t)
+            return hit[1]
+
+    def _cached(self, t: Tile) -> Tuple[Optional[List[Row]], bool]:
+        """(rows, fresh); rows is None if the tile was never fetched or expired."""
+        rows = self._local_rows(t)
+        if rows is not None:
+            return rows, True
+        hit = self.cache.peek(self.key(t), SOURCE)
+        if hit is None:
+            return None, False
+        if hit[1] > 0:
+            self._remember(t, hit[0], hit[1])  # no longer than the shared copy stays fresh
+        return hit[0], hit[1] > 0
+
+    def rows(self, tiles: List[Tile]) -> Dict[Tile, List[Row]]:
+        """Rows per tile; unavailable tiles (upstream failure) are left out."""
+        got: Dict[Tile, List[Row]] = {}
+        missing = []
+        stale: Dict[Tile, List[Row]] = {}
+        for t in tiles:
+            rows, fresh = self._cached(t)
+            if fresh:
+                got[t] = rows
+            else:
+                missing.append(t)
+                if rows is not None:
+                    stale[t] = rows  # refetched below; kept in case that fails
+        if not missing:
+            return got
+        # claim the missing tiles nobody else is fetching; wait for the rest
+        with self._lock:
+            mine = [t for t in missing if t not in self._inflight]
+            theirs = [(t, self._inflight[t]) for t in missing if t in self._inflight]
+            for t in mine:
+                self._inflight[t] = threading.Event()
+        try:
+            batches = [mine[i:i + MAX_TILES_PER_QUERY] for i in range(0, len(mine), MAX_TILES_PER_QUERY)]
+            if len(batches) == 1:
+                got.update(self._fetch(batches[0]))
+            elif batches:
+                with ThreadPoolExecutor(max_workers=min(len(batches), MAX_PARALLEL_QUERIES),
+                                        thread_name_prefix="rf-tiles") as pool:
+                    for out in pool.map(lambda fn: fn(), [run_in_context(self._fetch, b) for b in batches]):
+                        got.update(out)
+        finally:
+            with self._lock:
+                for t in mine:
+                    self._inflight.pop(t).set()
+        for t, ev in theirs:
+            ev.wait(120)
+            rows = self._local_rows(t)
+            if rows is not None:
+                got[t] = rows
+        unfetched = [t for t in stale if t not in got]
+        if unfetched:
+            fallback("overpass-tile-stale", detail=f"{len(unfetched)} tiles")
+            for t in unfetched:
+                got[t] = stale[t]
+        return got
+
+    def _fetch(self, batch: List[Tile]) -> Dict[Tile, List[Row]]:
+        try:
+            with span("overpass_tiles", tiles=len(batch)):
+                data = self.query(tile_query(batch, self.z))
+        except Exception as e:
+            fallback("overpass", e)
+            return {}
+        out = _rows_by_tile(data, set(batch), self.z)
+        ttl_s = self.cache.policy(SOURCE)[0]
+        for t, rows in out.items():
+            self.cache.put(self.key(t), SOURCE, rows)
+            self._remember(t, rows, ttl_s)
+        return out
+
+    def _matching(self, tiles: List[Tile], mask: int, nodes_only: bool) -> List[Row]:
+        return [r for rs in self.rows(tiles).values() for r in rs
+                if r[6] & mask and (not nodes_only or r[0] == "node")]
+
+    def _within(self, lat: float, lon: float, radius_m: float, mask: int,
+                nodes_only: bool, limit: Optional[int]) -> List[Row]:
+        rows = self._matching(tiles_for_circle(lat, lon, radius_m, self.z), mask, nodes_only)
+        if not rows:
+            return []
+        d = haversine_to((lat, lon), [r[2] for r in rows], [r[3] for r in rows]) * 1000.0
+        order = [i for i in np.argsort(d, kind="stable") if d[i] <= radius_m]
+        return [rows[i] for i in order[:limit]]
+
+    def places(self, lat: float, lon: float, radius_m: int, kind: str, limit: Optional[int] = None) -> List[Dict[str,Any]]:
+        """Same rows as `overpass_places`' per-kind query, nearest first."""
+        mask = KIND_MASKS.get(kind, KIND_MASKS["attraction"])
+        return [_place(r, kind, "Unnamed") for r in self._within(lat, lon, radius_m, mask, True, limit)]
+
+    def amenity(self, lat: float, lon: float, radius_m: int, amenity: str, limit: Optional[int] = 150) -> List[Dict[str,Any]]:
+        mask = amenity_mask(amenity)
+        if not mask:
+            return []
+        return [_place(r, "specific", amenity.title()) for r in
+                self._within(lat, lon, radius_m, mask, False, limit)]
+
+    def _along(self, corridor, mask: int, nodes_only: bool, limit: Optional[int]) -> List[Row]:
+        rows = self._matching(corridor.tiles(self.z), mask, nodes_only)
+        if not rows:
+            return []
+        order, _ = corridor.select([r[2] for r in rows], [r[3] for r in rows], limit)
+        return [rows[i] for i in order]
+
+    def places_along(self, corridor, kind: str, limit: Optional[int] = None) -> List[Dict[str,Any]]:
+        """`places` for a route corridor: smallest detour first."""
+        mask = KIND_MASKS.get(kind, KIND_MASKS["attraction"])
+        return [_place(r, kind, "Unnamed") for r in self._along(corridor, mask, True, limit)]
+
+    def amenity_along(self, corridor, amenity: str, limit: Optional[int] = 150) -> List[Dict[str,Any]]:
+        mask = amenity_mask(amenity)
+        if not mask:
+            return []
+        return [_place(r, "specific", amenity.title()) for r in self._along(corridor, mask, False, limit)]
+
+def _place(r: Row, category: str, default_name: str) -> Dict[str,Any]:
+    return {"name": r[4] or default_name, "lat": r[2], "lon": r[3], "category": category,
+            "address": r[5], "url": f"https://www.openstreetmap.org/{r[0]}/{r[1]}"}